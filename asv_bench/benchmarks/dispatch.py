@@ -0,0 +1,78 @@
+"""
+Benchmarks for the per-call overhead of grid operations on small arrays.
+
+For per-column or per-profile calls, the time spent finding the axis and
+position of the data and wrapping the result can exceed the compute. Run
+with ``asv run`` from the ``asv_bench`` directory, or directly with
+``python -m benchmarks.dispatch`` for the overhead of each call compared to
+the raw kernel.
+"""
+from __future__ import print_function, division
+
+import timeit
+import numpy as np
+import xarray as xr
+
+from xgcm import Grid
+from xgcm.duck_array_ops import _boundary_edge, _neighbor_stencil
+from xgcm.grid import raw_interp_function
+
+
+def _small_dataset(nx):
+    ds = xr.Dataset(coords={
+        'XC': ('XC', np.arange(nx) + 0.5, {'axis': 'X'}),
+        'XG': ('XG', np.arange(nx) * 1., {'axis': 'X',
+                                          'c_grid_axis_shift': -0.5}),
+        'YC': ('YC', np.arange(4) + 0.5, {'axis': 'Y'}),
+        'YG': ('YG', np.arange(4) * 1., {'axis': 'Y',
+                                         'c_grid_axis_shift': -0.5}),
+        'ZC': ('ZC', np.arange(4) + 0.5, {'axis': 'Z'}),
+        'ZG': ('ZG', np.arange(4) * 1., {'axis': 'Z',
+                                         'c_grid_axis_shift': -0.5})})
+    ds['T'] = ('XC', np.random.rand(nx))
+    return ds
+
+
+class Dispatch(object):
+    params = [[10, 1000]]
+    param_names = ['nx']
+
+    def setup(self, nx):
+        self.ds = _small_dataset(nx)
+        self.grid = Grid(self.ds, periodic=False)
+        self.da = self.ds.T
+
+    def time_kernel(self, nx):
+        # the compute alone, without any dispatch or wrapping
+        data = self.da.data
+        _neighbor_stencil(data, 0, raw_interp_function,
+                          left_edge=_boundary_edge(data, 0, left=True,
+                                                   boundary='extend'))
+
+    def time_grid_interp(self, nx):
+        self.grid.interp(self.da, 'X', boundary='extend')
+
+    def time_grid_diff(self, nx):
+        self.grid.diff(self.da, 'X', boundary='extend')
+
+    def time_grid_cumsum(self, nx):
+        self.grid.cumsum(self.da, 'X', boundary='fill')
+
+    def time_axis_interp(self, nx):
+        self.grid.axes['X'].interp(self.da, boundary='extend')
+
+
+if __name__ == '__main__':
+    bench = Dispatch()
+    for nx in Dispatch.params[0]:
+        bench.setup(nx)
+        number = 2000
+        times = {}
+        for name in ['time_kernel', 'time_grid_interp', 'time_grid_diff',
+                     'time_grid_cumsum', 'time_axis_interp']:
+            times[name] = min(timeit.repeat(
+                lambda: getattr(bench, name)(nx), number=number,
+                repeat=5)) / number
+            print('nx=%5d %-18s %8.1f us (overhead %8.1f us)'
+                  % (nx, name, 1e6 * times[name],
+                     1e6 * (times[name] - times['time_kernel'])))
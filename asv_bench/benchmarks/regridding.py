@@ -0,0 +1,46 @@
+"""
+Benchmarks for vertical regridding to tracer coordinates.
+
+Run with ``asv run`` from the ``asv_bench`` directory, or directly with
+``python -m benchmarks.regridding`` for a quick comparison of the numpy and
+dask versions.
+"""
+from __future__ import print_function, division
+
+import timeit
+import numpy as np
+import xarray as xr
+
+from xgcm.regridding import regrid_vertical, _regrid_vertical
+
+
+class RegridVertical(object):
+    params = [[50, 200]]
+    param_names = ['nx']
+
+    def setup(self, nx):
+        nz = 50
+        self.q = np.random.rand(nz, nx, nx)
+        self.tr = np.random.rand(nz, nx, nx).cumsum(axis=0)
+        self.trlevs = np.linspace(0, self.tr.max(), 41)
+        self.qdarr = xr.DataArray(self.q, dims=['Z', 'YC', 'XC'],
+                                  name='q').chunk({'YC': nx // 4})
+        self.trdarr = xr.DataArray(self.tr, dims=['Z', 'YC', 'XC'],
+                                   name='rho').chunk({'YC': nx // 4})
+
+    def time_vectorized(self, nx):
+        _regrid_vertical(self.q, self.tr, self.trlevs)
+
+    def time_dask(self, nx):
+        regrid_vertical(self.qdarr, self.trdarr, self.trlevs,
+                        'Z').compute()
+
+
+if __name__ == '__main__':
+    bench = RegridVertical()
+    for nx in RegridVertical.params[0]:
+        bench.setup(nx)
+        for name in ['time_vectorized', 'time_dask']:
+            t = min(timeit.repeat(lambda: getattr(bench, name)(nx),
+                                  number=1, repeat=3))
+            print('nx=%4d %-16s %8.4f s' % (nx, name, t))
@@ -1,3 +1,4 @@
 __version__ = "0.1.0"
 from .grid import Grid, Axis
 from .autogenerate import generate_grid_ds
+from .mdsxray import open_mdsdataset
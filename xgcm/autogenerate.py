@@ -1,6 +1,9 @@
 from __future__ import print_function
 from future.utils import iteritems
-from xgcm.grid import Axis, raw_interp_function
+from collections import OrderedDict
+from xgcm.grid import Axis, raw_interp_function, _replace_dims
+from xgcm.duck_array_ops import (_axis_slice, _halo_stencil, _is_dask_array,
+                                 _pad_axes)
 import xarray as xr
 
 
@@ -58,23 +61,9 @@ def generate_axis(ds,
     # desired position
     relative_pos_to = _position_to_relative(pos_from, pos_to)
 
-    if (boundary_discontinuity is not None) and (pad is not None):
-        raise RuntimeError('Coordinate cannot be wrapped and padded at the\
-                            same time')
-    elif (boundary_discontinuity is None) and (pad is not None):
-        if pad == 'auto':
-            fill_value = _auto_pad(ds[name], axis_dim, relative_pos_to)
-        else:
-            fill_value = pad
-        periodic = False
-        boundary = 'fill'
-    elif (boundary_discontinuity is not None) and (pad is None):
-        periodic = True
-        fill_value = 0.0
-        boundary = None
-    else:
-        raise RuntimeError('Either "boundary_discontinuity" or "pad" have \
-                            to be specified')
+    periodic, boundary, fill_value = \
+        _boundary_params(ds[name], axis_dim, relative_pos_to,
+                         boundary_discontinuity, pad)
 
     ds = ds.copy()
 
@@ -90,29 +79,16 @@ def generate_axis(ds,
     # propagate to this module.
 
     if attrs_from_scratch:
-        # Input coordinate has to be declared as center,
-        # or xgcm.Axis throws error. Will be rewrapped below.
-        ds[name] = _fill_attrs(ds[name], 'center', axis)
-
-        ax = Axis(ds, axis, periodic=periodic)
-        ds.coords[new_name] = \
-            ax._neighbor_binary_func_raw(ds[name],
-                                         raw_interp_function,
-                                         relative_pos_to,
-                                         boundary=boundary,
-                                         fill_value=fill_value,
-                                         boundary_discontinuity=\
-                                         boundary_discontinuity)
-
-        # Place the correct attributes
-        ds[name] = _fill_attrs(ds[name], pos_from, axis)
-        ds[new_name] = _fill_attrs(ds[new_name], pos_to, axis)
+        ds.coords[name], ds.coords[new_name] = \
+            _generate_dim_coord(ds[name], axis, pos_from, pos_to, new_name,
+                                relative_pos_to, periodic, boundary,
+                                fill_value, boundary_discontinuity)
     else:
         ax = Axis(ds, axis, periodic=periodic)
-        ds.coords[new_name] = ax.interp(ds[name], pos_to, boundary=boundary,
-                                        fill_value=fill_value,
-                                        boundary_discontinuity=\
-                                        boundary_discontinuity)
+        ds.coords[new_name] = _interp_coord(
+            ds[name], [(axis_dim, ax.coords[pos_to], relative_pos_to,
+                        (periodic, boundary, fill_value,
+                         boundary_discontinuity))])
     return ds
 
 
@@ -122,7 +98,8 @@ def generate_grid_ds(ds,
                      position=None,
                      boundary_discontinuity=None,
                      pad='auto',
-                     new_name=None):
+                     new_name=None,
+                     corner_coords=None):
     """
     Add c-grid dimensions and coordinates (optional) to observational Dataset
 
@@ -153,44 +130,193 @@ def generate_grid_ds(ds,
      variable ({dict} e.g. {'z':'auto','latitude':0.0})
     new_name : str, optional
      Name of the inferred grid variable. Defaults to name+'_'+position[1]
+    corner_coords : list, optional
+     Coordinates in ds to generate at the cell corners, i.e. interpolated
+     along every axis of axes_dims_dict they depend on (e.g. longitudes and
+     latitudes at vorticity points). Along the axis of the coordinate in
+     axes_coords_dict, boundary_discontinuity and pad apply as for
+     axes_coords_dict. Along the other axes, the coordinate is wrapped if the
+     dimension is, and extended from its edge values otherwise. The new
+     coordinates are named name+'_corner'.
+
+    Multidimensional coordinates are interpolated in a single pass over the
+    data. For dask arrays the result is lazy and has the chunks of the
+    original coordinate.
     """
 
-    if axes_coords_dict is not None:
-        combo_dict = [axes_dims_dict, axes_coords_dict]
+    # the dimensions are generated first, so that the multidimensional
+    # coordinates can be interpolated onto them. All new coordinates are
+    # assigned at once, without copying the dataset for every coordinate.
+    dim_coords = OrderedDict()
+    # the generated dimension of every axis
+    new_dims = {}
+    for ax, dim in iteritems(axes_dims_dict):
+        pos_from, pos_to, relative_pos_to, params = \
+            _parse_generate_params(ds[dim], dim, dim, ax, position,
+                                   boundary_discontinuity, pad)
+        name_new = new_name if new_name is not None else dim+'_'+pos_to
+        dim_coords[dim], dim_coords[name_new] = \
+            _generate_dim_coord(ds[dim], ax, pos_from, pos_to, name_new,
+                                relative_pos_to, *params)
+        new_dims[ax] = name_new
+    ds = ds.assign_coords(**dim_coords)
+
+    if axes_coords_dict is None:
+        axes_coords_dict = {}
+    if not (axes_coords_dict or corner_coords):
+        return ds
+
+    coords = OrderedDict()
+    for ax, name in iteritems(axes_coords_dict):
+        stencil = _coord_stencil(ds, name, ax, axes_dims_dict, new_dims,
+                                 position, boundary_discontinuity, pad)
+        name_new = (new_name if new_name is not None else
+                    name+'_'+_parse_position(position, ax)[1])
+        coords[name_new] = _interp_coord(ds[name], [stencil])
+
+    for name in corner_coords or []:
+        # the axis of the coordinate itself is interpolated first
+        own_axes = [ax for ax, coord in iteritems(axes_coords_dict)
+                    if coord == name]
+        stencils = [_coord_stencil(ds, name, ax, axes_dims_dict, new_dims,
+                                   position, boundary_discontinuity, pad,
+                                   own_axis=ax in own_axes)
+                    for ax in own_axes + [ax for ax in axes_dims_dict
+                                          if ax not in own_axes]
+                    if axes_dims_dict[ax] in ds[name].dims]
+        coords[name+'_corner'] = _interp_coord(ds[name], stencils)
+    return ds.assign_coords(**coords)
+
+
+def _parse_generate_params(da, name, axis_dim, axis, position,
+                           boundary_discontinuity, pad):
+    """Returns pos_from, pos_to, relative_pos_to and the boundary
+    parameters (periodic, boundary, fill_value, boundary_discontinuity)
+    for one coordinate of generate_grid_ds"""
+    pos_from, pos_to = _parse_position(position, axis)
+    relative_pos_to = _position_to_relative(pos_from, pos_to)
+    is_discontinous = _parse_boundary_params(boundary_discontinuity, name)
+    is_padded = _parse_boundary_params(pad, name)
+    periodic, boundary, fill_value = \
+        _boundary_params(da, axis_dim, relative_pos_to, is_discontinous,
+                         is_padded)
+    return (pos_from, pos_to, relative_pos_to,
+            (periodic, boundary, fill_value, is_discontinous))
+
+
+def _coord_stencil(ds, name, axis, axes_dims_dict, new_dims, position,
+                   boundary_discontinuity, pad, own_axis=True):
+    """Returns (dim, new_coord, relative_pos_to, boundary parameters) to
+    interpolate the coordinate ds[name] along axis (see _interp_coord).
+    Along axes other than its own, a coordinate is wrapped (without
+    discontinuity) if the dimension is wrapped, and extended from its edge
+    values otherwise"""
+    dim = axes_dims_dict[axis]
+    if own_axis:
+        _, _, relative_pos_to, params = \
+            _parse_generate_params(ds[name], name, dim, axis, position,
+                                   boundary_discontinuity, pad)
     else:
-        combo_dict = [axes_dims_dict]
-
-    for di, dd in enumerate(combo_dict):
-        if di == 0:
-            attrs_from_scratch = True
-            infer_dim = False
-        elif di == 1:
-            attrs_from_scratch = False
-            infer_dim = True
-
-        for ax in dd.keys():
-            # Get variable name
-            ax_v = dd[ax]
-            # Get dimension name
-            if infer_dim:
-                ax_d = axes_dims_dict[ax]
-            else:
-                ax_d = ax_v
-
-            # Parse position
-            pos_from, pos_to = _parse_position(position, ax)
-            # Pass wrap characteristics
-            is_discontinous = _parse_boundary_params(boundary_discontinuity,
-                                                    ax_v)
-            # Pass pad characteristics
-            is_padded = _parse_boundary_params(pad, ax_v)
-            ds = generate_axis(ds, ax, ax_v, ax_d,
-                               pos_from=pos_from, pos_to=pos_to,
-                               boundary_discontinuity=is_discontinous,
-                               pad=is_padded,
-                               new_name=new_name,
-                               attrs_from_scratch=attrs_from_scratch)
-    return ds
+        pos_from, pos_to = _parse_position(position, axis)
+        relative_pos_to = _position_to_relative(pos_from, pos_to)
+        if _parse_boundary_params(boundary_discontinuity, dim) is not None:
+            params = (True, None, 0.0, None)
+        else:
+            # a single extrapolated value doesn't fit a coordinate that
+            # varies along the other dimensions
+            params = (False, 'extend', None, None)
+    return dim, ds[new_dims[axis]], relative_pos_to, params
+
+
+def _interp_coord(da, stencils):
+    """Returns the coordinate da interpolated along several dimensions in a
+    single pass. stencils holds (dim, new_coord, relative_pos_to, (periodic,
+    boundary, fill_value, boundary_discontinuity)) for every dimension, in
+    order. Dask arrays are interpolated lazily, chunk by chunk, with the
+    boundary conditions applied inside the kernel"""
+    data = da.data
+    ndim = data.ndim
+    halos = []
+    pads = []
+    for dim, _, relative_pos_to, params in stencils:
+        periodic, boundary, fill_value, boundary_discontinuity = params
+        if periodic:
+            boundary = 'periodic'
+        elif boundary != 'extend':
+            boundary = 'fill'
+        if not periodic:
+            boundary_discontinuity = None
+        axis_num = da.get_axis_num(dim)
+        halos.append((axis_num, relative_pos_to,
+                      {'periodic': 'periodic',
+                       'extend': 'nearest'}.get(boundary, fill_value),
+                      boundary_discontinuity))
+        pads.append((axis_num, relative_pos_to == 'left',
+                     relative_pos_to == 'right', boundary, fill_value,
+                     boundary_discontinuity))
+
+    if _is_dask_array(data):
+        data_new = _halo_stencil(data, raw_interp_function, halos)
+    else:
+        # pad all dimensions at once, including the corners
+        data_new = _pad_axes(data, pads)
+        for axis_num, _, _, _ in halos:
+            data_new = raw_interp_function(
+                data_new[_axis_slice(ndim, axis_num, None, -1)],
+                data_new[_axis_slice(ndim, axis_num, 1, None)])
+    return _replace_dims(da, data_new, OrderedDict(
+        (dim, new_coord) for dim, new_coord, _, _ in stencils))
+
+
+def _boundary_params(da, axis_dim, relative_pos_to, boundary_discontinuity,
+                     pad):
+    """Returns periodic, boundary, fill_value.
+    Translate the wrapping or padding of a coordinate into the boundary
+    conditions of an Axis"""
+    if (boundary_discontinuity is not None) and (pad is not None):
+        raise RuntimeError('Coordinate cannot be wrapped and padded at the\
+                            same time')
+    elif (boundary_discontinuity is None) and (pad is not None):
+        if pad == 'auto':
+            fill_value = _auto_pad(da, axis_dim, relative_pos_to)
+        else:
+            fill_value = pad
+        return False, 'fill', fill_value
+    elif (boundary_discontinuity is not None) and (pad is None):
+        return True, None, 0.0
+    else:
+        raise RuntimeError('Either "boundary_discontinuity" or "pad" have \
+                            to be specified')
+
+
+def _generate_dim_coord(da, axis, pos_from, pos_to, new_name,
+                        relative_pos_to, periodic, boundary, fill_value,
+                        boundary_discontinuity):
+    """Returns da_from, da_to.
+    The one dimensional coordinate `da` with the attributes of its position,
+    and the coordinate generated from it at `pos_to`, along a new dimension
+    `new_name`"""
+    # Input coordinate has to be declared as center,
+    # or xgcm.Axis throws error. Will be rewrapped below.
+    # The Axis is built from a dataset with only this coordinate.
+    da = da.copy(deep=False)
+    da.attrs = dict(da.attrs)
+    center = _fill_attrs(da, 'center', axis)
+    ax = Axis(xr.Dataset(coords={center.name: center}), axis,
+              periodic=periodic)
+    data = ax._neighbor_binary_func_raw(center,
+                                        raw_interp_function,
+                                        relative_pos_to,
+                                        boundary=boundary,
+                                        fill_value=fill_value,
+                                        boundary_discontinuity=\
+                                        boundary_discontinuity)
+
+    # Place the correct attributes
+    da_from = _fill_attrs(center, pos_from, axis)
+    da_to = _fill_attrs(xr.DataArray(data, dims=[new_name], name=new_name),
+                        pos_to, axis)
+    return da_from, da_to
 
 
 def _parse_boundary_params(in_val, varname):
@@ -241,27 +367,28 @@ def _position_to_relative(pos_from, pos_to):
 
 
 def _auto_pad(da, dim, relative_pos_to):
-    "infer padding values from data array by linear extrapolation"
-    da_min = da.min().data
-    da_max = da.max().data
+    """infer padding values from data array by linear extrapolation.
+    Only the two outermost slices along dim are read. For dask arrays the
+    padding value is returned as a lazy 0-d array, which is computed along
+    with the padded coordinate"""
     # The difference between values at the top and
     # bottom is used to pad the array. For multidimensional arrays the min
     # difference is chosen. This could lead to undesired results if the
     # depth spacing is spatially irregular
-    min_diff = da.diff(dim).isel(**{dim: 0}).min().data
-    max_diff = da.diff(dim).isel(**{dim: -1}).min().data
 
-    min_ex = da_min - min_diff
-    max_ex = da_max + max_diff
-
-    # TODO: This assumes that the dim is increasing. Build check or option for
+    # TODO: This assumes that the dim is increasing, so that the min (max)
+    # is found in the first (last) slice. Build check or option for
     # decreasing coordinates
-
+    var = da.variable
     if relative_pos_to == 'right':
-        fill_value = max_ex
+        edge = var.isel(**{dim: -1})
+        max_diff = (edge - var.isel(**{dim: -2})).min()
+        fill_value = edge.max() + max_diff
     elif relative_pos_to == 'left':
-        fill_value = min_ex
-    return fill_value
+        edge = var.isel(**{dim: 0})
+        min_diff = (var.isel(**{dim: 1}) - edge).min()
+        fill_value = edge.min() - min_diff
+    return fill_value.data
 
 
 def _fill_attrs(da, pos, axis):
@@ -0,0 +1,210 @@
+"""
+Compute backends for the raw stencil kernels used by :class:`xgcm.Axis` and
+:class:`xgcm.Grid`.
+
+Every backend provides the kernels ``'interp'`` and ``'diff'``, with the
+signature ``f(data_left, data_right)``. The numpy backend is always
+available. The ``'numexpr'`` and ``'numba'`` backends evaluate the kernels
+multithreaded and without intermediate temporaries, and are only used if the
+corresponding package is installed; otherwise xgcm falls back to numpy.
+
+The backend can be selected per call (``grid.interp(da, 'X',
+backend='numexpr')``), per Grid (``Grid(ds, backend='numba')``) or globally
+with :func:`set_backend`.
+"""
+from __future__ import print_function, division
+
+import warnings
+import numpy as np
+
+from .duck_array_ops import _is_dask_array
+
+try:
+    import dask.array as dsa
+except ImportError:
+    pass
+
+_KERNEL_NAMES = ['interp', 'diff']
+
+# loaders return a dict of kernels, or raise ImportError
+_backend_loaders = {}
+_loaded_backends = {}
+# the kernels used for every backend name, with the numpy fallback for
+# backends that are not installed
+_resolved_backends = {}
+_global_backend = {'name': None}
+
+
+def register_backend(name, loader):
+    """
+    Register a new compute backend.
+
+    Parameters
+    ----------
+    name : str
+        The name of the backend
+    loader : function
+        Called without arguments the first time the backend is used. Should
+        return a dict mapping the kernel names (``'interp'``, ``'diff'``) to
+        functions with signature ``f(data_left, data_right)`` operating on
+        numpy arrays, or raise ImportError if the backend is not available.
+    """
+    _backend_loaders[name] = loader
+    _loaded_backends.pop(name, None)
+    _resolved_backends.pop(name, None)
+
+
+def set_backend(name):
+    """
+    Set the compute backend used by default for all grid operations.
+
+    Parameters
+    ----------
+    name : {None, 'numpy', 'numexpr', 'numba'}
+        The name of a registered backend. `None` restores the default
+        (numpy).
+    """
+    if name is not None and name not in _backend_loaders:
+        raise ValueError("Unknown backend '%s'. Available backends are %s."
+                         % (name, sorted(_backend_loaders)))
+    _global_backend['name'] = name
+
+
+def get_backend():
+    """Return the name of the current default compute backend."""
+    return _global_backend['name'] or 'numpy'
+
+
+def available_backends():
+    """Return the names of all backends that can be loaded."""
+    available = []
+    for name in sorted(_backend_loaders):
+        try:
+            _load_backend(name)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def get_kernel(kernel, backend=None):
+    """
+    Return a raw stencil kernel from a compute backend.
+
+    Parameters
+    ----------
+    kernel : {'interp', 'diff'}
+        The name of the kernel
+    backend : str, optional
+        The name of the backend. If not specified, the default backend (see
+        :func:`set_backend`) is used. Falls back to numpy if the backend is
+        not installed, with a warning the first time it is used.
+
+    Returns
+    -------
+    f : function
+        With signature f(data_left, data_right)
+    """
+    if kernel not in _KERNEL_NAMES:
+        raise ValueError("`%s` is not a valid kernel" % kernel)
+    if backend is None:
+        backend = get_backend()
+    if backend not in _backend_loaders:
+        raise ValueError("Unknown backend '%s'. Available backends are %s."
+                         % (backend, sorted(_backend_loaders)))
+    return _resolve_backend(backend)[kernel]
+
+
+def _resolve_backend(name):
+    if name not in _resolved_backends:
+        try:
+            kernels = _load_backend(name)
+        except ImportError as e:
+            warnings.warn("Backend '%s' is not available (%s), falling back "
+                          "to numpy." % (name, e))
+            kernels = _load_backend('numpy')
+        _resolved_backends[name] = kernels
+    return _resolved_backends[name]
+
+
+def _load_backend(name):
+    if name not in _loaded_backends:
+        kernels = _backend_loaders[name]()
+        # dask arrays are handled blockwise by all backends but numpy
+        if name != 'numpy':
+            kernels = {k: _blockwise(f) for k, f in kernels.items()}
+        _loaded_backends[name] = kernels
+    return _loaded_backends[name]
+
+
+def _blockwise(f):
+    """Apply a numpy kernel to the blocks of dask arrays."""
+    def kernel(data_left, data_right):
+        if _is_dask_array(data_left) or _is_dask_array(data_right):
+            data_left = dsa.asarray(data_left)
+            data_right = dsa.asarray(data_right)
+            dtype = f(np.ones(1, data_left.dtype),
+                      np.ones(1, data_right.dtype)).dtype
+            index = tuple(range(max(data_left.ndim, data_right.ndim)))
+            return dsa.blockwise(f, index,
+                                 data_left, index[-data_left.ndim:],
+                                 data_right, index[-data_right.ndim:],
+                                 dtype=dtype, align_arrays=True)
+        return f(data_left, data_right)
+    return kernel
+
+
+def _load_numpy():
+    # import here to avoid circular imports
+    from .grid import raw_interp_function, raw_diff_function
+    return {'interp': raw_interp_function, 'diff': raw_diff_function}
+
+
+def _load_numexpr():
+    import numexpr as ne
+
+    def interp(data_left, data_right):
+        # keep the precision of the inputs, as numpy does
+        half = np.asarray(0.5, dtype=np.result_type(data_left, data_right,
+                                                    0.5))
+        return ne.evaluate('(a + b) * half',
+                           local_dict={'a': data_left, 'b': data_right,
+                                       'half': half})
+
+    def diff(data_left, data_right):
+        return ne.evaluate('b - a', local_dict={'a': data_left,
+                                                'b': data_right})
+
+    return {'interp': interp, 'diff': diff}
+
+
+def _load_numba():
+    import numba
+
+    signatures = ['float32(float32, float32)', 'float64(float64, float64)']
+
+    @numba.vectorize(signatures, target='parallel')
+    def _interp(a, b):
+        return (a + b) * 0.5
+
+    @numba.vectorize(signatures, target='parallel')
+    def _diff(a, b):
+        return b - a
+
+    numpy_kernels = _load_numpy()
+
+    def _with_fallback(ufunc, numpy_kernel):
+        def kernel(data_left, data_right):
+            dtype = np.result_type(data_left, data_right)
+            if dtype not in (np.float32, np.float64):
+                return numpy_kernel(data_left, data_right)
+            return ufunc(data_left, data_right)
+        return kernel
+
+    return {'interp': _with_fallback(_interp, numpy_kernels['interp']),
+            'diff': _with_fallback(_diff, numpy_kernels['diff'])}
+
+
+register_backend('numpy', _load_numpy)
+register_backend('numexpr', _load_numexpr)
+register_backend('numba', _load_numba)
@@ -0,0 +1,253 @@
+"""
+Bounded in-memory caches used to reuse intermediate results across grid
+operations.
+"""
+from __future__ import print_function, division
+
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from .duck_array_ops import _is_dask_array
+
+
+def _sizeof(value):
+    """The number of bytes held by a cached value."""
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(_sizeof(v) for v in value)
+    return 0
+
+
+def data_token(data):
+    """
+    A hashable key identifying the data of an array: the (deterministic)
+    name of dask arrays, or the id of any other array.
+    """
+    if _is_dask_array(data):
+        return ('dask', data.name)
+    return ('id', id(data))
+
+
+def data_reference(data):
+    """
+    A callable returning `data` for as long as it exists, to check that an
+    id from :func:`data_token` still refers to the same array. Arrays that
+    don't support weak references are referenced strongly.
+    """
+    try:
+        return weakref.ref(data)
+    except TypeError:
+        return lambda: data
+
+
+def data_checksum(data):
+    """
+    A hashable key identifying the values of an array, which is the same
+    across processes: the (deterministic) name of dask arrays, or a hash of
+    the contents of any other array.
+    """
+    if _is_dask_array(data):
+        return ('dask', data.name)
+    data = np.ascontiguousarray(data)
+    digest = hashlib.sha1(data.view(np.uint8)).hexdigest()
+    return ('sha1', digest, str(data.dtype), data.shape)
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that evicts the least recently used entries once
+    the total size of its values exceeds `maxbytes`.
+
+    Values are sized by their `nbytes` attribute (summed over tuples and
+    lists); values without it count as zero bytes. A value larger than
+    `maxbytes` is not stored at all.
+    """
+
+    def __init__(self, maxbytes=None):
+        """
+        Create a new cache.
+
+        Parameters
+        ----------
+        maxbytes : int, optional
+            The maximum total size of the cached values. If `None`, the
+            cache is unbounded.
+        """
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return ('<xgcm.cache.LRUCache: %i entries, %i / %s bytes>'
+                % (len(self), self.nbytes, self.maxbytes))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            value, nbytes = self._data.pop(key)
+            # reinsert as the most recently used entry
+            self._data[key] = (value, nbytes)
+            return value
+
+    def __setitem__(self, key, value):
+        nbytes = _sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            if self.maxbytes is not None and nbytes > self.maxbytes:
+                return
+            self._data[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.maxbytes is not None and self.nbytes > self.maxbytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.nbytes -= evicted
+
+    def __delitem__(self, key):
+        with self._lock:
+            self.nbytes -= self._data.pop(key)[1]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __getstate__(self):
+        # caches are not shipped to other processes (e.g. dask workers),
+        # which start with an empty cache of the same size
+        return {'maxbytes': self.maxbytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxbytes'])
+
+
+class DiskCache(object):
+    """
+    A cache of numpy arrays stored as ``.npy`` files in a directory, so that
+    they persist across sessions and can be shared between processes.
+
+    Keys are hashed to file names with their `repr`, so they must only
+    contain values with a deterministic representation (strings, numbers,
+    tuples). Cached arrays are returned memory-mapped and read-only. Once the
+    total size of the files exceeds `maxbytes`, the least recently used files
+    are deleted.
+    """
+
+    def __init__(self, path, maxbytes=None):
+        """
+        Create a new cache, or open an existing one.
+
+        Parameters
+        ----------
+        path : str
+            The directory of the cache. Created if it doesn't exist.
+        maxbytes : int, optional
+            The maximum total size of the cached files. If `None`, the
+            cache is unbounded.
+        """
+        self.path = path
+        self.maxbytes = maxbytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def __repr__(self):
+        return ('<xgcm.cache.DiskCache %r: %i entries, %i / %s bytes>'
+                % (self.path, len(self), self.nbytes, self.maxbytes))
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.npy')
+
+    def _files(self):
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npy'):
+                fname = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(fname)
+                except OSError:
+                    # deleted by another process
+                    continue
+                files.append((stat.st_mtime, stat.st_size, fname))
+        return files
+
+    def __len__(self):
+        return len(self._files())
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size, _ in self._files())
+
+    def __contains__(self, key):
+        return os.path.exists(self._filename(key))
+
+    def get(self, key, default=None):
+        """Return the memory-mapped array for `key`, or `default`."""
+        fname = self._filename(key)
+        try:
+            data = np.load(fname, mmap_mode='r')
+            # the modification time tracks the last use, for eviction
+            os.utime(fname, None)
+        except (IOError, OSError, ValueError):
+            return default
+        return data
+
+    def __setitem__(self, key, data):
+        data = np.asarray(data)
+        if self.maxbytes is not None and data.nbytes > self.maxbytes:
+            return
+        fname = self._filename(key)
+        # write to a temporary file first, so that other processes never
+        # read partially written files
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, data, allow_pickle=False)
+            os.rename(tmpname, fname)
+        except Exception:
+            os.remove(tmpname)
+            raise
+        self._evict()
+
+    def _evict(self):
+        if self.maxbytes is None:
+            return
+        files = sorted(self._files())
+        nbytes = sum(size for _, size, _ in files)
+        for _, size, fname in files:
+            if nbytes <= self.maxbytes:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            nbytes -= size
+
+    def clear(self):
+        for _, _, fname in self._files():
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
@@ -1,5 +1,7 @@
 from __future__ import print_function
 from future.utils import iteritems
+from collections import OrderedDict
+import threading
 import xarray as xr
 
 def assert_valid_comodo(ds):
@@ -14,12 +16,15 @@ def assert_valid_comodo(ds):
     assert True
 
 
+# the positions of the axes inferred for each signature of dimensions (see
+# _dims_signature), shared by all datasets of the same structure
+_AXES_CACHE = OrderedDict()
+_AXES_CACHE_SIZE = 256
+_axes_cache_lock = threading.Lock()
+
+
 def get_all_axes(ds):
-    axes = set()
-    for d in ds.dims:
-        if 'axis' in ds[d].attrs:
-            axes.add(ds[d].attrs['axis'])
-    return axes
+    return set(_infer_axes(ds))
 
 
 def get_axis_coords(ds, axis_name):
@@ -36,13 +41,175 @@ def get_axis_coords(ds, axis_name):
     coord_name : list
         The names of the coordinate matching that axis
     """
+    return [d for d, _, axis, _ in _dims_signature(ds) if axis == axis_name]
+
+
+def get_axis_positions(ds, axis_name):
+    """Find the coordinates of a comodo axis and their positions.
+
+    Parameters
+    ----------
+    ds : xarray.dataset or xarray.dataarray
+    axis_name : str
+        The name of the axis to find (e.g. 'X')
+
+    Returns
+    -------
+    positions : OrderedDict
+        The name of the coordinate at every position of the axis ('center'
+        first, then 'left', 'right', 'inner' or 'outer'). A new mapping is
+        returned on every call.
+    """
+    positions = _infer_axes(ds).get(axis_name)
+    if positions is None:
+        # didn't find anything for this axis
+        raise ValueError("Couldn't find any coordinates for axis %s"
+                         % axis_name)
+    return _check_positions(positions)
+
+
+class _InvalidAxis(object):
+    """The reason why the positions of an axis couldn't be inferred."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def _check_positions(positions):
+    """
+    A copy of the positions of an axis inferred by _axis_positions, which
+    are shared through the cache. Raise the error found when inferring them
+    instead for invalid axes.
+    """
+    if isinstance(positions, _InvalidAxis):
+        raise ValueError(positions.message)
+    return OrderedDict(positions)
+
 
-    coord_names = []
+def _dims_signature(ds):
+    """
+    A cheap, hashable description of the dimensions of ds: the name, length
+    and comodo attributes (axis and c_grid_axis_shift) of every dimension.
+    """
+    coords = ds.coords
+    sizes = ds.sizes
+    signature = []
     for d in ds.dims:
-        axis = ds[d].attrs.get('axis')
-        if axis==axis_name:
-            coord_names.append(d)
-    return coord_names
+        attrs = coords[d].attrs if d in coords else {}
+        shift = attrs.get('c_grid_axis_shift')
+        try:
+            hash(shift)
+        except TypeError:
+            # e.g. single element arrays
+            try:
+                shift = float(shift)
+            except (TypeError, ValueError):
+                shift = repr(shift)
+        signature.append((d, sizes[d], attrs.get('axis'), shift))
+    return tuple(signature)
+
+
+def _infer_axes(ds):
+    """
+    The positions of all comodo axes of ds, inferred in a single pass over
+    its dimensions, as an OrderedDict mapping axis names to the result of
+    _axis_positions. Results are cached by the signature of the dimensions,
+    so that datasets with the same structure are only inferred once. They
+    are shared, and must only be read through _check_positions.
+    """
+    signature = _dims_signature(ds)
+    with _axes_cache_lock:
+        axes = _AXES_CACHE.pop(signature, None)
+        if axes is None:
+            axes = _axes_from_signature(signature)
+        # (re)insert as the most recently used entry
+        _AXES_CACHE[signature] = axes
+        while len(_AXES_CACHE) > _AXES_CACHE_SIZE:
+            _AXES_CACHE.popitem(last=False)
+    return axes
+
+
+def _axes_from_signature(signature):
+    # index every dimension by axis, with its shift and length
+    index = OrderedDict()
+    for d, size, axis, shift in signature:
+        if axis is not None:
+            index.setdefault(axis, []).append((d, shift, size))
+    return OrderedDict((axis, _axis_positions(axis, dims))
+                       for axis, dims in iteritems(index))
+
+
+def _axis_positions(axis_name, dims):
+    """
+    The name of the coordinate at every position of an axis, from the
+    (name, c_grid_axis_shift, length) of its dimensions. For invalid axes,
+    an _InvalidAxis with the error message is returned instead.
+    """
+    # some tortured logic for dealing with malforme c_grid_axis_shift
+    # attributes such as produced by old versions of xmitgcm.
+    # This should be a float (either -0.5 or 0.5)
+    # this function returns that, or True of the attribute is set to
+    # anything at all
+    def _maybe_fix_type(attr):
+        if attr is not None:
+            try:
+                return float(attr)
+            except (TypeError, ValueError):
+                return True
+
+    axis_shift = {name: _maybe_fix_type(shift) for name, shift, _ in dims}
+    coord_len = {name: size for name, _, size in dims}
+
+    # look for the center coord, which is required
+    # this list will potential contain "center" and "face" points
+    coords_without_axis_shift = [name for name, _, _ in dims
+                                 if not axis_shift[name]]
+    if len(coords_without_axis_shift) == 0:
+        return _InvalidAxis("Couldn't find a center coordinate for axis %s"
+                            % axis_name)
+    elif len(coords_without_axis_shift) > 1:
+        return _InvalidAxis("Found two coordinates without "
+                            "`c_grid_axis_shift` attribute for axis %s"
+                            % axis_name)
+    center_coord_name = coords_without_axis_shift[0]
+    # knowing the length of the center coord is key to decoding the other
+    # coords
+    axis_len = coord_len[center_coord_name]
+
+    # now we can start filling in the information about the different coords
+    positions = OrderedDict()
+    positions['center'] = center_coord_name
+
+    # now check the other coords
+    for name, _, _ in dims:
+        if name == center_coord_name:
+            continue
+        shift = axis_shift[name]
+        clen = coord_len[name]
+        if clen == axis_len + 1:
+            positions['outer'] = name
+        elif clen == axis_len - 1:
+            positions['inner'] = name
+        elif shift == -0.5:
+            if clen == axis_len:
+                positions['left'] = name
+            else:
+                return _InvalidAxis("Left coordinate %s has incompatible "
+                                    "length %g (axis_len=%g)"
+                                    % (name, clen, axis_len))
+        elif shift == 0.5:
+            if clen == axis_len:
+                positions['right'] = name
+            else:
+                return _InvalidAxis("Right coordinate %s has incompatible "
+                                    "length %g (axis_len=%g)"
+                                    % (name, clen, axis_len))
+        else:
+            return _InvalidAxis("Coordinate %s has invalid or missing "
+                                "`c_grid_axis_shift` attribute `%s`"
+                                % (name, repr(shift)))
+    return positions
+
 
 def _assert_data_on_grid(da):
     pass
@@ -34,10 +34,431 @@ def _dask_or_eager_func(name, eager_module=np, list_of_args=False,
 insert = _dask_or_eager_func('insert')
 take = _dask_or_eager_func('take')
 concatenate = _dask_or_eager_func('concatenate', list_of_args=True)
+stack = _dask_or_eager_func('stack', list_of_args=True)
 
 
 # my own function
 
+# upper bound (in bytes) on the blocks of input processed at once when
+# applying neighbor functions to padded numpy arrays
+_STENCIL_BLOCK_BYTES = 2**22
+
+def _is_dask_array(data):
+    """Whether `data` is a dask array."""
+    return has_dask and isinstance(data, dsa.Array)
+
+
+def _axis_slice(ndim, axis_num, start=None, stop=None):
+    """A tuple index selecting `start:stop` along `axis_num` only."""
+    index = [slice(None)] * ndim
+    index[axis_num] = slice(start, stop)
+    return tuple(index)
+
+
+def _halo_stencil(data, f, halos):
+    """
+    Apply a neighbor function along one or more axes of a dask array by
+    exchanging a one-cell halo between adjacent chunks.
+
+    This avoids rolling or padding the array, which for data chunked along
+    the axis rebuilds the whole dimension from sliced chunks. Each output
+    chunk only depends on its input chunk plus one cell from each
+    neighboring chunk (including the corner cells when several axes are
+    involved). Cells beyond the edges of the domain are taken from the
+    opposite edge (periodic), from the nearest edge or set to a constant.
+
+    Parameters
+    ----------
+    data : dask.array.Array
+        The data on which to operate
+    f : function
+        With signature f(data_left, data_right)
+    halos : list of tuples
+        ``(axis_num, neighbor, boundary, boundary_discontinuity)`` for every
+        axis along which to apply `f`, in order. `neighbor` is `'left'` to
+        compute ``f(data[i-1], data[i])`` or `'right'` to compute
+        ``f(data[i], data[i+1])``. `boundary` is `'periodic'`, `'nearest'`
+        or a constant fill value, which may be a lazy 0-d dask array. For
+        periodic axes, cells wrapped around the edges of the domain are
+        offset by `boundary_discontinuity` (if not `None`) inside the kernel.
+
+    Returns
+    -------
+    data_new : dask.array.Array
+        Array with the same shape and chunks as `data`
+    """
+
+    ndim = data.ndim
+    depth = {n: 0 for n in range(ndim)}
+    boundary = {n: 'none' for n in range(ndim)}
+    discontinuities = []
+    # lazy fill values are passed to the kernel, which pads the edges of the
+    # domain with them
+    lazy_fills = []
+    fill_values = []
+    for axis_num, neighbor, axis_boundary, discontinuity in halos:
+        if neighbor not in ['left', 'right']:
+            raise ValueError("`neighbor` must be `'left'` or `'right'`")
+        depth[axis_num] = 1
+        if _is_dask_array(axis_boundary):
+            lazy_fills.append(axis_num)
+            fill_values.append(axis_boundary.astype(data.dtype))
+            axis_boundary = 'none'
+        boundary[axis_num] = axis_boundary
+        if axis_boundary == 'periodic' and discontinuity is not None:
+            discontinuities.append((axis_num, discontinuity))
+
+    # the axes whose halos at the edges of the domain are filled with a
+    # constant, and aren't offset by the discontinuities of other axes
+    filled = [axis_num for axis_num, _, axis_boundary, _ in halos
+              if _is_dask_array(axis_boundary) or
+              axis_boundary not in ['periodic', 'nearest']]
+    block_dtype = np.result_type(data.dtype,
+                                 *[np.asarray(d) for _, d in discontinuities])
+
+    def _kernel(block, block_info=None):
+        # offset the halo cells wrapped around the edges of the domain
+        if discontinuities and block_info is not None:
+            location = block_info[0]['chunk-location']
+            num_chunks = block_info[0]['num-chunks']
+            # a copy, which can hold the offset values
+            block = block.astype(block_dtype)
+            for axis_num, discontinuity in discontinuities:
+                index = [slice(None)] * ndim
+                for other in filled:
+                    index[other] = slice(
+                        1 if location[other] == 0 else None,
+                        -1 if location[other] == num_chunks[other] - 1
+                        else None)
+                for halo, edge_chunk, sign in [(0, 0, -1),
+                                               (-1, num_chunks[axis_num] - 1,
+                                                1)]:
+                    if location[axis_num] != edge_chunk:
+                        continue
+                    index[axis_num] = slice(halo, halo + 1 or None)
+                    block[tuple(index)] += sign * discontinuity
+
+        # every block arrives with one halo cell on each side of the axes
+        # in `halos`, which are consumed one axis at a time
+        for axis_num, neighbor, _, _ in halos:
+            middle = block[_axis_slice(ndim, axis_num, 1, -1)]
+            if neighbor == 'left':
+                block = f(block[_axis_slice(ndim, axis_num, None, -2)],
+                          middle)
+            else:
+                block = f(middle, block[_axis_slice(ndim, axis_num, 2, None)])
+        return block
+
+    sample = np.ones(1, dtype=block_dtype)
+    dtype = f(sample, sample).dtype
+    if not lazy_fills:
+        return dsa.map_overlap(_kernel, data, depth=depth, boundary=boundary,
+                               trim=False, chunks=data.chunks, dtype=dtype)
+    overlapped = dsa.overlap.overlap(data, depth=depth, boundary=boundary)
+    for axis_num, fill_value in zip(lazy_fills, fill_values):
+        chunks = list(overlapped.chunks)
+        axis_chunks = list(chunks[axis_num])
+        axis_chunks[0] += 1
+        axis_chunks[-1] += 1
+        chunks[axis_num] = tuple(axis_chunks)
+        overlapped = dsa.map_blocks(_pad_edges, overlapped, fill_value,
+                                    axis_num=axis_num, chunks=tuple(chunks),
+                                    dtype=data.dtype)
+    return dsa.map_blocks(_kernel, overlapped, chunks=data.chunks,
+                          dtype=dtype)
+
+
+def _pad_edges(block, fill_value, axis_num=None, block_info=None):
+    """Pad the blocks at the edges of a dask array along axis_num by one
+    cell of fill_value (see _halo_stencil)."""
+    location = block_info[0]['chunk-location'][axis_num]
+    num_chunks = block_info[0]['num-chunks'][axis_num]
+    edge_shape = list(block.shape)
+    edge_shape[axis_num] = 1
+    edge = np.full(edge_shape, fill_value, dtype=block.dtype)
+    parts = [block]
+    if location == 0:
+        parts.insert(0, edge)
+    if location == num_chunks - 1:
+        parts.append(edge)
+    return np.concatenate(parts, axis=axis_num)
+
+
+def _edge_stencil(data, axis_num, f, left_edge=None, right_edge=None):
+    """
+    Apply a neighbor function along one axis of a dask array, padding it on
+    either side with given edge cells.
+
+    Like :func:`_halo_stencil`, adjacent chunks only exchange a one-cell
+    halo, and the edges are only joined to the chunks at the ends of the
+    axis, so the array is never concatenated along the axis.
+
+    Parameters
+    ----------
+    data : dask.array.Array
+        The data on which to operate
+    axis_num : int
+        The axis along which to apply the function
+    f : function
+        With signature f(data_left, data_right)
+    left_edge, right_edge : array_like, optional
+        The cells just outside the beginning (end) of the array, with length
+        one along `axis_num` and broadcastable against `data` otherwise. If
+        `None`, the array is not padded on that side.
+
+    Returns
+    -------
+    data_new : dask.array.Array
+        Array with length ``len + n_edges - 1`` along `axis_num`, chunked
+        like `data` along the other axes
+    """
+
+    ndim = data.ndim
+    data_chunks = data.chunks[axis_num]
+    num_chunks = len(data_chunks)
+    edge_chunks = list(data.chunks)
+    edge_chunks[axis_num] = (1,)
+    edge_shape = list(data.shape)
+    edge_shape[axis_num] = 1
+    edges = [None if edge is None else
+             dsa.broadcast_to(dsa.asarray(edge),
+                              edge_shape).rechunk(tuple(edge_chunks))
+             for edge in (left_edge, right_edge)]
+
+    def _kernel(block, left, right, block_info=None):
+        location = block_info[0]['chunk-location'][axis_num]
+        # blocks arrive with one cell of each adjacent block. With a left
+        # edge, each output cell is computed by the block holding its right
+        # neighbor and the cells of the next block aren't needed, otherwise
+        # by the block holding its left neighbor.
+        if left is not None:
+            start = None
+            stop = -1 if location < num_chunks - 1 else None
+        else:
+            start = 1 if location > 0 else None
+            stop = None
+        parts = [block[_axis_slice(ndim, axis_num, start, stop)]]
+        if left is not None and location == 0:
+            parts.insert(0, left)
+        if right is not None and location == num_chunks - 1:
+            parts.append(right)
+        padded = np.concatenate(parts, axis=axis_num)
+        return f(padded[_axis_slice(ndim, axis_num, None, -1)],
+                 padded[_axis_slice(ndim, axis_num, 1, None)])
+
+    # the output is chunked like the data, except for the last chunk
+    chunks = list(data.chunks)
+    axis_chunks = list(data_chunks)
+    axis_chunks[-1] += (int(left_edge is not None) +
+                        int(right_edge is not None) - 1)
+    chunks[axis_num] = tuple(axis_chunks)
+    overlapped = dsa.overlap.overlap(
+        data, depth={n: int(n == axis_num) for n in range(ndim)},
+        boundary={n: 'none' for n in range(ndim)})
+    sample = np.ones(1, dtype=np.result_type(
+        data.dtype, *[e.dtype for e in edges if e is not None]))
+    return dsa.map_blocks(_kernel, overlapped, *edges, chunks=tuple(chunks),
+                          dtype=f(sample, sample).dtype)
+
+
+def _pad_axes(data, pads):
+    """
+    Pad a numpy or dask array by one cell on either side of several axes,
+    including the corner cells.
+
+    Numpy arrays are copied once into a preallocated buffer, dask arrays are
+    padded lazily.
+
+    Parameters
+    ----------
+    data : numpy.ndarray or dask.array.Array
+        The data to pad
+    pads : list of tuples
+        ``(axis_num, pad_left, pad_right, boundary, fill_value,
+        boundary_discontinuity)`` for every axis to pad. `boundary` is one
+        of `'periodic'`, `'fill'` or `'extend'`. For periodic axes, the
+        wrapped cells are offset by `boundary_discontinuity` (if not
+        `None`).
+
+    Returns
+    -------
+    padded : numpy.ndarray or dask.array.Array
+    """
+
+    for axis_num, _, _, boundary, _, _ in pads:
+        if boundary not in ['periodic', 'fill', 'extend']:
+            raise ValueError("`boundary` must be `'fill'` or `'extend'`")
+
+    ndim = data.ndim
+
+    def _edge_cells(padded, axis_num, start, stop, boundary, fill_value,
+                    discontinuity):
+        # values of the cells just outside the interior [start, stop)
+        if boundary == 'periodic':
+            left = padded[_axis_slice(ndim, axis_num, stop - 1, stop)]
+            right = padded[_axis_slice(ndim, axis_num, start, start + 1)]
+            if discontinuity is not None:
+                left = left - discontinuity
+                right = right + discontinuity
+        elif boundary == 'extend':
+            left = padded[_axis_slice(ndim, axis_num, start, start + 1)]
+            right = padded[_axis_slice(ndim, axis_num, stop - 1, stop)]
+        else:
+            left = right = fill_value
+        return left, right
+
+    if not _is_dask_array(data):
+        shape = list(data.shape)
+        interior = [slice(None)] * ndim
+        for axis_num, pad_left, pad_right, _, _, _ in pads:
+            shape[axis_num] += int(pad_left) + int(pad_right)
+            interior[axis_num] = slice(int(pad_left),
+                                       int(pad_left) + data.shape[axis_num])
+        padded = np.empty(shape, dtype=data.dtype)
+        padded[tuple(interior)] = data
+        # later axes copy the edges of earlier padding, filling the corners
+        for (axis_num, pad_left, pad_right, boundary, fill_value,
+             discontinuity) in pads:
+            start = int(pad_left)
+            stop = start + data.shape[axis_num]
+            left, right = _edge_cells(padded, axis_num, start, stop,
+                                      boundary, fill_value, discontinuity)
+            if pad_left:
+                padded[_axis_slice(ndim, axis_num, 0, 1)] = left
+            if pad_right:
+                padded[_axis_slice(ndim, axis_num, -1, None)] = right
+        return padded
+
+    for (axis_num, pad_left, pad_right, boundary, fill_value,
+         discontinuity) in pads:
+        left, right = _edge_cells(data, axis_num, 0, data.shape[axis_num],
+                                  boundary, fill_value, discontinuity)
+        edge_shape = list(data.shape)
+        edge_shape[axis_num] = 1
+        edge_chunks = list(data.chunks)
+        edge_chunks[axis_num] = (1,)
+        arrays_to_concat = [data]
+        if pad_left:
+            arrays_to_concat.insert(0, dsa.broadcast_to(
+                left, edge_shape, chunks=edge_chunks).astype(data.dtype))
+        if pad_right:
+            arrays_to_concat.append(dsa.broadcast_to(
+                right, edge_shape, chunks=edge_chunks).astype(data.dtype))
+        data = dsa.concatenate(arrays_to_concat, axis=axis_num)
+    return data
+
+
+def _stencil_chain(data, axis_num, steps):
+    """
+    Apply a sequence of linear two-point stencils along one axis, one after
+    the other.
+
+    Parameters
+    ----------
+    data : numpy.ndarray or dask.array.Array
+        The data on which to operate
+    axis_num : int
+        The axis along which to apply the stencils
+    steps : list of tuples
+        ``(weights, pad_left, pad_right, boundary, fill_value)`` for every
+        stencil, where `weights` are the weights of the left and right
+        neighbors, and the data is padded by one cell on either side
+        according to `boundary` (see :func:`_pad_axes`) before applying it.
+
+    Returns
+    -------
+    data_new : numpy.ndarray or dask.array.Array
+    """
+    ndim = data.ndim
+    for weights, pad_left, pad_right, boundary, fill_value in steps:
+        if pad_left or pad_right:
+            data = _pad_axes(data, [(axis_num, pad_left, pad_right, boundary,
+                                     fill_value, None)])
+        data = (weights[0] * data[_axis_slice(ndim, axis_num, None, -1)] +
+                weights[1] * data[_axis_slice(ndim, axis_num, 1, None)])
+    return data
+
+
+def _fused_stencil(data, axis_num, steps):
+    """
+    Apply a sequence of linear two-point stencils along one axis (see
+    :func:`_stencil_chain`) as a single wider stencil.
+
+    The weights of the stencils are combined, so that the interior of the
+    result is computed in one pass over the data, without intermediate
+    arrays. Periodic chains wrap the data once by the total width of the
+    halo. Otherwise, the few cells affected by the boundary conditions are
+    computed by applying the stencils one by one to thin slabs at the edges
+    of the data.
+
+    Returns
+    -------
+    data_new : numpy.ndarray or dask.array.Array or None
+        `None` if the boundary conditions of the stencils can't be combined.
+    """
+    ndim = data.ndim
+    axis_len = data.shape[axis_num]
+    nsteps = len(steps)
+
+    weights = np.ones(1, dtype=int)
+    pad_left = pad_right = 0
+    boundaries = set()
+    for step_weights, step_left, step_right, boundary, _ in steps:
+        weights = np.convolve(weights, step_weights)
+        pad_left += int(step_left)
+        pad_right += int(step_right)
+        if step_left or step_right:
+            boundaries.add(boundary)
+    new_len = axis_len + pad_left + pad_right - nsteps
+
+    def _apply_weights(padded, length):
+        result = None
+        for offset, weight in enumerate(weights):
+            # taps whose weights cancel are still applied, so that missing
+            # values propagate as they do through the separate stencils
+            term = padded[_axis_slice(ndim, axis_num, offset,
+                                      offset + length)]
+            if weight != 1:
+                term = weight * term
+            result = term if result is None else result + term
+        return result
+
+    if boundaries == set(['periodic']):
+        if max(pad_left, pad_right) > axis_len:
+            return None
+        wrapped = [data[_axis_slice(ndim, axis_num, axis_len - pad_left,
+                                    None)]] if pad_left else []
+        wrapped.append(data)
+        if pad_right:
+            wrapped.append(data[_axis_slice(ndim, axis_num, 0, pad_right)])
+        return _apply_weights(concatenate(wrapped, axis=axis_num), new_len)
+
+    if not boundaries <= set(['fill', 'extend']):
+        return None
+
+    # the slabs must be wide enough that the boundary conditions at the
+    # inner side of the slab don't reach the cells taken from it
+    slab = pad_left + pad_right + 2 * nsteps
+    if axis_len < slab:
+        return _stencil_chain(data, axis_num, steps)
+
+    parts = []
+    if pad_left:
+        edge = _stencil_chain(data[_axis_slice(ndim, axis_num, 0, slab)],
+                              axis_num, steps)
+        parts.append(edge[_axis_slice(ndim, axis_num, 0, pad_left)])
+    parts.append(_apply_weights(data, axis_len - nsteps))
+    if pad_right:
+        edge = _stencil_chain(data[_axis_slice(ndim, axis_num,
+                                               axis_len - slab, None)],
+                              axis_num, steps)
+        parts.append(edge[_axis_slice(ndim, axis_num, -pad_right, None)])
+    if len(parts) == 1:
+        return parts[0]
+    dtype = np.result_type(*[p.dtype for p in parts])
+    return concatenate([p.astype(dtype) for p in parts], axis=axis_num)
+
+
 def _pad_array(da, dim, left=False, boundary=None, fill_value=0.):
     """
     Pad an xarray.DataArray da according to the boundary conditions along dim.
@@ -62,7 +483,7 @@ def _pad_array(da, dim, left=False, boundary=None, fill_value=0.):
         * 'extend': Set values outside the array to the nearest array
           value. (i.e. a limited form of Dirichlet boundary condition.)
 
-    fill_value : float, optional
+    fill_value : float or 0-d dask.array.Array, optional
          The value to use in the boundary condition with `boundary='fill'`.
     """
 
@@ -70,29 +491,391 @@ def _pad_array(da, dim, left=False, boundary=None, fill_value=0.):
         raise ValueError("`boundary` must be `'fill'` or `'extend'`")
 
     axis_num = da.get_axis_num(dim)
+    base_array = da.data
+
+    if not _is_dask_array(base_array):
+        # write straight into a preallocated buffer instead of concatenating
+        edge_value = _boundary_edge(base_array, axis_num, left=left,
+                                    boundary=boundary, fill_value=fill_value)
+        shape = list(base_array.shape)
+        shape[axis_num] += 1
+        padded = np.empty(shape, dtype=base_array.dtype)
+        ndim = base_array.ndim
+        if left:
+            padded[_axis_slice(ndim, axis_num, 0, 1)] = edge_value
+            padded[_axis_slice(ndim, axis_num, 1, None)] = base_array
+        else:
+            padded[_axis_slice(ndim, axis_num, None, -1)] = base_array
+            padded[_axis_slice(ndim, axis_num, -1, None)] = edge_value
+        return padded
+
     shape = list(da.shape)
     shape[axis_num] = 1
 
-    base_array = da.data
     index = slice(0,1) if left else slice(-1, None)
     edge_array = da.isel(**{dim: index}).data
 
-    use_dask = has_dask and isinstance(base_array, dsa.Array)
-
     if boundary == 'extend':
         boundary_array = edge_array
+    elif boundary == 'fill' and _is_dask_array(fill_value):
+        # a lazy fill value (e.g. from xgcm.autogenerate) is not computed
+        boundary_array = dsa.broadcast_to(fill_value.astype(base_array.dtype),
+                                          shape, chunks=edge_array.chunks)
     elif boundary == 'fill':
-        args = shape, fill_value
-        kwargs = {'dtype': base_array.dtype}
-        if use_dask:
-            full_func = dsa.full
-            kwargs['chunks'] = edge_array.chunks
-        else:
-            full_func = np.full
-        boundary_array = full_func(*args, **kwargs)
+        boundary_array = dsa.full(shape, fill_value, dtype=base_array.dtype,
+                                  chunks=edge_array.chunks)
 
     arrays_to_concat = [base_array, boundary_array]
     if left:
         arrays_to_concat.reverse()
 
     return concatenate(arrays_to_concat, axis=axis_num)
+
+
+def _boundary_edge(data, axis_num, left=False, boundary=None, fill_value=0.):
+    """
+    The value of the single cell just outside the boundary of a numpy array,
+    according to the boundary conditions. Returns either a view of the edge
+    of `data` or `fill_value` cast to the dtype of `data`.
+    """
+
+    if boundary not in ['fill', 'extend']:
+        raise ValueError("`boundary` must be `'fill'` or `'extend'`")
+
+    if boundary == 'extend':
+        index = (0, 1) if left else (-1, None)
+        return data[_axis_slice(data.ndim, axis_num, *index)]
+    else:
+        return np.asarray(fill_value, dtype=data.dtype)
+
+
+def _neighbor_stencil(data, axis_num, f, left_edge=None, right_edge=None):
+    """
+    Apply a neighbor function to a numpy array, padding it on either side
+    without making a padded copy.
+
+    The function is applied to the boundary cells and to strided views of
+    the interior neighbor pairs, and the results are written into a single
+    preallocated output array. The interior is processed in blocks along
+    `axis_num`, so that the temporaries created by `f` stay small compared
+    to the output.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The data on which to operate
+    axis_num : int
+        The axis along which to apply the function
+    f : function
+        With signature f(data_left, data_right)
+    left_edge, right_edge : array_like, optional
+        The value of the cell just outside the beginning (end) of the array,
+        broadcastable against a slice of `data` with length one along
+        `axis_num`. If `None`, the array is not padded on that side.
+
+    Returns
+    -------
+    data_new : numpy.ndarray
+        Array with length ``len + n_edges - 1`` along `axis_num`
+    """
+
+    ndim = data.ndim
+    axis_len = data.shape[axis_num]
+
+    if left_edge is None and right_edge is None:
+        return f(data[_axis_slice(ndim, axis_num, None, -1)],
+                 data[_axis_slice(ndim, axis_num, 1, None)])
+
+    edges = {}
+    if left_edge is not None:
+        edges[0] = f(left_edge, data[_axis_slice(ndim, axis_num, 0, 1)])
+    if right_edge is not None:
+        edges[-1] = f(data[_axis_slice(ndim, axis_num, -1, None)], right_edge)
+
+    shape = list(data.shape)
+    shape[axis_num] += len(edges) - 1
+    dtype = np.result_type(*edges.values())
+    data_new = np.empty(shape, dtype=dtype)
+
+    for index, edge in edges.items():
+        stop = index + 1 or None
+        data_new[_axis_slice(ndim, axis_num, index, stop)] = edge
+
+    # offset of the interior in the output
+    offset = 1 if 0 in edges else 0
+    bytes_per_index = max(data.nbytes // max(axis_len, 1), 1)
+    block_len = max(_STENCIL_BLOCK_BYTES // bytes_per_index, 1)
+    for start in range(1, axis_len, block_len):
+        stop = min(start + block_len, axis_len)
+        data_new[_axis_slice(ndim, axis_num, start + offset - 1,
+                             stop + offset - 1)] = \
+            f(data[_axis_slice(ndim, axis_num, start - 1, stop - 1)],
+              data[_axis_slice(ndim, axis_num, start, stop)])
+
+    return data_new
+
+
+def _multi_axis_stencil(padded, f, axis_nums):
+    """
+    Apply a neighbor function along several axes of a padded numpy array in
+    one pass.
+
+    The array is processed in blocks along its first axis, and the function
+    is applied along all axes to each block before moving on to the next,
+    so the intermediate results along the earlier axes stay small compared
+    to the output.
+
+    Parameters
+    ----------
+    padded : numpy.ndarray
+        The data on which to operate, already padded along `axis_nums` (see
+        :func:`_pad_axes`)
+    f : function
+        With signature f(data_left, data_right)
+    axis_nums : list of int
+        The axes along which to apply the function, in order
+
+    Returns
+    -------
+    data_new : numpy.ndarray
+        Array with length ``len - 1`` along `axis_nums`
+    """
+
+    ndim = padded.ndim
+    shape = list(padded.shape)
+    for axis_num in axis_nums:
+        shape[axis_num] -= 1
+    # blocks along the first axis are contiguous
+    halo = int(0 in axis_nums)
+    axis_len = shape[0]
+    bytes_per_index = max(padded.nbytes // max(padded.shape[0], 1), 1)
+    block_len = max(_STENCIL_BLOCK_BYTES // bytes_per_index, 1)
+
+    data_new = None
+    for start in range(0, axis_len, block_len):
+        stop = min(start + block_len, axis_len)
+        block = padded[start:stop + halo]
+        for axis_num in axis_nums:
+            block = f(block[_axis_slice(ndim, axis_num, None, -1)],
+                      block[_axis_slice(ndim, axis_num, 1, None)])
+        if stop - start == axis_len:
+            return block
+        if data_new is None:
+            data_new = np.empty(shape, dtype=block.dtype)
+        data_new[start:stop] = block
+    if data_new is None:
+        sample = np.ones(1, dtype=padded.dtype)
+        data_new = np.empty(shape, dtype=f(sample, sample).dtype)
+    return data_new
+
+
+def _shifted_cumsum(data, axis_num, pad=False, drop=False, reverse=False,
+                    boundary=None, fill_value=0.):
+    """
+    Cumulatively sum a numpy or dask array along `axis_num`, emitting the
+    result directly at a shifted grid position.
+
+    With ``P[m]`` the sum of the first `m` values (``P[0] = 0``), a forward
+    sum returns ``P[1 - pad:]`` and drops the last value if `drop`. A
+    reverse sum works from the end of the axis: with ``Q[m]`` the sum of all
+    values from index `m` on (``Q[N] = 0``), it returns ``Q[drop:]`` and
+    drops the last value if not `pad`. The empty sum (``P[0]`` or ``Q[N]``)
+    is replaced according to the boundary conditions. The output therefore
+    has length ``N + pad - drop``.
+
+    Dask arrays are summed with a local scan of every block followed by a
+    carry-propagation pass over the block totals. The output keeps the input
+    chunks (apart from the last chunk, which changes by ``pad - drop``) and
+    is never padded or concatenated.
+
+    Parameters
+    ----------
+    data : numpy.ndarray or dask.array.Array
+        The data to sum
+    axis_num : int
+        The axis along which to sum
+    pad : bool
+        Whether the output includes a boundary cell
+    drop : bool
+        Whether the output skips one of the partial sums
+    reverse : bool
+        Whether to sum from the end of the axis
+    boundary : {'fill', 'extend'}
+        How to set the boundary cell, if `pad`:
+
+        * 'fill':  Set it to fill_value.
+        * 'extend': Set it to the nearest partial sum.
+
+    fill_value : float, optional
+         The value to use in the boundary condition with `boundary='fill'`.
+
+    Returns
+    -------
+    data_cum : numpy.ndarray or dask.array.Array
+    """
+
+    if pad and boundary not in ['fill', 'extend']:
+        raise ValueError("`boundary` must be `'fill'` or `'extend'`")
+
+    ndim = data.ndim
+    dtype = np.cumsum(np.zeros(1, dtype=data.dtype)).dtype
+    # xarray skips NaNs in cumulative sums of floats
+    cumsum_func = np.nancumsum if dtype.kind in 'fc' else np.cumsum
+    sum_func = np.nansum if dtype.kind in 'fc' else np.sum
+
+    flip = tuple(slice(None, None, -1) if n == axis_num else slice(None)
+                 for n in range(ndim))
+
+    # the window of partial sums returned by the first and last blocks
+    start = int(drop) if reverse else 1 - int(pad)
+    end_extra = int(pad) - int(drop)
+
+    def _scan_block(block, carry, first, last):
+        # all partial sums including both ends of the block, shifted by the
+        # carry from the preceding (or, in reverse, following) blocks
+        shape = list(block.shape)
+        shape[axis_num] += 1
+        sums = np.empty(shape, dtype=dtype)
+        if reverse:
+            sums[_axis_slice(ndim, axis_num, -1, None)] = 0
+            partial = sums[_axis_slice(ndim, axis_num, None, -1)]
+            # sum reversed views, without flipping the data
+            cumsum_func(block[flip], axis=axis_num, out=partial[flip])
+        else:
+            sums[_axis_slice(ndim, axis_num, 0, 1)] = 0
+            partial = sums[_axis_slice(ndim, axis_num, 1, None)]
+            cumsum_func(block, axis=axis_num, out=partial)
+        if carry is not None:
+            sums += carry
+
+        block_len = block.shape[axis_num]
+        stop = start + block_len + (end_extra if last else 0)
+        if pad and reverse and last:
+            if boundary == 'extend':
+                sums[_axis_slice(ndim, axis_num, -1, None)] = \
+                    sums[_axis_slice(ndim, axis_num, -2, -1)]
+            else:
+                sums[_axis_slice(ndim, axis_num, -1, None)] = fill_value
+        elif pad and not reverse and first:
+            if boundary == 'extend':
+                sums[_axis_slice(ndim, axis_num, 0, 1)] = \
+                    sums[_axis_slice(ndim, axis_num, 1, 2)]
+            else:
+                sums[_axis_slice(ndim, axis_num, 0, 1)] = fill_value
+        return sums[_axis_slice(ndim, axis_num, start, stop)]
+
+    if not _is_dask_array(data):
+        return _scan_block(data, None, True, True)
+
+    # carry propagation: prefix sums of the per-block totals
+    total_chunks = list(data.chunks)
+    total_chunks[axis_num] = (1,) * len(data.chunks[axis_num])
+    totals = data.map_blocks(sum_func, axis=axis_num, keepdims=True,
+                             dtype=dtype, chunks=tuple(total_chunks))
+
+    def _exclusive_scan(t):
+        carry = np.zeros_like(t)
+        if reverse:
+            cumsum_func(t[_axis_slice(ndim, axis_num, 1, None)][flip],
+                        axis=axis_num,
+                        out=carry[_axis_slice(ndim, axis_num, None, -1)][flip])
+        else:
+            cumsum_func(t[_axis_slice(ndim, axis_num, None, -1)],
+                        axis=axis_num,
+                        out=carry[_axis_slice(ndim, axis_num, 1, None)])
+        return carry
+
+    carries = totals.rechunk({axis_num: -1}).map_blocks(_exclusive_scan,
+                                                         dtype=dtype)
+    carries = carries.rechunk(tuple(total_chunks))
+
+    nblocks = len(data.chunks[axis_num])
+
+    def _kernel(block, carry, block_info=None):
+        location = block_info[0]['chunk-location'][axis_num]
+        return _scan_block(block, carry, location == 0,
+                           location == nblocks - 1)
+
+    out_chunks = list(data.chunks)
+    out_chunks[axis_num] = (data.chunks[axis_num][:-1] +
+                            (data.chunks[axis_num][-1] + end_extra,))
+    return dsa.map_blocks(_kernel, data, carries, dtype=dtype,
+                          chunks=tuple(out_chunks))
+
+
+def _broadcast_chunks_like(data, other):
+    """
+    Broadcast `data` (with the same number of dimensions) against the dask
+    array `other`, following its chunks and without copying.
+    """
+    data = dsa.asarray(data)
+    data = data.rechunk(tuple(
+        chunks if data.shape[n] == other.shape[n] else -1
+        for n, chunks in enumerate(other.chunks)))
+    return dsa.broadcast_to(data, other.shape, chunks=other.chunks)
+
+
+def _weighted_sum_chunk(data, weights, reduce_axes=()):
+    # the weighted sum and the sum of the weights of all valid cells,
+    # stacked along a new leading axis
+    weighted = data * weights
+    if weighted.dtype.kind in 'fc':
+        valid = ~np.isnan(data)
+        weighted_sum = np.nansum(weighted, axis=reduce_axes, keepdims=True)
+    else:
+        valid = np.ones(data.shape, dtype=bool)
+        weighted_sum = np.sum(weighted, axis=reduce_axes, keepdims=True)
+    weights_sum = np.sum(np.where(valid, weights, 0), axis=reduce_axes,
+                         keepdims=True, dtype=weighted_sum.dtype)
+    return np.stack([weighted_sum, weights_sum])
+
+
+def _weighted_sum(data, weights, axis_nums, average=False):
+    """
+    Sum a numpy or dask array multiplied by weights along several axes.
+    NaNs in `data` are skipped.
+
+    Under dask, every block of `data` is read once to compute both the
+    weighted sum and the sum of the weights, which are then combined in a
+    single tree reduction.
+
+    Parameters
+    ----------
+    data : numpy.ndarray or dask.array.Array
+        The data to sum
+    weights : numpy.ndarray or dask.array.Array
+        The weights. Must have the same number of dimensions as `data` and
+        be broadcastable against it.
+    axis_nums : list of int
+        The axes along which to sum
+    average : bool, optional
+        If ``True``, divide the weighted sum by the sum of the weights of
+        the cells that are not NaN.
+
+    Returns
+    -------
+    data_sum : numpy.ndarray or dask.array.Array
+    """
+    axis_nums = tuple(axis_nums)
+    ndim = data.ndim
+
+    if _is_dask_array(data) or _is_dask_array(weights):
+        data = dsa.asarray(data)
+        weights = _broadcast_chunks_like(weights, data)
+        dtype = np.result_type(data.dtype, weights.dtype)
+        index = tuple(range(1, ndim + 1))
+        partials = dsa.blockwise(_weighted_sum_chunk, (0,) + index,
+                                 data, index, weights, index,
+                                 new_axes={0: 2},
+                                 adjust_chunks={n + 1: 1 for n in axis_nums},
+                                 reduce_axes=axis_nums, dtype=dtype)
+        sums = partials.sum(axis=tuple(n + 1 for n in axis_nums))
+    else:
+        weights = np.broadcast_to(weights, data.shape)
+        sums = _weighted_sum_chunk(data, weights, axis_nums)
+        sums = sums.reshape((2,) + tuple(
+            s for n, s in enumerate(data.shape) if n not in axis_nums))
+
+    if average:
+        return sums[0] / sums[1]
+    return sums[0]
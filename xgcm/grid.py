@@ -1,16 +1,46 @@
 from __future__ import print_function
 from __future__ import absolute_import
-from future.utils import iteritems
+from future.utils import iteritems, string_types
 from collections import OrderedDict
+import itertools
+import json
+import numbers
+import os
+import tempfile
+import threading
 import docrep
 import xarray as xr
 import numpy as np
 
+try:
+    import dask.array as dsa
+except ImportError:
+    pass
+
 from . import comodo
-from .duck_array_ops import _pad_array
+from .backends import get_kernel
+from .cache import LRUCache, DiskCache, data_checksum
+from .lazy import LazyGrid
+from .spec import GridSpec
+from .duck_array_ops import (stack, concatenate, _pad_array, _is_dask_array,
+                             _halo_stencil, _edge_stencil, _pad_axes,
+                             _boundary_edge, _neighbor_stencil,
+                             _multi_axis_stencil, _axis_slice,
+                             _shifted_cumsum, _weighted_sum)
 
 docstrings = docrep.DocstringProcessor(doc_key='My doc string')
 
+# the description of a grid stored with Grid.save
+_GRID_FILE = 'grid.json'
+
+# temporary dimension used to stack Dataset variables
+_STACK_DIM = '_xgcm_variable'
+
+# DataArrays without data, with the dims and coordinates of recent results
+# (see _replace_dims)
+_TEMPLATES = OrderedDict()
+_TEMPLATES_SIZE = 128
+_templates_lock = threading.Lock()
 
 
 class Axis:
@@ -45,7 +75,8 @@ class Axis:
     differentiated by their length.
     """
 
-    def __init__(self, ds, axis_name, periodic=True, default_shifts={}):
+    def __init__(self, ds, axis_name, periodic=True, default_shifts={},
+                 backend=None, positions=None):
         """
         Create a new Axis object from an input dataset.
 
@@ -61,6 +92,13 @@ class Axis:
         default_shifts : dict, optional
             Default mapping from and to grid positions
             (e.g. `{'center': 'left'}`). Will be inferred if not specified.
+        backend : str, optional
+            The compute backend for interpolation and differencing kernels
+            (see :mod:`xgcm.backends`). Defaults to the global default.
+        positions : dict, optional
+            The name of the coordinate at every position of the axis (see
+            :func:`xgcm.comodo.get_axis_positions`). Inferred from `ds` if
+            not specified.
 
 
         REFERENCES
@@ -71,84 +109,20 @@ class Axis:
         self._ds = ds
         self._name = axis_name
         self._periodic = periodic
-
-        # figure out what the grid dimensions are
-        coord_names = comodo.get_axis_coords(ds, axis_name)
-        ncoords = len(coord_names)
-        if ncoords == 0:
-            # didn't find anything for this axis
-            raise ValueError("Couldn't find any coordinates for axis %s"
-                             % axis_name)
-
-        # now figure out what type of coordinates these are:
-        # center, left, right, or outer
-        coords = {name: ds[name] for name in coord_names}
-
-        # some tortured logic for dealing with malforme c_grid_axis_shift
-        # attributes such as produced by old versions of xmitgcm.
-        # This should be a float (either -0.5 or 0.5)
-        # this function returns that, or True of the attribute is set to
-        # anything at all
-        def _maybe_fix_type(attr):
-            if attr is not None:
-                try:
-                    return float(attr)
-                except TypeError:
-                    return True
-
-        axis_shift = {name:
-                          _maybe_fix_type(coord.attrs.get('c_grid_axis_shift'))
-                      for name, coord in coords.items()}
-        coord_len = {name: len(coord) for name, coord in coords.items()}
-
-        # look for the center coord, which is required
-        # this list will potential contain "center" and "face" points
-        coords_without_axis_shift = {name: coord_len[name]
-                                     for name, shift in axis_shift.items()
-                                     if not shift}
-        if len(coords_without_axis_shift) == 0:
-            raise ValueError("Couldn't find a center coordinate for axis %s"
-                             % axis_name)
-        elif len(coords_without_axis_shift) > 1:
-            raise ValueError("Found two coordinates without "
-                             "`c_grid_axis_shift` attribute for axis %s"
-                             % axis_name)
-        center_coord_name = list(coords_without_axis_shift)[0]
-        # knowing the length of the center coord is key to decoding the other
-        # coords
-        axis_len = coord_len[center_coord_name]
-
-        # now we can start filling in the information about the different coords
-        axis_coords = OrderedDict()
-        axis_coords['center'] = coords[center_coord_name]
-
-        # now check the other coords
-        coord_names.remove(center_coord_name)
-        for name in coord_names:
-            shift = axis_shift[name]
-            clen = coord_len[name]
-            if clen == axis_len + 1:
-                axis_coords['outer'] = coords[name]
-            elif clen == axis_len - 1:
-                axis_coords['inner'] = coords[name]
-            elif shift == -0.5:
-                if clen == axis_len:
-                    axis_coords['left'] = coords[name]
-                else:
-                    raise ValueError("Left coordinate %s has incompatible "
-                                     "length %g (axis_len=%g)"
-                                     % (name, clen, axis_len))
-            elif shift == 0.5:
-                if clen == axis_len:
-                    axis_coords['right'] = coords[name]
-                else:
-                    raise ValueError("Right coordinate %s has incompatible "
-                                     "length %g (axis_len=%g)"
-                                     % (name, clen, axis_len))
-            else:
-                raise ValueError("Coordinate %s has invalid or missing "
-                                 "`c_grid_axis_shift` attribute `%s`" %
-                                 (name, repr(shift)))
+        self._backend = backend
+        # set by Grid for axes with connections across the faces of a
+        # multi-face grid (see `Grid(face_connections=...)`)
+        self._facedim = None
+        self._connections = {}
+        self._face_axes = ()
+        self._grid = None
+
+        # figure out what the grid dimensions are, and what type of
+        # coordinates these are: center, left, right, inner or outer
+        if positions is None:
+            positions = comodo.get_axis_positions(ds, axis_name)
+        axis_coords = OrderedDict((pos, ds[name])
+                                  for pos, name in iteritems(positions))
 
         self.coords = axis_coords
 
@@ -167,6 +141,36 @@ class Axis:
                         self._default_shifts[pos] = possible_shift
                         break
 
+    @classmethod
+    def _from_spec(cls, spec, sources, backend=None):
+        """
+        Create an Axis from an :class:`xgcm.spec.AxisSpec`, taking the
+        coordinates from `sources` (a mapping by name) if available.
+        """
+        ax = cls.__new__(cls)
+        ax._ds = None
+        ax._name = spec.name
+        ax._periodic = spec.periodic
+        ax._backend = backend
+        ax._facedim = None
+        ax._connections = {}
+        ax._face_axes = ()
+        ax._grid = None
+
+        ax.coords = OrderedDict()
+        for position, dim, size in spec.coords:
+            coord = sources[dim] if dim in sources else None
+            if coord is None:
+                coord = _DimCoord(dim, size)
+            elif len(coord) != size:
+                raise ValueError("Coordinate %s has length %g, expected %g "
+                                 "for the %s position of axis %s."
+                                 % (dim, len(coord), size, position,
+                                    spec.name))
+            ax.coords[position] = coord
+        ax._default_shifts = dict(spec.default_shifts)
+        return ax
+
     def __repr__(self):
         is_periodic = 'periodic' if self._periodic else 'not periodic'
         summary = ["<xgcm.Axis '%s' %s>" % (self._name, is_periodic)]
@@ -188,7 +192,8 @@ class Axis:
     @docstrings.get_sectionsf('neighbor_binary_func')
     @docstrings.dedent
     def _neighbor_binary_func(self, da, f, to, boundary=None, fill_value=0.0,
-                              boundary_discontinuity=None):
+                              boundary_discontinuity=None,
+                              vector_partner=None):
         """
         Apply a function to neighboring points.
 
@@ -213,6 +218,13 @@ class Axis:
 
         fill_value : float, optional
              The value to use in the boundary condition with `boundary='fill'`.
+        vector_partner : dict, optional
+            If `da` is one component of a vector field on a face-connected
+            grid, a dict mapping the name of the axis of the other component
+            to its DataArray (e.g. `{'Y': ds.V}` for `da=ds.U`). Halos across
+            rotated face edges are then taken from the partner component,
+            with the signs flipped where the orientation reverses. Only used
+            on face-connected axes.
 
         Returns
         -------
@@ -227,7 +239,9 @@ class Axis:
                                                   boundary=boundary,
                                                   fill_value=fill_value,
                                                   boundary_discontinuity=\
-                                                  boundary_discontinuity)
+                                                  boundary_discontinuity,
+                                                  vector_partner=\
+                                                  vector_partner)
         # wrap in a new xarray wrapper
         da_new = self._wrap_and_replace_coords(da, data_new, to)
 
@@ -237,7 +251,71 @@ class Axis:
 
     def _neighbor_binary_func_raw(self, da, f, to, boundary=None,
                                   fill_value=0.0,
-                                  boundary_discontinuity=None):
+                                  boundary_discontinuity=None,
+                                  vector_partner=None):
+
+        if self._connections:
+            if boundary_discontinuity is not None:
+                raise NotImplementedError("`boundary_discontinuity` is not "
+                                          "supported on face-connected axis "
+                                          "%s." % self._name)
+            return self._neighbor_binary_func_faces(da, f, to, boundary,
+                                                    fill_value,
+                                                    vector_partner)
+
+        position_from, dim = self._get_axis_coord(da)
+        transition = (position_from, to)
+
+        data = da.data
+        axis_num = da.get_axis_num(dim)
+
+        if (self._periodic and not boundary and
+            transition in [('center', 'left'), ('right', 'center'),
+                           ('center', 'right'), ('left', 'center')]):
+            neighbor = ('left' if transition in [('center', 'left'),
+                                                 ('right', 'center')]
+                        else 'right')
+            # periodic shifts of chunked dask arrays only need a one-cell
+            # halo from the neighboring chunk, so apply the function
+            # blockwise
+            if _is_dask_array(data):
+                return _halo_stencil(data, f,
+                                     [(axis_num, neighbor, 'periodic',
+                                       boundary_discontinuity)])
+            # numpy arrays only need the wrapped cell from the opposite edge,
+            # offset by the discontinuity
+            if neighbor == 'left':
+                left_edge = data[_axis_slice(data.ndim, axis_num, -1, None)]
+                if boundary_discontinuity is not None:
+                    left_edge = left_edge - boundary_discontinuity
+                return _neighbor_stencil(data, axis_num, f,
+                                         left_edge=left_edge)
+            else:
+                right_edge = data[_axis_slice(data.ndim, axis_num, 0, 1)]
+                if boundary_discontinuity is not None:
+                    right_edge = right_edge + boundary_discontinuity
+                return _neighbor_stencil(data, axis_num, f,
+                                         right_edge=right_edge)
+
+        # numpy arrays are padded by writing only the boundary cells into
+        # the preallocated result, rather than building padded copies
+        if not self._periodic and not _is_dask_array(data):
+            pad_left = transition in [('center', 'outer'), ('inner', 'center'),
+                                      ('center', 'left'), ('right', 'center')]
+            pad_right = transition in [('center', 'outer'),
+                                       ('inner', 'center'),
+                                       ('center', 'right'),
+                                       ('left', 'center')]
+            if pad_left or pad_right:
+                edge_kwargs = dict(boundary=boundary, fill_value=fill_value)
+                left_edge = (_boundary_edge(data, axis_num, left=True,
+                                            **edge_kwargs)
+                             if pad_left else None)
+                right_edge = (_boundary_edge(data, axis_num, **edge_kwargs)
+                              if pad_right else None)
+                return _neighbor_stencil(data, axis_num, f,
+                                         left_edge=left_edge,
+                                         right_edge=right_edge)
 
         # get the two neighboring sets of raw data
         data_left, data_right = \
@@ -253,13 +331,148 @@ class Axis:
 
         return data_new
 
-    def _get_neighbor_data_pairs(self, da, position_to, boundary=None,
-                                 fill_value=0.0, boundary_discontinuity=None):
-        """Returns data_left, data_right.
-        boundary_discontinuity option enables periodic coordinate interpolation
-        (see xgcm.autogenerate)"""
+    def _neighbor_binary_func_faces(self, da, f, to, boundary=None,
+                                    fill_value=0.0, vector_partner=None):
+        """
+        Apply a function to neighboring points on a face-connected axis.
 
+        Instead of stitching the faces together, each face is padded with
+        the one-cell halo it needs from its neighbor face (or from the
+        boundary conditions on unconnected edges), so that the faces can stay
+        in separate chunks.
+        """
         position_from, dim = self._get_axis_coord(da)
+        pad_left, pad_right, boundary = \
+            self._get_neighbor_padding(position_from, to, boundary)
+
+        data = da.data
+        axis_num = da.get_axis_num(dim)
+        face_axis_num = da.get_axis_num(self._facedim)
+        nfaces = data.shape[face_axis_num]
+
+        edges = []
+        for is_left, pad in [(True, pad_left), (False, pad_right)]:
+            if not pad:
+                edges.append(None)
+                continue
+            halos = [self._get_face_halo(da, face, is_left, boundary,
+                                         fill_value, vector_partner)
+                     for face in range(nfaces)]
+            edges.append(concatenate(halos, axis=face_axis_num))
+        left_edge, right_edge = edges
+
+        if _is_dask_array(data):
+            return _edge_stencil(data, axis_num, f, left_edge=left_edge,
+                                 right_edge=right_edge)
+        return _neighbor_stencil(data, axis_num, f, left_edge=left_edge,
+                                 right_edge=right_edge)
+
+    def _get_face_halo(self, da, face, is_left, boundary, fill_value,
+                       vector_partner=None):
+        """
+        The raw data of the cells just outside the left (right) edge of
+        `face`, with length one along the face dimension and this axis.
+
+        Connected edges take the edge cells of the neighbor face, reoriented
+        to the axes of `face`. Values along the edge are matched index by
+        index, in reverse order where the orientation flips.
+        """
+        facedim = self._facedim
+        position_from, dim = self._get_axis_coord(da)
+        axis_num = da.get_axis_num(dim)
+        link = self._connections.get(face, (None, None))[0 if is_left else 1]
+
+        if link is None:
+            face_data = da.data[_axis_slice(da.ndim,
+                                            da.get_axis_num(facedim),
+                                            face, face + 1)]
+            edge = _boundary_edge(face_data, axis_num, left=is_left,
+                                  boundary=boundary, fill_value=fill_value)
+            if edge.ndim == 0:
+                shape = list(face_data.shape)
+                shape[axis_num] = 1
+                full = dsa.full if _is_dask_array(face_data) else np.full
+                edge = full(shape, fill_value, dtype=face_data.dtype)
+            return edge
+
+        neighbor_face, neighbor_axis, reverse = link
+        rotated = neighbor_axis != self._name
+        flipped = rotated != reverse
+        source, sign = self._get_halo_source(da, neighbor_axis, reverse,
+                                             flipped, vector_partner)
+
+        # without reversal, the left edge borders the end of the neighbor
+        _, source_dim = self._grid.axes[neighbor_axis]._get_axis_coord(source)
+        halo = source.variable.isel(**{facedim: neighbor_face,
+                                       source_dim: (-1 if is_left != reverse
+                                                    else 0)})
+
+        other_dims = [d for d in da.dims if d not in (facedim, dim)]
+        if rotated:
+            # the remaining horizontal dim of the source lies along this
+            # axis, and maps onto the orthogonal dim of `da`
+            _, along_dim = self._get_axis_coord(halo)
+            _, ortho_dim = \
+                self._grid.axes[neighbor_axis]._get_axis_coord(da)
+            halo = xr.Variable([ortho_dim if d == along_dim else d
+                                for d in halo.dims], halo.data)
+        else:
+            ortho_dim = self._get_orthogonal_dim(da)
+        if flipped and ortho_dim is not None:
+            halo = halo.isel(**{ortho_dim: slice(None, None, -1)})
+        if sign < 0:
+            halo = -halo
+
+        index = tuple(None if d in (facedim, dim) else slice(None)
+                      for d in da.dims)
+        return halo.transpose(*other_dims).data[index]
+
+    def _get_halo_source(self, da, neighbor_axis, reverse, flipped,
+                         vector_partner=None):
+        """Returns source, sign.
+        The DataArray on the neighbor face from which a halo of `da` is
+        taken, and the sign to apply to it."""
+        if vector_partner is None:
+            return da, 1
+
+        (partner_axis, partner), = iteritems(vector_partner)
+        component_axis = self._get_orthogonal_axis(partner_axis)
+        if component_axis == self._name:
+            # the component along this axis becomes the component along the
+            # neighbor axis, reversed with the orientation
+            target_axis = neighbor_axis
+            sign = -1 if reverse else 1
+        else:
+            target_axis = self._get_orthogonal_axis(neighbor_axis)
+            sign = -1 if flipped else 1
+        source = da if target_axis == component_axis else partner
+        return source, sign
+
+    def _get_orthogonal_axis(self, axis_name):
+        """The other connected axis of a face-connected grid."""
+        others = [name for name in self._face_axes if name != axis_name]
+        if len(others) != 1:
+            raise ValueError("Vector components require exactly two "
+                             "face-connected axes, found %s."
+                             % list(self._face_axes))
+        return others[0]
+
+    def _get_orthogonal_dim(self, da):
+        """The dim of `da` along the other connected axis, if any."""
+        for name in self._face_axes:
+            if name != self._name:
+                try:
+                    return self._grid.axes[name]._get_axis_coord(da)[1]
+                except KeyError:
+                    pass
+        return None
+
+    def _get_neighbor_padding(self, position_from, position_to,
+                              boundary=None):
+        """Returns pad_left, pad_right, boundary.
+        Whether the data needs to be padded on either side to get the
+        neighbors for a transition, and the boundary condition to pad with
+        (`'periodic'` for wrapped padding)."""
 
         valid_positions = ['outer', 'inner', 'left', 'right', 'center']
         if position_to not in valid_positions:
@@ -274,6 +487,41 @@ class Axis:
 
         transition = (position_from, position_to)
 
+        if ((transition == ('outer', 'center')) or
+            (transition == ('center', 'inner'))):
+            return False, False, boundary
+        elif ((transition == ('center', 'outer')) or
+              (transition == ('inner', 'center'))):
+            return True, True, boundary
+        elif ((transition == ('center', 'left')) or
+              (transition == ('right', 'center'))):
+            pad_left, pad_right = True, False
+        elif ((transition == ('center', 'right')) or
+              (transition == ('left', 'center'))):
+            pad_left, pad_right = False, True
+        else:
+            is_periodic = 'periodic' if self._periodic else 'non-periodic'
+            raise NotImplementedError(' to '.join(transition) +
+                                      ' (%s) transition not yet supported.'
+                                      % is_periodic)
+
+        if self._periodic:
+            boundary = 'periodic'
+        return pad_left, pad_right, boundary
+
+    def _get_neighbor_data_pairs(self, da, position_to, boundary=None,
+                                 fill_value=0.0, boundary_discontinuity=None):
+        """Returns data_left, data_right.
+        boundary_discontinuity option enables periodic coordinate interpolation
+        (see xgcm.autogenerate)"""
+
+        position_from, dim = self._get_axis_coord(da)
+
+        # validate the transition
+        self._get_neighbor_padding(position_from, position_to, boundary)
+
+        transition = (position_from, position_to)
+
         if ((transition == ('outer', 'center')) or
             (transition == ('center', 'inner'))):
             # doesn't matter if domain is periodic or not
@@ -303,18 +551,29 @@ class Axis:
         elif (self._periodic and ((transition == ('center', 'left')) or
                                   (transition == ('right', 'center')))):
 
-            left = da.roll(**{dim: 1})
+            # wrap the last cell around to the beginning
+            data = da.data
+            axis_num = da.get_axis_num(dim)
+            wrapped = data[_axis_slice(data.ndim, axis_num, -1, None)]
             if boundary_discontinuity is not None:
-                left = add_to_slice(left, dim, 0, -boundary_discontinuity)
-            left = left.data
-            right = da.data
+                wrapped = wrapped - boundary_discontinuity
+            left = concatenate([wrapped, data[_axis_slice(data.ndim,
+                                                          axis_num,
+                                                          None, -1)]],
+                               axis=axis_num)
+            right = data
         elif (self._periodic and ((transition == ('center', 'right')) or
                                   (transition == ('left', 'center')))):
-            left = da.data
-            right = da.roll(**{dim: -1})
+            # wrap the first cell around to the end
+            data = da.data
+            axis_num = da.get_axis_num(dim)
+            wrapped = data[_axis_slice(data.ndim, axis_num, 0, 1)]
             if boundary_discontinuity is not None:
-                right = add_to_slice(right, dim, -1, boundary_discontinuity)
-            right = right.data
+                wrapped = wrapped + boundary_discontinuity
+            left = data
+            right = concatenate([data[_axis_slice(data.ndim, axis_num,
+                                                  1, None)], wrapped],
+                                axis=axis_num)
         else:
             is_periodic = 'periodic' if self._periodic else 'non-periodic'
             raise NotImplementedError(' to '.join(transition) +
@@ -326,7 +585,8 @@ class Axis:
 
     @docstrings.dedent
     def interp(self, da, to=None, boundary=None, fill_value=0.0,
-               boundary_discontinuity=None):
+               boundary_discontinuity=None, backend=None,
+               vector_partner=None):
         """
         Interpolate neighboring points to the intermediate grid point along
         this axis.
@@ -334,6 +594,10 @@ class Axis:
         Parameters
         ----------
         %(neighbor_binary_func.parameters.no_f)s
+        backend : str, optional
+            The compute backend for the raw kernel (see
+            :mod:`xgcm.backends`). Defaults to the backend of the axis, or
+            the global default.
 
         Returns
         -------
@@ -342,19 +606,24 @@ class Axis:
 
         """
 
-        return self._neighbor_binary_func(da, raw_interp_function, to,
-                                          boundary, fill_value,
-                                          boundary_discontinuity)
+        f = get_kernel('interp', backend or self._backend)
+        return self._neighbor_binary_func(da, f, to, boundary, fill_value,
+                                          boundary_discontinuity,
+                                          vector_partner)
 
     @docstrings.dedent
     def diff(self, da, to=None, boundary=None, fill_value=0.0,
-             boundary_discontinuity=None):
+             boundary_discontinuity=None, backend=None, vector_partner=None):
         """
         Difference neighboring points to the intermediate grid point.
 
         Parameters
         ----------
         %(neighbor_binary_func.parameters.no_f)s
+        backend : str, optional
+            The compute backend for the raw kernel (see
+            :mod:`xgcm.backends`). Defaults to the backend of the axis, or
+            the global default.
 
         Returns
         -------
@@ -362,12 +631,14 @@ class Axis:
             The differenced data
         """
 
-        return self._neighbor_binary_func(da, raw_diff_function, to,
-                                          boundary, fill_value,
-                                          boundary_discontinuity)
+        f = get_kernel('diff', backend or self._backend)
+        return self._neighbor_binary_func(da, f, to, boundary, fill_value,
+                                          boundary_discontinuity,
+                                          vector_partner)
 
     @docstrings.dedent
-    def cumsum(self, da, to=None, boundary=None, fill_value=0.0):
+    def cumsum(self, da, to=None, boundary=None, fill_value=0.0,
+               reverse=False):
         """
         Cumulatively sum a DataArray, transforming to the intermediate axis
         position.
@@ -375,6 +646,9 @@ class Axis:
         Parameters
         ----------
         %(neighbor_binary_func.parameters.no_f)s
+        reverse : bool, optional
+            If `True`, accumulate from the end of the axis (e.g. from the
+            bottom up), without flipping the data.
 
         Returns
         -------
@@ -387,31 +661,29 @@ class Axis:
         if to is None:
             to = self._default_shifts[pos]
 
-        # first use xarray's cumsum method
-        da_cum = da.cumsum(dim=dim)
-
-        boundary_kwargs = dict(boundary=boundary, fill_value=fill_value)
-
-        # now pad / trim the data as necessary
-        # here we enumerate all the valid possible shifts
+        # Whether the output includes a boundary cell (pad) or skips one of
+        # the partial sums (drop). Here we enumerate all the valid possible
+        # shifts. Reverse sums mirror the shifts to the left and right.
         if ((pos == 'center' and to == 'right') or
             (pos == 'left' and to == 'center')):
-            # do nothing, this is the default for how cumsum works
-            data = da_cum.data
+            pad = drop = reverse
         elif ((pos == 'center' and to == 'left') or
               (pos == 'right' and to == 'center')):
-            data = _pad_array(da_cum.isel(**{dim: slice(0, -1)}), dim,
-                              left=True, **boundary_kwargs)
+            pad = drop = not reverse
         elif ((pos == 'center' and to == 'inner') or
               (pos == 'outer' and to == 'center')):
-            data = da_cum.isel(**{dim: slice(0, -1)}).data
+            pad, drop = False, True
         elif ((pos == 'center' and to == 'outer') or
               (pos == 'inner' and to == 'center')):
-            data = _pad_array(da_cum, dim, left=True, **boundary_kwargs)
+            pad, drop = True, False
         else:
             raise ValueError("From `%s` to `%s` is not a valid position "
                              "shift for cumsum operation." % (pos, to))
 
+        data = _shifted_cumsum(da.data, da.get_axis_num(dim), pad=pad,
+                               drop=drop, reverse=reverse, boundary=boundary,
+                               fill_value=fill_value)
+
         da_cum_newcoord = self._wrap_and_replace_coords(da, data, to)
         return da_cum_newcoord
 
@@ -421,26 +693,16 @@ class Axis:
         a new DataArray with a coordinate on position_to.
         """
         position_from, old_dim = self._get_axis_coord(da)
+        new_coord = self._get_position_coord(position_to)
+        return _replace_dims(da, data_new, {old_dim: new_coord})
+
+    def _get_position_coord(self, position):
+        """Return the axis coordinate at `position`."""
         try:
-            new_coord = self.coords[position_to]
+            return self.coords[position]
         except KeyError:
             raise KeyError("Position '%s' was not found in axis.coords."
-                           % position_to)
-        new_dim = new_coord.name
-
-        orig_dims = da.dims
-
-        coords = OrderedDict()
-        dims = []
-        for d in orig_dims:
-            if d == old_dim:
-                dims.append(new_dim)
-                coords[new_dim] = new_coord
-            else:
-                dims.append(d)
-                coords[d] = da.coords[d]
-
-        return xr.DataArray(data_new, dims=dims, coords=coords)
+                           % position)
 
 
     def _get_axis_coord(self, da):
@@ -462,7 +724,9 @@ class Grid:
     independent axes.
     """
 
-    def __init__(self, ds, check_dims=True, periodic=True, default_shifts={}):
+    def __init__(self, ds, check_dims=True, periodic=True, default_shifts={},
+                 backend=None, metrics=None, face_connections=None,
+                 cache_bytes=None, disk_cache=None):
         """
         Create a new Grid object from an input dataset.
 
@@ -481,6 +745,47 @@ class Grid:
         default_shifts : dict
             A dictionary of dictionaries specifying default grid position
             shifts (e.g. `{'X': {'center': 'left', 'left': 'center'}}`)
+        backend : str, optional
+            The compute backend for interpolation and differencing kernels
+            (see :mod:`xgcm.backends`). Defaults to the global default.
+        metrics : dict, optional
+            Specification of the grid metrics (distances, areas and volumes)
+            used in weighted reductions. Maps tuples of axis names to lists
+            of variable names in `ds`, e.g.
+            `{('X',): ['dxC', 'dxG'], ('X', 'Y'): ['rA', 'rAz']}`.
+        face_connections : dict, optional
+            The connectivity of a grid made of several faces (e.g. LLC or
+            cubed-sphere grids), stored along one face dimension of `ds`.
+            Maps the face dimension to a dict of the form
+            `{face: {axis_name: (left_link, right_link)}}`, where `face` is
+            the position of a face along the face dimension and each link is
+            either `None` (an unconnected edge, subject to the boundary
+            conditions) or a tuple `(neighbor_face, neighbor_axis, reverse)`.
+            `neighbor_axis` is the axis of the neighbor face that continues
+            across the edge, and `reverse` whether it runs in the opposite
+            direction. Without reversal, the left edge of a face borders the
+            right edge of its neighbor. Connected axes are not periodic.
+            Both horizontal axes should be listed if any edge is reversed,
+            so that the orthogonal axis can be flipped as well.
+        cache_bytes : int, optional
+            If specified, the results of `interp`, `diff` and `cumsum` on
+            DataArrays are cached, up to a total of `cache_bytes` bytes
+            (least recently used results are evicted first). Repeated calls
+            with the same data and coordinates and the same arguments
+            return the cached result. Numpy data are identified by a
+            checksum of their values, which costs a pass over the data, and
+            dask arrays by their name. Numpy results are copied into and
+            out of the cache, so they can be modified freely. See
+            :meth:`cache_info`.
+        disk_cache : str or xgcm.cache.DiskCache, optional
+            A directory (or :class:`xgcm.cache.DiskCache`, to limit its
+            size) in which the results of `interp`, `diff` and `cumsum` on
+            DataArrays are stored, keyed by the operation, its arguments,
+            the grid and a checksum of the input data (the name of dask
+            arrays). Results found in the cache, also from earlier sessions
+            or other processes, are loaded memory-mapped instead of being
+            recomputed. Results are computed when they are stored, also for
+            dask arrays.
 
         REFERENCES
         ----------
@@ -488,11 +793,13 @@ class Grid:
         """
         self._ds = ds
         self._check_dims = check_dims
+        self._backend = backend
 
-        all_axes = comodo.get_all_axes(ds)
+        # the positions of all axes, inferred in one pass over the dims
+        all_axes = comodo._infer_axes(ds)
 
         self.axes = OrderedDict()
-        for axis_name in all_axes:
+        for axis_name, positions in iteritems(all_axes):
             try:
                 is_periodic = axis_name in periodic
             except TypeError:
@@ -501,8 +808,285 @@ class Grid:
                 axis_default_shifts = default_shifts[axis_name]
             else:
                 axis_default_shifts = {}
-            self.axes[axis_name] = Axis(ds, axis_name, is_periodic,
-                                        default_shifts=axis_default_shifts)
+            self.axes[axis_name] = Axis(
+                ds, axis_name, is_periodic,
+                default_shifts=axis_default_shifts, backend=backend,
+                positions=comodo._check_positions(positions))
+
+        self._set_metrics(metrics, ds)
+        self._set_caches(cache_bytes, disk_cache)
+
+        self._face_connections = None
+        if face_connections is not None:
+            self._assign_face_connections(face_connections)
+
+    @classmethod
+    def from_spec(cls, spec, ds=None, check_dims=True, cache_bytes=None,
+                  disk_cache=None):
+        """
+        Create a Grid from a :class:`xgcm.spec.GridSpec`, without inferring
+        the axes from a dataset.
+
+        Parameters
+        ----------
+        spec : xgcm.spec.GridSpec
+            The description of the grid
+        ds : xarray.Dataset or list of xarray.DataArray, optional
+            Data holding the axis coordinates and metrics of the grid.
+            Axis coordinates that are not found are represented by their
+            dimension only, so that results on those positions have no
+            coordinate values. Metrics whose variables are not found are
+            left out.
+        check_dims, cache_bytes, disk_cache : optional
+            As in :class:`Grid`
+
+        Returns
+        -------
+        grid : xgcm.Grid
+        """
+        sources = _coord_sources(ds)
+        grid = cls.__new__(cls)
+        grid._ds = ds if isinstance(ds, xr.Dataset) else None
+        grid._check_dims = check_dims
+        grid._backend = spec.backend
+
+        grid.axes = OrderedDict()
+        for axis_spec in spec.axes:
+            grid.axes[axis_spec.name] = Axis._from_spec(axis_spec, sources,
+                                                        spec.backend)
+
+        metrics = {}
+        for key, metric_vars in spec.metrics:
+            found = [name for name in metric_vars if name in sources]
+            if found:
+                metrics[key] = found
+        grid._set_metrics(metrics, sources)
+        grid._set_caches(cache_bytes, disk_cache)
+
+        grid._face_connections = None
+        if spec.face_connections is not None:
+            facedim, connections = spec.face_connections
+            grid._attach_face_connections(facedim, dict(
+                (face, dict(links)) for face, links in connections))
+        return grid
+
+    @property
+    def spec(self):
+        """
+        A compact, picklable description of the grid without its data (see
+        :class:`xgcm.spec.GridSpec`).
+        """
+        return GridSpec.from_grid(self)
+
+    def __reduce__(self):
+        # pickle the description of the grid with only its coordinates and
+        # metrics, rather than the full dataset
+        cache_bytes = (self._result_cache.maxbytes
+                       if self._result_cache is not None else None)
+        return (Grid.from_spec, (self.spec, self._grid_dataset(),
+                                 self._check_dims, cache_bytes,
+                                 self._disk_cache))
+
+    def _grid_dataset(self):
+        """A Dataset with only the axis coordinates and metrics."""
+        coords = OrderedDict()
+        for ax in self.axes.values():
+            for coord in ax.coords.values():
+                if isinstance(coord, xr.DataArray):
+                    coords[coord.name] = coord.variable
+        data_vars = OrderedDict()
+        for metric_vars in self._metrics.values():
+            for metric in metric_vars:
+                data_vars[metric.name] = metric.variable
+        return xr.Dataset(data_vars, coords=coords)
+
+    def save(self, path):
+        """
+        Store the grid in a directory, to be reopened quickly with
+        :meth:`load`.
+
+        The description of the grid (see :attr:`spec`) is written as JSON,
+        and the axis coordinates and metrics as ``.npy`` files, which are
+        memory-mapped when the grid is loaded. Metrics held in dask arrays
+        are computed.
+
+        Parameters
+        ----------
+        path : str
+            The directory in which to store the grid. Created if it doesn't
+            exist; a grid stored there before is replaced, including its
+            array files.
+
+        Raises
+        ------
+        ValueError
+            If a coordinate or metric has dtype object, or has attributes
+            that can't be written to JSON. Nothing is written in that case.
+        """
+        ds = self._grid_dataset()
+        arrays = []
+        variables = []
+        for n, (name, var) in enumerate(ds.variables.items()):
+            data = np.asarray(var.values)
+            if data.dtype.kind == 'O':
+                raise ValueError("Can't store variable '%s' with dtype "
+                                 "object. Convert it to a numeric, string "
+                                 "or datetime dtype first." % name)
+            fname = 'variable%i.npy' % n
+            arrays.append((fname, data))
+            variables.append({'name': name, 'dims': list(var.dims),
+                              'attrs': _json_attrs(name, var.attrs),
+                              'coord': name in ds.coords, 'file': fname})
+        meta = {'spec': self.spec.to_dict(), 'check_dims': self._check_dims,
+                'variables': variables}
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        try:
+            with open(os.path.join(path, _GRID_FILE)) as f:
+                old_files = set(var['file']
+                                for var in json.load(f)['variables'])
+        except (IOError, OSError, ValueError, KeyError):
+            old_files = set()
+        # files are replaced rather than overwritten, so that grids loaded
+        # from the old files keep their memory maps
+        for fname, data in arrays:
+            _replace_file(path, fname,
+                          lambda f: np.save(f, data, allow_pickle=False))
+        _replace_file(path, _GRID_FILE,
+                      lambda f: f.write(json.dumps(meta, sort_keys=True)
+                                        .encode('utf-8')))
+        for fname in old_files - set(fname for fname, _ in arrays):
+            try:
+                os.remove(os.path.join(path, fname))
+            except OSError:
+                pass
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Open a grid stored with :meth:`save`, without inferring its axes.
+        The axis coordinates and metrics are memory-mapped.
+
+        Parameters
+        ----------
+        path : str
+            The directory of the stored grid
+        **kwargs
+            Passed to :meth:`from_spec` (e.g. `cache_bytes`)
+
+        Returns
+        -------
+        grid : xgcm.Grid
+        """
+        with open(os.path.join(path, _GRID_FILE)) as f:
+            meta = json.load(f)
+        coords = OrderedDict()
+        data_vars = OrderedDict()
+        for var in meta['variables']:
+            data = np.load(os.path.join(path, var['file']), mmap_mode='r')
+            variables = coords if var['coord'] else data_vars
+            variables[var['name']] = xr.Variable(var['dims'], data,
+                                                 var['attrs'])
+        ds = xr.Dataset(data_vars, coords=coords)
+        kwargs.setdefault('check_dims', meta['check_dims'])
+        return cls.from_spec(GridSpec.from_dict(meta['spec']), ds, **kwargs)
+
+    def _set_metrics(self, metrics, ds):
+        self._metrics = {}
+        # products of metrics, keyed by axes and the dims of the data
+        self._metric_cache = {}
+        # reciprocals of metrics, keyed by axes and the dims and chunks of
+        # the data
+        self._reciprocal_cache = {}
+        if metrics is not None:
+            for key, metric_vars in iteritems(metrics):
+                key = frozenset(key)
+                for axis_name in key:
+                    if axis_name not in self.axes:
+                        raise KeyError("Metric axis '%s' not found in grid "
+                                       "axes %s." % (axis_name,
+                                                     list(self.axes)))
+                for metric_var in metric_vars:
+                    if metric_var not in ds:
+                        raise KeyError("Metric variable '%s' not found in "
+                                       "dataset." % metric_var)
+                    self._metrics.setdefault(key, []).append(ds[metric_var])
+
+    def _set_caches(self, cache_bytes, disk_cache):
+        # results of grid operations, keyed by the operation, its arguments
+        # and the identity of the input data
+        self._result_cache = (LRUCache(cache_bytes)
+                              if cache_bytes is not None else None)
+        if disk_cache is not None and not isinstance(disk_cache, DiskCache):
+            disk_cache = DiskCache(disk_cache)
+        self._disk_cache = disk_cache
+        self._cache_stats = {'hits': 0, 'misses': 0}
+
+    def _assign_face_connections(self, face_connections):
+        """Validate the face connections and attach them to the axes."""
+        if len(face_connections) != 1:
+            raise ValueError("Only one face dimension is supported, found "
+                             "%s." % list(face_connections))
+        (facedim, connections), = iteritems(face_connections)
+        if facedim not in self._ds.dims:
+            raise ValueError("Face dimension '%s' not found in dataset."
+                             % facedim)
+        nfaces = self._ds.sizes[facedim]
+
+        def _check_face(face):
+            if face not in range(nfaces):
+                raise ValueError("Face %r is out of range for face dimension "
+                                 "'%s' of length %i." % (face, facedim,
+                                                         nfaces))
+
+        def _check_axis(axis_name):
+            if axis_name not in self.axes:
+                raise KeyError("Connected axis '%s' not found in grid axes "
+                               "%s." % (axis_name, list(self.axes)))
+
+        face_axes = set()
+        for face, links in iteritems(connections):
+            _check_face(face)
+            for axis_name, edge_links in iteritems(links):
+                _check_axis(axis_name)
+                face_axes.add(axis_name)
+                if len(edge_links) != 2:
+                    raise ValueError("Connections of face %r along axis '%s' "
+                                     "must be a (left, right) pair."
+                                     % (face, axis_name))
+                for link in edge_links:
+                    if link is None:
+                        continue
+                    neighbor_face, neighbor_axis, _ = link
+                    _check_face(neighbor_face)
+                    _check_axis(neighbor_axis)
+                    face_axes.add(neighbor_axis)
+        if len(face_axes) > 2:
+            raise ValueError("At most two axes can be connected across "
+                             "faces, found %s." % sorted(face_axes))
+
+        self._attach_face_connections(facedim, connections)
+
+    def _attach_face_connections(self, facedim, connections):
+        """Attach validated face connections to the axes."""
+        face_axes = set()
+        for links in connections.values():
+            for axis_name, edge_links in iteritems(links):
+                face_axes.add(axis_name)
+                face_axes.update(link[1] for link in edge_links
+                                 if link is not None)
+        self._face_connections = (facedim, connections)
+
+        for axis_name in face_axes:
+            ax = self.axes[axis_name]
+            ax._facedim = facedim
+            ax._connections = {face: links[axis_name]
+                               for face, links in iteritems(connections)
+                               if axis_name in links}
+            ax._face_axes = tuple(sorted(face_axes))
+            ax._grid = self
+            ax._periodic = False
 
 
     def __repr__(self):
@@ -513,17 +1097,55 @@ class Grid:
             summary += axis._coord_desc()
         return '\n'.join(summary)
 
+    def lazy(self):
+        """
+        Record grid operations for deferred evaluation.
+
+        The returned object has `interp` and `diff` methods with the same
+        signature as the Grid (for single axes), which record the operations
+        into an expression graph instead of evaluating them. Identical
+        subexpressions are only evaluated once, and chains of operations
+        along the same axis are fused into a single stencil (see
+        :mod:`xgcm.lazy`).
+
+        Returns
+        -------
+        lazy : xgcm.lazy.LazyGrid
+
+        Examples
+        --------
+        >>> with grid.lazy() as lazy:
+        ...     flux = lazy.interp(ds.u * ds.T, 'X')
+        ...     div = lazy.diff(flux, 'X')
+        ...     div, T_x = lazy.compute(div, lazy.interp(ds.T, 'X'))
+        """
+        return LazyGrid(self)
+
     @docstrings.dedent
     def interp(self, da, axis, **kwargs):
         """
         Interpolate neighboring points to the intermediate grid point along
         this axis.
 
+        If `da` is a Dataset, the operation is applied to all of its data
+        variables that lie on `axis`, and a Dataset is returned.
+
         Parameters
         ----------
-        axis : str
-            Name of the axis on which ot act
+        axis : str or list of str
+            Name of the axis on which ot act. If a list of axes is given
+            (e.g. `['X', 'Y']`), the data is interpolated along all of them
+            in one fused operation. In that case, `to`, `boundary`,
+            `fill_value` and `boundary_discontinuity` can also be dicts
+            mapping axis names to values. The result is the same as from
+            successive calls along the axes in the order given: the
+            boundary conditions of each axis apply to the result along the
+            preceding axes, so a nonzero `fill_value` depends on that order.
         %(neighbor_binary_func.parameters.no_f)s
+        backend : str, optional
+            The compute backend for the raw kernel (see
+            :mod:`xgcm.backends`). Defaults to the backend of the grid, or
+            the global default.
 
         Returns
         -------
@@ -531,6 +1153,15 @@ class Grid:
             The interpolated data
         """
 
+        if isinstance(da, xr.Dataset):
+            return self._apply_to_dataset(self.interp, da, axis, **kwargs)
+        return self._cached('interp', self._interp, da, axis, kwargs)
+
+    def _interp(self, da, axis, **kwargs):
+        if _is_axis_list(axis):
+            backend = kwargs.pop('backend', None) or self._backend
+            return self._neighbor_binary_func_multi(
+                da, get_kernel('interp', backend), axis, **kwargs)
         ax = self.axes[axis]
         return ax.interp(da, **kwargs)
 
@@ -539,11 +1170,25 @@ class Grid:
         """
         Difference neighboring points to the intermediate grid point.
 
+        If `da` is a Dataset, the operation is applied to all of its data
+        variables that lie on `axis`, and a Dataset is returned.
+
         Parameters
         ----------
-        axis : str
-            Name of the axis on which ot act
+        axis : str or list of str
+            Name of the axis on which ot act. If a list of axes is given
+            (e.g. `['X', 'Y']`), the data is differenced along all of them
+            in one fused operation. In that case, `to`, `boundary`,
+            `fill_value` and `boundary_discontinuity` can also be dicts
+            mapping axis names to values. The result is the same as from
+            successive calls along the axes in the order given: the
+            boundary conditions of each axis apply to the result along the
+            preceding axes, so a nonzero `fill_value` depends on that order.
         %(neighbor_binary_func.parameters.no_f)s
+        backend : str, optional
+            The compute backend for the raw kernel (see
+            :mod:`xgcm.backends`). Defaults to the backend of the grid, or
+            the global default.
 
         Returns
         -------
@@ -551,9 +1196,109 @@ class Grid:
             The differenced data
         """
 
+        if isinstance(da, xr.Dataset):
+            return self._apply_to_dataset(self.diff, da, axis, **kwargs)
+        return self._cached('diff', self._diff, da, axis, kwargs)
+
+    def _diff(self, da, axis, **kwargs):
+        if _is_axis_list(axis):
+            backend = kwargs.pop('backend', None) or self._backend
+            return self._neighbor_binary_func_multi(
+                da, get_kernel('diff', backend), axis, **kwargs)
         ax = self.axes[axis]
         return ax.diff(da, **kwargs)
 
+    def _neighbor_binary_func_multi(self, da, f, axes, to=None, boundary=None,
+                                    fill_value=0.0,
+                                    boundary_discontinuity=None,
+                                    vector_partner=None):
+        """
+        Apply a function to neighboring points along several axes at once.
+
+        The function is applied along each axis in turn, and the result is
+        wrapped in a new DataArray only once. As in successive calls along
+        the single axes, the boundary conditions of each axis are applied to
+        the result along the preceding axes. Numpy arrays are padded along
+        all axes at once and the function is applied in one blocked pass,
+        and for dask arrays, shifts that preserve the length of every axis
+        are computed blockwise with a one-cell halo, unless a later axis is
+        filled with a nonzero value, which then would not pass through the
+        earlier stencils (nor would a discontinuity of a later numpy axis).
+        Discontinuities across periodic boundaries are applied to the
+        wrapped cells only.
+        Face-connected axes are processed one at a time, exchanging halos
+        between the faces.
+        """
+        if any(self.axes[axis_name]._connections for axis_name in axes):
+            for axis_name in axes:
+                da = self.axes[axis_name]._neighbor_binary_func(
+                    da, f, _get_axis_kwarg(to, axis_name),
+                    boundary=_get_axis_kwarg(boundary, axis_name),
+                    fill_value=_get_axis_kwarg(fill_value, axis_name) or 0.0,
+                    boundary_discontinuity=_get_axis_kwarg(
+                        boundary_discontinuity, axis_name),
+                    vector_partner=vector_partner)
+            return da
+
+        pads = []
+        new_coords = OrderedDict()
+        for axis_name in axes:
+            ax = self.axes[axis_name]
+            position_from, dim = ax._get_axis_coord(da)
+            ax_to = _get_axis_kwarg(to, axis_name)
+            if ax_to is None:
+                ax_to = ax._default_shifts[position_from]
+            ax_fill_value = _get_axis_kwarg(fill_value, axis_name)
+            if ax_fill_value is None:
+                ax_fill_value = 0.0
+            pad_left, pad_right, ax_boundary = \
+                ax._get_neighbor_padding(position_from, ax_to,
+                                         _get_axis_kwarg(boundary, axis_name))
+            new_coords[dim] = ax._get_position_coord(ax_to)
+            pads.append((da.get_axis_num(dim), pad_left, pad_right,
+                         ax_boundary, ax_fill_value,
+                         _get_axis_kwarg(boundary_discontinuity, axis_name)))
+
+        data = da.data
+        one_sided = all(pad_left != pad_right
+                        for _, pad_left, pad_right, _, _, _ in pads)
+        zero_fill = all(ax_boundary != 'fill' or ax_fill_value == 0
+                        for _, _, _, ax_boundary, ax_fill_value, _
+                        in pads[1:])
+        if not _is_dask_array(data) and zero_fill and all(
+                discontinuity is None for _, _, _, _, _, discontinuity
+                in pads[1:]):
+            # the padding of the later axes passes through the stencils
+            # along the earlier axes unchanged, so the data can be padded
+            # along all axes at once
+            padding = [pad for pad in pads if pad[1] or pad[2]]
+            data_new = _multi_axis_stencil(
+                _pad_axes(data, padding) if padding else data, f,
+                [pad[0] for pad in pads])
+        elif _is_dask_array(data) and one_sided and zero_fill:
+            halo_boundary = {'periodic': 'periodic', 'extend': 'nearest'}
+            halos = []
+            for (axis_num, pad_left, _, ax_boundary, ax_fill_value,
+                 discontinuity) in pads:
+                if ax_boundary not in ['periodic', 'fill', 'extend']:
+                    raise ValueError("`boundary` must be `'fill'` or "
+                                     "`'extend'`")
+                halos.append((axis_num, 'left' if pad_left else 'right',
+                              halo_boundary.get(ax_boundary, ax_fill_value),
+                              discontinuity))
+            data_new = _halo_stencil(data, f, halos)
+        else:
+            data_new = data
+            for pad in pads:
+                axis_num, pad_left, pad_right = pad[:3]
+                if pad_left or pad_right:
+                    data_new = _pad_axes(data_new, [pad])
+                data_new = f(data_new[_axis_slice(data.ndim, axis_num,
+                                                  None, -1)],
+                             data_new[_axis_slice(data.ndim, axis_num,
+                                                  1, None)])
+
+        return _replace_dims(da, data_new, new_coords)
 
     @docstrings.dedent
     def cumsum(self, da, axis, **kwargs):
@@ -561,6 +1306,9 @@ class Grid:
         Cumulatively sum a DataArray, transforming to the intermediate axis
         position.
 
+        If `da` is a Dataset, the operation is applied to all of its data
+        variables that lie on `axis`, and a Dataset is returned.
+
         Parameters
         ----------
         axis : str
@@ -573,9 +1321,569 @@ class Grid:
             The cumsummed data
         """
 
+        if isinstance(da, xr.Dataset):
+            return self._apply_to_dataset(self.cumsum, da, axis, **kwargs)
+        return self._cached('cumsum', self._cumsum, da, axis, kwargs)
+
+    def _cumsum(self, da, axis, **kwargs):
         ax = self.axes[axis]
         return ax.cumsum(da, **kwargs)
 
+    def _cached(self, op, func, da, axis, kwargs):
+        """Apply `func`, returning a cached result if possible."""
+        cache = self._result_cache
+        if cache is None and self._disk_cache is None:
+            return func(da, axis, **kwargs)
+
+        params = (op, tuple(axis) if _is_axis_list(axis) else axis,
+                  tuple(sorted((k, _hashable_kwarg(v))
+                               for k, v in iteritems(kwargs))),
+                  da.dims, tuple(da.coords))
+        try:
+            hash(params)
+        except TypeError:
+            # e.g. DataArrays as arguments
+            return func(da, axis, **kwargs)
+
+        data = da.variable._data
+        if cache is not None:
+            # numpy data and coordinates are keyed by their values, so that
+            # changes in place are picked up
+            key = params + (data_checksum(data),) + tuple(
+                (d, data_checksum(da.coords[d].values))
+                for d in da.dims if d in da.coords)
+            cached = cache.get(key)
+            if cached is not None and all(
+                    cached.coords[d].attrs == da.coords[d].attrs
+                    for d in cached.dims if d in da.dims and d in da.coords):
+                self._cache_stats['hits'] += 1
+                return _cache_copy(cached)
+            self._cache_stats['misses'] += 1
+
+        if (self._disk_cache is not None and da.dtype.kind in 'biufc' and
+                _is_plain_value(params)):
+            result = self._disk_cached(params, func, da, axis, kwargs)
+        else:
+            result = func(da, axis, **kwargs)
+
+        if cache is not None:
+            cache[key] = _cache_copy(result)
+        return result
+
+    def _disk_cached(self, params, func, da, axis, kwargs):
+        """Load the result of `func` from the disk cache, or store it."""
+        key = (self._cache_token(), params,
+               data_checksum(da.variable._data))
+        stats = self._cache_stats
+        data_new = self._disk_cache.get(key)
+        if data_new is None:
+            stats['disk_misses'] = stats.get('disk_misses', 0) + 1
+            result = func(da, axis, **kwargs)
+            if not _is_dask_array(result.data):
+                self._disk_cache[key] = result.data
+                return result
+            self._disk_cache[key] = result.data.compute()
+            data_new = self._disk_cache.get(key)
+            if data_new is None:
+                # too large for the cache
+                return result
+        else:
+            stats['disk_hits'] = stats.get('disk_hits', 0) + 1
+
+        # apply the operation to placeholder data (lazily, without
+        # computing anything) to find the dims, coords and chunks of the
+        # result
+        is_dask = _is_dask_array(da.data)
+        chunks = da.data.chunks if is_dask else -1
+        placeholder = da.copy(data=dsa.zeros(da.shape, dtype=da.dtype,
+                                             chunks=chunks))
+        template = func(placeholder, axis, **kwargs)
+        if is_dask:
+            data_new = dsa.from_array(data_new, chunks=template.data.chunks)
+        return xr.DataArray(data_new, dims=template.dims,
+                            coords=template.coords)
+
+    def _cache_token(self):
+        """The properties of the grid that affect the results of its
+        operations, for keys of the disk cache."""
+        token = []
+        for name, ax in iteritems(self.axes):
+            token.append((name, ax._periodic,
+                          tuple(sorted(iteritems(ax._default_shifts))),
+                          tuple((pos, coord.name, len(coord))
+                                for pos, coord in iteritems(ax.coords)),
+                          tuple(sorted(iteritems(ax._connections)))))
+        return tuple(token)
+
+    def cache_info(self):
+        """
+        Statistics of the result cache (see the `cache_bytes` argument).
+
+        Returns
+        -------
+        info : dict
+            The number of cache `hits` and `misses`, the number of cached
+            results (`entries`), their total size (`nbytes`) and the
+            maximum size (`maxbytes`). With a disk cache, the same
+            statistics prefixed with `disk_`. Empty if caching is disabled.
+        """
+        info = {}
+        cache = self._result_cache
+        if cache is not None:
+            info.update(hits=self._cache_stats['hits'],
+                        misses=self._cache_stats['misses'],
+                        entries=len(cache), nbytes=cache.nbytes,
+                        maxbytes=cache.maxbytes)
+        disk_cache = self._disk_cache
+        if disk_cache is not None:
+            info.update(disk_hits=self._cache_stats.get('disk_hits', 0),
+                        disk_misses=self._cache_stats.get('disk_misses', 0),
+                        disk_entries=len(disk_cache),
+                        disk_nbytes=disk_cache.nbytes,
+                        disk_maxbytes=disk_cache.maxbytes)
+        return info
+
+    def clear_cache(self, disk=False):
+        """
+        Empty the result cache and reset its statistics.
+
+        Parameters
+        ----------
+        disk : bool, optional
+            Whether to delete the files of the disk cache as well.
+        """
+        if self._result_cache is not None:
+            self._result_cache.clear()
+        if disk and self._disk_cache is not None:
+            self._disk_cache.clear()
+        self._cache_stats = {'hits': 0, 'misses': 0}
+
+    def get_metric(self, da, axes):
+        """
+        Find the metric (distance, area or volume) of the grid cells of a
+        DataArray along one or several axes.
+
+        If no single metric covers all of `axes`, the metrics of subsets of
+        the axes are multiplied. The result is cached on the grid, so that
+        every combination of axes and grid positions is only computed once.
+
+        Parameters
+        ----------
+        da : xarray.DataArray
+            The data whose grid positions determine the metric
+        axes : str or list of str
+            Names of the axes
+
+        Returns
+        -------
+        metric : xarray.DataArray
+        """
+        axes = frozenset(axes if _is_axis_list(axes) else [axes])
+        cache_key = (axes, frozenset(da.dims))
+        if cache_key not in self._metric_cache:
+            metric = self._find_metric(da, axes)
+            if metric is None:
+                raise KeyError("Unable to find any combination of metrics "
+                               "for axes %s and dims %s."
+                               % (sorted(axes), da.dims))
+            self._metric_cache[cache_key] = metric
+        return self._metric_cache[cache_key]
+
+    def _find_metric(self, da, axes):
+        """
+        Return the metric for `axes` that lies at the grid positions of
+        `da`, multiplying metrics of subsets of `axes` if necessary, or None.
+        """
+        dims = {}
+        for axis_name in axes:
+            _, dims[axis_name] = self.axes[axis_name]._get_axis_coord(da)
+        for metric in self._metrics.get(axes, []):
+            if (set(metric.dims) <= set(da.dims) and
+                    all(dims[axis_name] in metric.dims
+                        for axis_name in axes)):
+                return metric
+        if len(axes) > 1:
+            # split off subsets containing the first axis, largest first
+            axes_list = sorted(axes)
+            first, others = axes_list[0], axes_list[1:]
+            for n in reversed(range(len(others))):
+                for subset in itertools.combinations(others, n):
+                    subset = frozenset((first,) + subset)
+                    metric = self._find_metric(da, subset)
+                    if metric is None:
+                        continue
+                    rest = self._find_metric(da, axes - subset)
+                    if rest is not None:
+                        return metric * rest
+        return None
+
+    def _get_reciprocal_metric(self, da, axes):
+        """
+        Return the reciprocal of the metric for `axes` at the grid positions
+        of `da`, as a raw array that broadcasts against the data of `da`.
+
+        The reciprocal is computed once for every combination of dims and
+        chunks. For dask data, it is chunked like `da` and persisted, so that
+        it is not embedded in every task graph that uses it.
+        """
+        axes = frozenset(axes if _is_axis_list(axes) else [axes])
+        cache_key = (axes, da.dims, da.chunks)
+        if cache_key not in self._reciprocal_cache:
+            reciprocal = _broadcast_metric(1 / self.get_metric(da, axes), da)
+            if _is_dask_array(da.data):
+                reciprocal = dsa.asarray(reciprocal)
+                reciprocal = reciprocal.rechunk(tuple(
+                    chunks if reciprocal.shape[n] == da.shape[n] else -1
+                    for n, chunks in enumerate(da.chunks)))
+                reciprocal = reciprocal.persist()
+            elif _is_dask_array(reciprocal):
+                reciprocal = reciprocal.compute()
+            self._reciprocal_cache[cache_key] = reciprocal
+        return self._reciprocal_cache[cache_key]
+
+    @docstrings.dedent
+    def derivative(self, da, axis, **kwargs):
+        """
+        Take the centered-difference derivative along an axis, dividing the
+        difference of neighboring points by the grid metric at the
+        intermediate grid point.
+
+        If `da` is a Dataset, the operation is applied to all of its data
+        variables that lie on `axis`, and a Dataset is returned.
+
+        Parameters
+        ----------
+        axis : str
+            Name of the axis on which to act
+        %(neighbor_binary_func.parameters.no_f)s
+        backend : str, optional
+            The compute backend for the raw kernel (see
+            :mod:`xgcm.backends`). Defaults to the backend of the grid, or
+            the global default.
+
+        Returns
+        -------
+        da_i : xarray.DataArray
+            The derivative
+        """
+
+        if isinstance(da, xr.Dataset):
+            return self._apply_to_dataset(self.derivative, da, axis,
+                                          **kwargs)
+        diff = self.diff(da, axis, **kwargs)
+        reciprocal = self._get_reciprocal_metric(diff, axis)
+        data_new = diff.data
+        # the difference is a new array (the result cache hands out copies),
+        # so numpy data are scaled in place rather than into a second
+        # full-size array. Memory-mapped results from the disk cache are
+        # read-only. For dask data, the multiplication is blockwise and is
+        # fused into the tasks of the difference.
+        if (isinstance(data_new, np.ndarray) and data_new.flags.writeable and
+                np.result_type(data_new, reciprocal) == data_new.dtype and
+                np.broadcast(data_new, reciprocal).shape == data_new.shape):
+            np.multiply(data_new, reciprocal, out=data_new)
+        else:
+            data_new = data_new * reciprocal
+        return xr.DataArray(data_new, dims=diff.dims, coords=diff.coords)
+
+    def integrate(self, da, axis):
+        """
+        Integrate a DataArray over one or several axes, weighting it by the
+        grid metrics. NaNs are skipped.
+
+        If `da` is a Dataset, the operation is applied to all of its data
+        variables that lie on `axis`, and a Dataset is returned.
+
+        Parameters
+        ----------
+        da : xarray.DataArray
+            The data to integrate
+        axis : str or list of str
+            Name of the axis or axes over which to integrate
+
+        Returns
+        -------
+        da_i : xarray.DataArray
+            The integrated data
+        """
+        return self._weighted_reduction(da, axis, average=False)
+
+    def average(self, da, axis):
+        """
+        Average a DataArray over one or several axes, weighting it by the
+        grid metrics. NaNs are skipped, and are excluded from the sum of the
+        weights.
+
+        If `da` is a Dataset, the operation is applied to all of its data
+        variables that lie on `axis`, and a Dataset is returned.
+
+        Parameters
+        ----------
+        da : xarray.DataArray
+            The data to average
+        axis : str or list of str
+            Name of the axis or axes over which to average
+
+        Returns
+        -------
+        da_i : xarray.DataArray
+            The averaged data
+        """
+        return self._weighted_reduction(da, axis, average=True)
+
+    def _weighted_reduction(self, da, axis, average):
+        if isinstance(da, xr.Dataset):
+            func = self.average if average else self.integrate
+            return self._apply_to_dataset(func, da, axis)
+        axis_names = axis if _is_axis_list(axis) else [axis]
+        metric = self.get_metric(da, axis_names)
+
+        weights = _broadcast_metric(metric, da)
+        reduce_dims = [self.axes[axis_name]._get_axis_coord(da)[1]
+                       for axis_name in axis_names]
+        data_new = _weighted_sum(da.data, weights,
+                                 [da.get_axis_num(d) for d in reduce_dims],
+                                 average=average)
+
+        dims = [d for d in da.dims if d not in reduce_dims]
+        coords = OrderedDict((name, coord) for name, coord
+                             in iteritems(da.coords)
+                             if set(coord.dims) <= set(dims))
+        return xr.DataArray(data_new, dims=dims, coords=coords)
+
+    def _apply_to_dataset(self, func, ds, axis, **kwargs):
+        """
+        Apply a grid operation to all data variables of a Dataset that lie
+        on `axis`.
+
+        Dask variables with the same dims, dtype and chunks (and hence the
+        same grid positions) are stacked along a new dimension, so that the
+        operation runs only once per group. Stacking dask arrays is lazy and
+        reuses their blocks; numpy variables are processed one at a time,
+        since stacking them would copy them first. Variables without a
+        dimension on `axis` are dropped. The attributes of the Dataset and
+        of its variables are kept, as are the non-dimension coordinates
+        whose dimensions are all in the result.
+        """
+        axis_names = axis if _is_axis_list(axis) else [axis]
+
+        groups = OrderedDict()
+        for name, da in iteritems(ds.data_vars):
+            try:
+                for axis_name in axis_names:
+                    self.axes[axis_name]._get_axis_coord(da)
+            except KeyError:
+                continue
+            if _is_dask_array(da.data):
+                key = (da.dims, da.dtype, da.chunks)
+            else:
+                key = name
+            groups.setdefault(key, []).append(name)
+
+        results = {}
+        for key, names in iteritems(groups):
+            if len(names) == 1:
+                results[names[0]] = func(ds[names[0]], axis, **kwargs)
+                continue
+            dims = key[0]
+            stacked = stack([ds[name].data for name in names])
+            da_stacked = xr.DataArray(stacked, dims=(_STACK_DIM,) + dims,
+                                      coords={d: ds[d] for d in dims
+                                              if d in ds.coords})
+            da_new = func(da_stacked, axis, **kwargs)
+            new_dims = da_new.dims[1:]
+            new_coords = OrderedDict((d, da_new.coords[d]) for d in new_dims
+                                     if d in da_new.coords)
+            for n, name in enumerate(names):
+                results[name] = xr.DataArray(da_new.data[n], dims=new_dims,
+                                             coords=new_coords)
+
+        data_vars = OrderedDict()
+        for name in ds.data_vars:
+            if name in results:
+                # results may be shared by the cache, so they are not
+                # modified
+                data_vars[name] = results[name].copy(deep=False)
+                data_vars[name].attrs = ds[name].attrs.copy()
+        ds_new = xr.Dataset(data_vars, attrs=ds.attrs.copy())
+        coords = OrderedDict((name, coord.variable)
+                             for name, coord in iteritems(ds.coords)
+                             if name not in ds.dims and
+                             set(coord.dims) <= set(ds_new.dims))
+        return ds_new.assign_coords(**coords)
+
+
+def _json_attrs(name, attrs):
+    """
+    The attributes of the variable `name`, converted to be written to JSON.
+    """
+    json_attrs = {}
+    for key, value in iteritems(attrs):
+        if isinstance(value, (np.generic, np.ndarray)):
+            value = value.tolist()
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            raise ValueError("Can't store attribute '%s' of variable '%s': "
+                             "%r can't be written to JSON. Convert or "
+                             "remove it first." % (key, name, value))
+        json_attrs[key] = value
+    return json_attrs
+
+
+def _replace_file(dirname, fname, write):
+    """
+    Replace the file `fname` in `dirname` with one written by `write(f)`,
+    through a temporary file, so that readers never see a partial file.
+    """
+    fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.rename(tmpname, os.path.join(dirname, fname))
+    except Exception:
+        os.remove(tmpname)
+        raise
+
+
+class _DimCoord(object):
+    """
+    Stands in for an axis coordinate that is not available (see
+    :meth:`Grid.from_spec`): a dimension name and length without values.
+    """
+    __slots__ = ('name', 'size')
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+def _coord_sources(ds):
+    """A mapping of the variables and coordinates of a Dataset or a list of
+    DataArrays, by name."""
+    if ds is None:
+        return {}
+    if isinstance(ds, xr.Dataset):
+        return ds
+    sources = {}
+    for da in ds:
+        for name, coord in iteritems(da.coords):
+            sources.setdefault(name, coord)
+        if da.name is not None:
+            sources.setdefault(da.name, da)
+    return sources
+
+
+def _replace_dims(da, data_new, new_coords):
+    """
+    Take the base coords from da and the data from data_new, and return a
+    new DataArray in which every dim in new_coords is replaced by the
+    corresponding coordinate.
+    """
+    coords = OrderedDict()
+    dims = []
+    for d in da.dims:
+        if d in new_coords:
+            new_coord = new_coords[d]
+            dims.append(new_coord.name)
+            if not isinstance(new_coord, _DimCoord):
+                coords[new_coord.name] = new_coord
+        else:
+            dims.append(d)
+            if d in da.coords:
+                coords[d] = da.coords[d]
+
+    return _new_dataarray(data_new, dims, coords)
+
+
+def _new_dataarray(data, dims, coords):
+    """
+    A new DataArray holding `data`, with the dimension coordinates `coords`
+    (DataArrays).
+
+    Building a DataArray validates and copies its coordinates and indexes,
+    which dominates the cost of operations on small arrays. Results with
+    the same dims and coordinates as a recent one are instead shallow
+    copies of a template DataArray, with the data replaced.
+    """
+    variables = OrderedDict((name, coord.variable)
+                            for name, coord in iteritems(coords))
+    key = (tuple(dims), data.shape, tuple(variables))
+    with _templates_lock:
+        entry = _TEMPLATES.pop(key, None)
+        if entry is not None:
+            _TEMPLATES[key] = entry
+    if entry is not None:
+        template, sources = entry
+        # coordinates of the same Dataset or Grid are the same objects
+        if all(var is sources[name] or var.identical(sources[name])
+               for name, var in iteritems(variables)):
+            return template.copy(deep=False, data=data)
+
+    # the template only holds a broadcast scalar, not the data
+    template = xr.DataArray(np.broadcast_to(np.zeros((), data.dtype),
+                                            data.shape),
+                            dims=dims, coords=coords)
+    with _templates_lock:
+        _TEMPLATES[key] = (template, variables)
+        while len(_TEMPLATES) > _TEMPLATES_SIZE:
+            _TEMPLATES.popitem(last=False)
+    return template.copy(deep=False, data=data)
+
+
+def _broadcast_metric(metric, da):
+    """
+    Return the data of a metric with its dims lined up with `da`, and
+    missing dims inserted with length one.
+    """
+    metric = metric.transpose(*[d for d in da.dims if d in metric.dims])
+    return metric.data[tuple(slice(None) if d in metric.dims else None
+                             for d in da.dims)]
+
+
+def _is_axis_list(axis):
+    """Whether `axis` is a list of several axis names."""
+    return isinstance(axis, (list, tuple, set, frozenset))
+
+
+def _cache_copy(da):
+    """
+    A copy of a result of a grid operation for the result cache, or from
+    it, so that neither the cache nor the callers see changes made in
+    place by the other. Dask arrays aren't modified in place, and are
+    shared.
+    """
+    return da.copy(deep=not _is_dask_array(da.data))
+
+
+def _hashable_kwarg(value):
+    """Per-axis dicts of keyword arguments as hashable tuples."""
+    if isinstance(value, dict):
+        return tuple(sorted(iteritems(value)))
+    return value
+
+
+def _is_plain_value(value):
+    """
+    Whether `value` is made of tuples of numbers, strings and None only,
+    whose `repr` can be used in keys of the disk cache (unlike e.g. dask
+    arrays as fill values).
+    """
+    if isinstance(value, tuple):
+        return all(_is_plain_value(v) for v in value)
+    return (value is None or isinstance(value, (numbers.Number, string_types))
+            and not _is_dask_array(value))
+
+
+def _get_axis_kwarg(value, axis_name):
+    """Pick the value for one axis out of a per-axis dict, if necessary."""
+    if isinstance(value, dict):
+        return value.get(axis_name)
+    return value
+
 
 def add_to_slice(da, dim, sl, value):
     # split array into before, middle and after (if slice is the
@@ -596,7 +1904,11 @@ def add_to_slice(da, dim, sl, value):
 def raw_interp_function(data_left, data_right):
     # linear, centered interpolation
     # TODO: generalize to higher order interpolation
-    return 0.5*(data_left + data_right)
+    data_sum = data_left + data_right
+    if isinstance(data_sum, np.ndarray) and data_sum.dtype.kind in 'fc':
+        # halve in place to avoid a second full-size temporary
+        return np.multiply(data_sum, 0.5, out=data_sum)
+    return 0.5*data_sum
 
 
 def raw_diff_function(data_left, data_right):
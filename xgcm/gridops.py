@@ -266,7 +266,7 @@ class GCMDataset(object):
         hfac = self._get_hfac_for_array(array)
         if hfac is not None:
             # brodcast hfac against dz
-            dz *= hfac
+            dz = dz * hfac
         a_int = (array * dz).sum(dim='Z')
         if average:
             return a_int / dz.sum(dim='Z')
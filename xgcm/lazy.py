@@ -0,0 +1,335 @@
+"""
+Deferred evaluation of grid operations.
+
+:meth:`xgcm.Grid.lazy` returns a :class:`LazyGrid`, which records
+interpolations, differences and arithmetic into an expression graph instead
+of evaluating them::
+
+    lazy = grid.lazy()
+    flux = lazy.interp(ds.u * ds.T, 'X')
+    div = lazy.diff(flux, 'X') + lazy.diff(lazy.interp(ds.v * ds.T, 'Y'), 'Y')
+    uT = lazy.interp(ds.T, 'X') * ds.u
+    div, uT = lazy.compute(div, uT)
+
+Identical operations on the same inputs are recorded only once, and are
+evaluated only once. Chains of interpolations and differences along the same
+axis are fused into a single wider stencil, which is applied in one pass
+over the data. For dask arrays the results stay lazy, and computing them
+together (e.g. with ``dask.compute``) shares the common tasks.
+"""
+from __future__ import print_function, division
+
+import numbers
+import operator
+
+import xarray as xr
+
+from .cache import data_token
+from .duck_array_ops import _fused_stencil
+
+# operations that can be fused, and the weights of their left and right
+# neighbors
+_STENCIL_WEIGHTS = {'interp': (0.5, 0.5), 'diff': (-1, 1)}
+
+_BINARY_OPS = {'add': operator.add, 'sub': operator.sub,
+               'mul': operator.mul, 'truediv': operator.truediv,
+               'pow': operator.pow}
+
+
+class GridExpression(object):
+    """
+    A node of the expression graph recorded by :class:`LazyGrid`.
+
+    Supports arithmetic with other expressions, DataArrays and scalars,
+    which is recorded as well. Use :meth:`compute` (or
+    :meth:`LazyGrid.compute` for several expressions at once) to evaluate it.
+    """
+
+    def __init__(self, lazy, op, args, params, key):
+        self._lazy = lazy
+        self.op = op
+        self.args = args
+        self.params = dict(params)
+        self.key = key
+
+    def __repr__(self):
+        if self.op == 'input':
+            return '<xgcm.GridExpression input %r>' % (self._input.name,)
+        if self.op == 'const':
+            return '<xgcm.GridExpression %r>' % (self.params['value'],)
+        return ('<xgcm.GridExpression %s%s>'
+                % (self.op, '' if 'axis' not in self.params
+                   else " along '%s'" % self.params['axis']))
+
+    def compute(self):
+        """Evaluate the expression and return a DataArray."""
+        return self._lazy.compute(self)
+
+    def _binary(self, op, other, reflexive=False):
+        other = self._lazy._as_expression(other)
+        args = (other, self) if reflexive else (self, other)
+        return self._lazy._record(op, args)
+
+    def __neg__(self):
+        return self._lazy._record('neg', (self,))
+
+    def __add__(self, other):
+        return self._binary('add', other)
+
+    def __radd__(self, other):
+        return self._binary('add', other, reflexive=True)
+
+    def __sub__(self, other):
+        return self._binary('sub', other)
+
+    def __rsub__(self, other):
+        return self._binary('sub', other, reflexive=True)
+
+    def __mul__(self, other):
+        return self._binary('mul', other)
+
+    def __rmul__(self, other):
+        return self._binary('mul', other, reflexive=True)
+
+    def __truediv__(self, other):
+        return self._binary('truediv', other)
+
+    def __rtruediv__(self, other):
+        return self._binary('truediv', other, reflexive=True)
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, other):
+        return self._binary('pow', other)
+
+
+class LazyGrid(object):
+    """
+    Records grid operations into an expression graph, to be evaluated
+    together by :meth:`compute`. Usually created by :meth:`xgcm.Grid.lazy`.
+
+    Can be used as a context manager, which releases the recorded graph on
+    exit.
+    """
+
+    def __init__(self, grid):
+        """
+        Create a new recorder.
+
+        Parameters
+        ----------
+        grid : xgcm.Grid
+            The grid on which the operations are evaluated
+        """
+        self._grid = grid
+        # recorded expressions by key, so that identical operations are
+        # only recorded once
+        self._expressions = {}
+
+    def __repr__(self):
+        return ('<xgcm.LazyGrid: %i recorded expressions>'
+                % len(self._expressions))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._expressions.clear()
+
+    def _record(self, op, args, params=()):
+        key = (op,) + tuple(arg.key for arg in args) + tuple(params)
+        expression = self._expressions.get(key)
+        if expression is None:
+            expression = GridExpression(self, op, args, params, key)
+            self._expressions[key] = expression
+        return expression
+
+    def _as_expression(self, value):
+        if isinstance(value, GridExpression):
+            if value._lazy is not self:
+                raise ValueError("Can't combine expressions recorded by "
+                                 "different LazyGrid objects.")
+            return value
+        if isinstance(value, (xr.DataArray, xr.Dataset)):
+            expression = self._record('input', (), _input_key(value))
+            # the input is kept by the expression, so that the ids in its
+            # key are not reused while it is recorded
+            expression._input = value
+            return expression
+        if isinstance(value, numbers.Number):
+            return self._record('const', (), (('value', value),
+                                              ('type', type(value))))
+        raise TypeError("Can't record operations on %r." % type(value))
+
+    def _neighbor_op(self, op, da, axis, to, boundary, fill_value, backend):
+        if axis not in self._grid.axes:
+            raise KeyError("Axis '%s' not found in grid axes %s."
+                           % (axis, list(self._grid.axes)))
+        params = (('axis', axis), ('to', to), ('boundary', boundary),
+                  ('fill_value', fill_value), ('backend', backend))
+        return self._record(op, (self._as_expression(da),), params)
+
+    def interp(self, da, axis, to=None, boundary=None, fill_value=0.0,
+               backend=None):
+        """
+        Record an interpolation along a single axis (see
+        :meth:`xgcm.Grid.interp`).
+
+        Parameters
+        ----------
+        da : xarray.DataArray or GridExpression
+            The data to interpolate
+        axis : str
+            Name of the axis on which to act
+        to, boundary, fill_value, backend : optional
+            As in :meth:`xgcm.Grid.interp`
+
+        Returns
+        -------
+        expression : GridExpression
+        """
+        return self._neighbor_op('interp', da, axis, to, boundary,
+                                 fill_value, backend)
+
+    def diff(self, da, axis, to=None, boundary=None, fill_value=0.0,
+             backend=None):
+        """
+        Record a difference along a single axis (see
+        :meth:`xgcm.Grid.diff`).
+
+        Parameters
+        ----------
+        da : xarray.DataArray or GridExpression
+            The data to difference
+        axis : str
+            Name of the axis on which to act
+        to, boundary, fill_value, backend : optional
+            As in :meth:`xgcm.Grid.diff`
+
+        Returns
+        -------
+        expression : GridExpression
+        """
+        return self._neighbor_op('diff', da, axis, to, boundary,
+                                 fill_value, backend)
+
+    def compute(self, *expressions):
+        """
+        Evaluate recorded expressions.
+
+        Every distinct subexpression is evaluated once. Chains of
+        interpolations and differences along the same axis, whose
+        intermediate results are not used elsewhere, are applied as one
+        fused stencil (with numpy arithmetic, regardless of `backend`).
+
+        Parameters
+        ----------
+        *expressions : GridExpression
+            The expressions to evaluate
+
+        Returns
+        -------
+        results : xarray.DataArray or tuple of xarray.DataArray
+            One result per expression
+        """
+        expressions = [self._as_expression(e) for e in expressions]
+        outputs = set(e.key for e in expressions)
+        consumers = _count_consumers(expressions)
+        results = {}
+        values = tuple(self._evaluate(e, consumers, outputs, results)
+                       for e in expressions)
+        return values[0] if len(values) == 1 else values
+
+    def _evaluate(self, expression, consumers, outputs, results):
+        if expression.key in results:
+            return results[expression.key]
+
+        op = expression.op
+        if op == 'input':
+            value = expression._input
+        elif op == 'const':
+            value = expression.params['value']
+        elif op in _STENCIL_WEIGHTS:
+            # collect the chain of stencils along the same axis, ending at
+            # this expression
+            axis = expression.params['axis']
+            chain = [expression]
+            source = expression.args[0]
+            while (source.op in _STENCIL_WEIGHTS and
+                   source.params['axis'] == axis and
+                   consumers[source.key] == 1 and
+                   source.key not in outputs and
+                   source.key not in results):
+                chain.append(source)
+                source = source.args[0]
+            chain.reverse()
+            da = self._evaluate(source, consumers, outputs, results)
+            value = self._apply_chain(da, axis, chain)
+        elif op == 'neg':
+            value = -self._evaluate(expression.args[0], consumers, outputs,
+                                    results)
+        else:
+            left, right = [self._evaluate(arg, consumers, outputs, results)
+                           for arg in expression.args]
+            value = _BINARY_OPS[op](left, right)
+
+        results[expression.key] = value
+        return value
+
+    def _apply_chain(self, da, axis_name, chain):
+        """Apply a chain of stencils along one axis, fused if possible."""
+        grid = self._grid
+        ax = grid.axes[axis_name]
+
+        data_new = None
+        if (len(chain) > 1 and isinstance(da, xr.DataArray) and
+                not ax._connections):
+            position, dim = ax._get_axis_coord(da)
+            steps = []
+            for expression in chain:
+                params = expression.params
+                to = params['to'] or ax._default_shifts[position]
+                pad_left, pad_right, boundary = \
+                    ax._get_neighbor_padding(position, to,
+                                             params['boundary'])
+                steps.append((_STENCIL_WEIGHTS[expression.op], pad_left,
+                              pad_right, boundary, params['fill_value']))
+                position = to
+            data_new = _fused_stencil(da.data, da.get_axis_num(dim), steps)
+
+        if data_new is None:
+            for expression in chain:
+                params = dict(expression.params)
+                del params['axis']
+                da = getattr(grid, expression.op)(da, axis_name, **params)
+            return da
+        return ax._wrap_and_replace_coords(da, data_new, position)
+
+
+def _input_key(value):
+    """
+    Identify an input DataArray by its underlying data, so that DataArrays
+    taken from a Dataset repeatedly (e.g. `ds.T`) are the same input.
+    """
+    if isinstance(value, xr.Dataset):
+        return (('id', id(value)),)
+    return (('data', data_token(value.variable._data)), ('dims', value.dims),
+            ('coords', tuple(id(value.coords[c].variable)
+                             for c in value.coords)))
+
+
+def _count_consumers(expressions):
+    """The number of distinct expressions using each subexpression."""
+    consumers = {}
+    visited = set()
+    stack = list(expressions)
+    while stack:
+        expression = stack.pop()
+        if expression.key in visited:
+            continue
+        visited.add(expression.key)
+        for arg in set(expression.args):
+            consumers[arg.key] = consumers.get(arg.key, 0) + 1
+            stack.append(arg)
+    return consumers
@@ -0,0 +1,451 @@
+"""
+Lazy reader for MITgcm MDS output (``.meta`` / ``.data`` file pairs).
+
+The binary files are memory-mapped only when a chunk of data is actually
+computed, so opening a run with many iterations reads nothing but the
+``.meta`` headers of the first iteration of every output prefix.
+
+Output written per tile (``T.0000000010.001.002.data``) is assembled into
+global arrays, with the tile placement taken from the ``.meta`` headers.
+Headers and tiles are read with a thread pool.
+"""
+from __future__ import print_function, division
+from future.utils import iteritems
+
+import os
+import re
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import xarray as xr
+import dask.array as dsa
+from dask.base import tokenize
+
+# Comodo attributes of the MITgcm dimensions
+_DIMENSIONS = OrderedDict([
+    ('X', {'axis': 'X', 'standard_name': 'longitude',
+           'long_name': 'x-coordinate of cell center'}),
+    ('Xp1', {'axis': 'X', 'c_grid_axis_shift': -0.5,
+             'standard_name': 'longitude_at_f_location',
+             'long_name': 'x-coordinate of cell corner'}),
+    ('Y', {'axis': 'Y', 'standard_name': 'latitude',
+           'long_name': 'y-coordinate of cell center'}),
+    ('Yp1', {'axis': 'Y', 'c_grid_axis_shift': -0.5,
+             'standard_name': 'latitude_at_f_location',
+             'long_name': 'y-coordinate of cell corner'}),
+    ('Z', {'axis': 'Z', 'standard_name': 'depth',
+           'long_name': 'vertical coordinate of cell center',
+           'positive': 'up'}),
+    ('Zp1', {'axis': 'Z', 'c_grid_axis_shift': -0.5,
+             'standard_name': 'depth_at_w_location',
+             'long_name': 'vertical coordinate of cell interface',
+             'positive': 'up'}),
+    ('Zl', {'axis': 'Z', 'c_grid_axis_shift': -0.5,
+            'standard_name': 'depth_at_upper_w_location',
+            'long_name': 'vertical coordinate of upper cell interface',
+            'positive': 'up'}),
+    ('Zu', {'axis': 'Z', 'c_grid_axis_shift': 0.5,
+            'standard_name': 'depth_at_lower_w_location',
+            'long_name': 'vertical coordinate of lower cell interface',
+            'positive': 'up'}),
+])
+
+# grid files: prefix -> (variable name, dims)
+_GRID_VARIABLES = OrderedDict([
+    ('XC', ('XC', ('Y', 'X'))),
+    ('YC', ('YC', ('Y', 'X'))),
+    ('XG', ('XG', ('Yp1', 'Xp1'))),
+    ('YG', ('YG', ('Yp1', 'Xp1'))),
+    ('DXC', ('dxC', ('Y', 'Xp1'))),
+    ('DYC', ('dyC', ('Yp1', 'X'))),
+    ('DXG', ('dxG', ('Yp1', 'X'))),
+    ('DYG', ('dyG', ('Y', 'Xp1'))),
+    ('RAC', ('rA', ('Y', 'X'))),
+    ('RAZ', ('rAz', ('Yp1', 'Xp1'))),
+    ('RAW', ('rAw', ('Y', 'Xp1'))),
+    ('RAS', ('rAs', ('Yp1', 'X'))),
+    ('Depth', ('Depth', ('Y', 'X'))),
+    ('DRF', ('drF', ('Z',))),
+    ('DRC', ('drC', ('Zp1',))),
+    ('hFacC', ('HFacC', ('Z', 'Y', 'X'))),
+    ('hFacW', ('HFacW', ('Z', 'Y', 'Xp1'))),
+    ('hFacS', ('HFacS', ('Z', 'Yp1', 'X'))),
+])
+
+# the horizontal and vertical position of output variables that are not at
+# the cell center
+_VARIABLE_DIMS = {
+    'U': ('Z', 'Y', 'Xp1'), 'UVEL': ('Z', 'Y', 'Xp1'),
+    'V': ('Z', 'Yp1', 'X'), 'VVEL': ('Z', 'Yp1', 'X'),
+    'W': ('Zl', 'Y', 'X'), 'WVEL': ('Zl', 'Y', 'X'),
+}
+
+_META_FILE = re.compile(r'^([A-Za-z]\w*?)(?:\.(\d{10}))?'
+                        r'(\.\d{3}\.\d{3})?\.meta$')
+
+# the number of threads used to read headers and tiles
+_NTHREADS = 8
+_thread_pools = {}
+_META_ENTRY = re.compile(r'(\w+)\s*=\s*([\[\{])(.*?)[\]\}]\s*;', re.S)
+
+
+def open_mdsdataset(dirname, iters='all', deltaT=1, prefix=None,
+                    read_grid=True, nthreads=_NTHREADS):
+    """
+    Open MITgcm MDS output as a lazy xarray Dataset.
+
+    Every variable is a dask array with one chunk per record (iteration),
+    vertical level and tile. Data is only read (through a memory map) when
+    a chunk is computed, so operations on a subregion only read the tiles
+    that overlap it. The dimensions carry Comodo attributes, so the dataset
+    can be passed directly to :class:`xgcm.Grid`.
+
+    Parameters
+    ----------
+    dirname : str
+        The directory with the MDS files
+    iters : list of int, 'all' or None, optional
+        The iterations to read. If `'all'`, all iterations found for any
+        of the prefixes are read, and the variables of prefixes without
+        output at some of them are missing values (NaN) there. If `None`,
+        only the grid is read.
+    deltaT : float, optional
+        The model time step, used to convert iterations to time (in
+        seconds)
+    prefix : str or list of str, optional
+        The prefixes of the output files to read (e.g. `['T', 'S']`). By
+        default, all prefixes with output at the requested iterations.
+    read_grid : bool, optional
+        Whether to read the grid files (``XC.data``, ``hFacC.data``, ...)
+    nthreads : int, optional
+        The number of threads used to parse the headers of tiled output
+        and to read tiles
+
+    Returns
+    -------
+    ds : xarray.Dataset
+    """
+    meta_files, tiles = _find_meta_files(dirname)
+    all_iters = isinstance(iters, str) and iters == 'all'
+    if isinstance(prefix, str):
+        prefix = [prefix]
+    if iters is None:
+        prefix = []
+    elif prefix is None:
+        prefix = sorted(meta_files)
+        if not all_iters:
+            # only the prefixes with output at the requested iterations
+            prefix = [p for p in prefix
+                      if set(np.atleast_1d(iters)) & meta_files[p]]
+    for p in prefix:
+        if p not in meta_files:
+            raise IOError("No output with prefix '%s' found in %s"
+                          % (p, dirname))
+    if all_iters:
+        iters = sorted(set().union(*[meta_files[p] for p in prefix]))
+    elif iters is not None:
+        iters = [int(i) for i in np.atleast_1d(iters)]
+
+    ds = xr.Dataset()
+    sizes = {}
+    if read_grid:
+        for grid_prefix, (name, dims) in iteritems(_GRID_VARIABLES):
+            if grid_prefix not in tiles:
+                continue
+            fname = os.path.join(dirname, grid_prefix)
+            meta, layout = _read_layout(fname, tiles[grid_prefix], nthreads)
+            data = _mds_arrays([fname], meta, layout, nthreads)[0][0]
+            data = data.reshape(_squeeze_shape(data.shape, len(dims)))
+            sizes.update(zip(dims, data.shape))
+            ds[name] = (dims, data)
+
+    for p in prefix:
+        missing = set(iters) - meta_files[p]
+        if missing and not all_iters:
+            raise IOError("Iterations %s of prefix '%s' not found in %s"
+                          % (sorted(missing), p, dirname))
+        # missing iterations are left as gaps (None)
+        fnames = [None if i in missing
+                  else os.path.join(dirname, '%s.%010d' % (p, i))
+                  for i in iters]
+        # all iterations are assumed to share the layout of the first
+        meta, layout = _read_layout(
+            next(fname for fname in fnames if fname is not None), tiles[p],
+            nthreads)
+        arrays = _mds_arrays(fnames, meta, layout, nthreads)
+        names = meta.get('fldList', [p])
+        for name, data in zip(names, arrays):
+            dims = _get_variable_dims(name, data.ndim - 1)
+            sizes.update(zip(dims, data.shape[1:]))
+            ds[name] = (('time',) + dims, data)
+
+    if iters:
+        ds.coords['iter'] = ('time', np.asarray(iters))
+        ds.coords['time'] = ('time', np.asarray(iters) * deltaT,
+                             {'units': 'seconds'})
+    ds.coords.update(_dimension_coords(dirname, sizes, tiles, read_grid,
+                                       nthreads))
+    return ds
+
+
+def parse_meta_file(fname):
+    """
+    Parse an MITgcm ``.meta`` file.
+
+    Parameters
+    ----------
+    fname : str
+        The path of the file
+
+    Returns
+    -------
+    meta : dict
+        All entries of the file. Numeric entries are lists of numbers
+        (single values are unpacked), and ``dimList`` is a list of
+        ``(global size, start, end)`` tuples, starting with the fastest
+        varying (x) dimension. ``dataprec`` is converted to a numpy dtype.
+    """
+    with open(fname) as f:
+        text = f.read()
+    meta = {}
+    for key, bracket, value in _META_ENTRY.findall(text):
+        if bracket == '{' or "'" in value:
+            entries = [v.strip() for v in re.findall(r"'([^']*)'", value)]
+            if key != 'fldList' and len(entries) == 1:
+                entries = entries[0]
+        else:
+            entries = [float(v) if '.' in v or 'e' in v.lower() else int(v)
+                       for v in value.replace(',', ' ').split()]
+            if len(entries) == 1:
+                entries = entries[0]
+        meta[key] = entries
+
+    dims = meta.get('dimList', [])
+    meta['dimList'] = [tuple(dims[n:n + 3]) for n in range(0, len(dims), 3)]
+    meta['dataprec'] = _get_dtype(meta.get('dataprec', 'float32'))
+    meta.setdefault('nrecords', 1)
+    return meta
+
+
+def _get_dtype(dataprec):
+    return np.dtype({'float32': '>f4', 'float64': '>f8', 'real*4': '>f4',
+                     'real*8': '>f8', 'int32': '>i4', 'int64': '>i8'}
+                    [dataprec.lower()])
+
+
+def _find_meta_files(dirname):
+    """
+    Map every output prefix to the set of its iterations, and every prefix
+    (including grid files) to the set of its tile suffixes (``''`` for
+    global files).
+    """
+    meta_files = {}
+    tiles = {}
+    for fname in os.listdir(dirname):
+        match = _META_FILE.match(fname)
+        if match:
+            prefix, iternum, tile = match.groups()
+            if iternum is not None:
+                meta_files.setdefault(prefix, set()).add(int(iternum))
+            tiles.setdefault(prefix, set()).add(tile or '')
+    return meta_files, tiles
+
+
+def _get_pool(nthreads):
+    if nthreads not in _thread_pools:
+        _thread_pools[nthreads] = ThreadPool(nthreads)
+    return _thread_pools[nthreads]
+
+
+def _read_layout(fname, tiles, nthreads=_NTHREADS):
+    """
+    Parse the headers of all tiles of an MDS file (given without suffix).
+
+    Returns the header of the first tile, with the global sizes in
+    ``dimList``, and the placement of every tile as a list of
+    ``(suffix, y_start, y_end, x_start, x_end)`` tuples.
+    """
+    tiles = sorted(tiles)
+    meta_fnames = [fname + tile + '.meta' for tile in tiles]
+    if len(tiles) > 1:
+        metas = _get_pool(nthreads).map(parse_meta_file, meta_fnames)
+    else:
+        metas = [parse_meta_file(meta_fnames[0])]
+    layout = []
+    for tile, meta in zip(tiles, metas):
+        (_, x0, x1), (_, y0, y1) = meta['dimList'][:2]
+        layout.append((tile, y0 - 1, y1, x0 - 1, x1))
+    return metas[0], layout
+
+
+def _get_variable_dims(name, ndim):
+    dims = _VARIABLE_DIMS.get(name, ('Z', 'Y', 'X'))
+    return dims[-ndim:]
+
+
+def _squeeze_shape(shape, ndim):
+    # vertical grid files are written as (Nr, 1, 1), and 2D fields may come
+    # with a leading vertical dimension of length 1. Only these extra
+    # dimensions are dropped, so that dimensions of length 1 are kept.
+    shape = tuple(shape)
+    while len(shape) > ndim and shape[-1] == 1:
+        shape = shape[:-1]
+    while len(shape) > ndim and shape[0] == 1:
+        shape = shape[1:]
+    return shape
+
+
+def _read_file(fname, dtype, shape):
+    """Memory-map an MDS file, without reading it."""
+    return np.memmap(fname, dtype=dtype, mode='r', shape=shape)
+
+
+class _MDSArray(object):
+    """
+    A lazy array of shape ``(len(fnames), [nz,] ny, nx)`` holding one
+    record of MDS files, one file (or set of tiles) per entry along the
+    first axis. Indexing memory-maps the files it touches and reads only the
+    requested values, reading several tiles concurrently. Entries without a
+    file (`None`) are missing values.
+    """
+
+    def __init__(self, fnames, dtype, shape, nrecords=1, record=0,
+                 layout=None, nthreads=_NTHREADS):
+        self.fnames = fnames
+        self.file_dtype = np.dtype(dtype)
+        self.nrecords = nrecords
+        self.record = record
+        self.dtype = self.file_dtype.newbyteorder('=')
+        self.shape = (len(fnames),) + tuple(shape)
+        self.ndim = len(self.shape)
+        if layout is None:
+            layout = [('', 0, shape[-2], 0, shape[-1])]
+        self.layout = layout
+        self.nthreads = nthreads
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        file_key, level_key = key[0], key[1:-2]
+        if isinstance(file_key, slice):
+            indices = range(*file_key.indices(len(self.fnames)))
+        else:
+            indices = [file_key]
+        y0, y1, _ = key[-2].indices(self.shape[-2])
+        x0, x1, _ = key[-1].indices(self.shape[-1])
+        level_shape = np.broadcast_to(np.empty(()),
+                                      self.shape[1:-2])[level_key].shape
+
+        fill_value = np.nan if self.dtype.kind in 'fc' else 0
+        data = np.full((len(indices),) + level_shape + (y1 - y0, x1 - x0),
+                       fill_value, dtype=self.dtype)
+        reads = []
+        for n, index in enumerate(indices):
+            if self.fnames[index] is None:
+                continue
+            for tile, ty0, ty1, tx0, tx1 in self.layout:
+                oy0, oy1 = max(y0, ty0), min(y1, ty1)
+                ox0, ox1 = max(x0, tx0), min(x1, tx1)
+                if oy0 >= oy1 or ox0 >= ox1:
+                    continue
+                tile_shape = ((self.nrecords,) + self.shape[1:-2] +
+                              (ty1 - ty0, tx1 - tx0))
+                tile_key = ((self.record,) + level_key +
+                            (slice(oy0 - ty0, oy1 - ty0),
+                             slice(ox0 - tx0, ox1 - tx0)))
+                out_key = ((n, Ellipsis) +
+                           (slice(oy0 - y0, oy1 - y0),
+                            slice(ox0 - x0, ox1 - x0)))
+                reads.append((self.fnames[index] + tile + '.data',
+                              tile_shape, tile_key, out_key))
+
+        def _read(args):
+            fname, tile_shape, tile_key, out_key = args
+            data[out_key] = _read_file(fname, self.file_dtype,
+                                       tile_shape)[tile_key]
+
+        if len(reads) > 1:
+            _get_pool(self.nthreads).map(_read, reads)
+        else:
+            for args in reads:
+                _read(args)
+
+        if not isinstance(file_key, slice):
+            data = data[0]
+        return data
+
+
+def _mds_arrays(fnames, meta, layout=None, nthreads=_NTHREADS):
+    """
+    Build one dask array of shape ``(len(fnames), [nz,] ny, nx)`` for
+    every record of MDS files (given without suffix) with the header
+    `meta` and the tile placement `layout`, with one chunk per file,
+    vertical level and tile.
+    """
+    # dimList starts with the fastest varying dimension
+    shape = tuple(size for size, _, _ in meta['dimList'][::-1])
+    if layout is None:
+        layout = [('', 0, shape[-2], 0, shape[-1])]
+    # chunks line up with the tiles
+    y_starts = sorted(set(tile[1] for tile in layout)) + [shape[-2]]
+    x_starts = sorted(set(tile[3] for tile in layout)) + [shape[-1]]
+    chunks = ((1,) * len(fnames),) + tuple((1,) * s for s in shape[:-2])
+    chunks += (tuple(np.diff(y_starts)), tuple(np.diff(x_starts)))
+
+    arrays = []
+    for record in range(meta['nrecords']):
+        array = _MDSArray(fnames, meta['dataprec'], shape,
+                          meta['nrecords'], record, layout, nthreads)
+        name = 'mds-' + tokenize(fnames, array.file_dtype.str, shape,
+                                 meta['nrecords'], record, layout)
+        arrays.append(dsa.from_array(array, chunks=chunks, name=name,
+                                     lock=False, asarray=False))
+    return arrays
+
+
+def _dimension_coords(dirname, sizes, tiles, read_grid,
+                      nthreads=_NTHREADS):
+    """
+    The 1D coordinates of all dimensions, from the grid files if
+    available and as index ranges otherwise.
+    """
+    def _read_1d(prefix, index):
+        if not (read_grid and prefix in tiles):
+            return None
+        fname = os.path.join(dirname, prefix)
+        meta, layout = _read_layout(fname, tiles[prefix], nthreads)
+        data = _mds_arrays([fname], meta, layout, nthreads)[0][0]
+        data = data.reshape(_squeeze_shape(data.shape, len(index)))
+        return np.asarray(data[index])
+
+    values = {'X': lambda: _read_1d('XC', (0, slice(None))),
+              'Xp1': lambda: _read_1d('XG', (0, slice(None))),
+              'Y': lambda: _read_1d('YC', (slice(None), 0)),
+              'Yp1': lambda: _read_1d('YG', (slice(None), 0)),
+              'Z': lambda: _read_1d('RC', (slice(None),)),
+              'Zp1': lambda: _read_1d('RF', (slice(None),)),
+              'Zl': lambda: _read_1d('RF', (slice(None, -1),)),
+              'Zu': lambda: _read_1d('RF', (slice(1, None),))}
+
+    # the vertical interfaces follow from the centers
+    if 'Z' in sizes:
+        sizes.setdefault('Zp1', sizes['Z'] + 1)
+        sizes.setdefault('Zl', sizes['Z'])
+        sizes.setdefault('Zu', sizes['Z'])
+
+    coords = OrderedDict()
+    for dim, attrs in iteritems(_DIMENSIONS):
+        if dim not in sizes:
+            continue
+        data = values[dim]()
+        if data is None or len(data) != sizes[dim]:
+            data = np.arange(sizes[dim])
+            # keep the grid positions consistent with the shifts
+            shift = attrs.get('c_grid_axis_shift', 0.)
+            if dim == 'Zp1':
+                shift = -0.5
+            data = data + shift
+        coords[dim] = (dim, data, attrs)
+    return coords
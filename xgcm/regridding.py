@@ -3,23 +3,212 @@ from __future__ import print_function, division
 
 import warnings
 import numpy as np
-import xray
+import xarray as xr
+
+try:
+    import dask.array as dsa
+except ImportError:
+    pass
+
+from .duck_array_ops import _is_dask_array, _broadcast_chunks_like
+from .grid import _broadcast_metric
+from .cache import LRUCache
+
 
-# this automatically converts dask arrays to numpy
-# use with caution
 def regrid_vertical(qdarr, trdarr, trlevs, dim):
     """Regrid a DataArray ``q``, co-located with tracer ``trarr``
     to a new vertical grid with levels defined by ``trlevs`` along
-    the specified dimension."""
+    the specified dimension.
 
-    dims = list(qdarr.dims)
-    ax = dims.index(dim)
-    qtr = _regrid_vertical(qdarr.values, trdarr.values,
-                           trlevs, axis=ax)
+    Dask arrays are regridded lazily, block by block along the other
+    dimensions. The dimension ``dim`` is merged into a single chunk.
+
+    To regrid several variables with the same tracer, use
+    :class:`VerticalRegridder`, which computes the bins only once."""
+
+    return VerticalRegridder(trdarr, trlevs, dim, maxbytes=0)(qdarr)
+
+
+class VerticalRegridder(object):
+    """
+    Regrid any number of variables co-located with a tracer to a new
+    vertical grid defined by levels of the tracer.
+
+    The bin index of every cell is the expensive part of regridding. It is
+    computed lazily, the first time a block of the tracer is used, and kept
+    in an LRU cache for all subsequent variables.
+    """
+
+    def __init__(self, trdarr, trlevs, dim, maxbytes=2**28):
+        """
+        Create a new regridder.
+
+        Parameters
+        ----------
+        trdarr : xarray.DataArray
+            The tracer defining the new vertical coordinate
+        trlevs : array_like
+            The levels of the tracer bounding the new vertical cells
+        dim : str
+            The vertical dimension
+        maxbytes : int, optional
+            The maximum memory held by the cached bin indices. The least
+            recently used indices are evicted first, and recomputed when
+            needed again.
+        """
+        self.trlevs = np.asarray(trlevs)
+        self.dim = dim
+        self._trdarr = trdarr
+        self._tr = trdarr.data
+        self._ax = trdarr.get_axis_num(dim)
+        if _is_dask_array(self._tr):
+            self._tr = self._tr.rechunk({self._ax: -1})
+        self._cache = LRUCache(maxbytes)
+
+    def __call__(self, qdarr):
+        """
+        Regrid a DataArray co-located with the tracer.
+
+        Parameters
+        ----------
+        qdarr : xarray.DataArray
+            The data to regrid. Must have the same dims as the tracer.
+
+        Returns
+        -------
+        qtr : xarray.DataArray
+            The data summed in the cells of the new vertical grid
+        """
+        if qdarr.dims != self._trdarr.dims:
+            raise ValueError('qdarr must have the same dims as the tracer, '
+                             'got %s and %s' % (qdarr.dims,
+                                                self._trdarr.dims))
+        ax = self._ax
+        Nbins = len(self.trlevs) - 1
+        q, tr = qdarr.data, self._tr
+        if _is_dask_array(q) or _is_dask_array(tr):
+            tr = dsa.asarray(tr).rechunk({ax: -1})
+            q = dsa.asarray(q).rechunk(tr.chunks)
+            chunks = list(tr.chunks)
+            chunks[ax] = (Nbins,)
+            # the name of the tracer identifies its blocks in the cache
+            qtr = dsa.map_blocks(self._regrid_block, q, tr, tr.name,
+                                 chunks=tuple(chunks), dtype=np.float64)
+        else:
+            qtr = _apply_bins(q, self._get_bins(tr, None), Nbins, axis=ax)
+        return _wrap_regridded(qtr, qdarr, self._trdarr, self.trlevs, ax)
+
+    def _get_bins(self, tr, key):
+        idx = self._cache.get(key)
+        if idx is None:
+            idx = _bin_indices(tr, self.trlevs, axis=self._ax)
+            self._cache[key] = idx
+        return idx
+
+    def _regrid_block(self, q, tr, name, block_info=None):
+        if block_info is None:
+            # dtype inference on empty blocks
+            return _regrid_vertical(q, tr, self.trlevs, axis=self._ax)
+        key = (name, tuple(block_info[1]['chunk-location']))
+        return _apply_bins(q, self._get_bins(tr, key),
+                           len(self.trlevs) - 1, axis=self._ax)
+
+
+def conservative_regrid_vertical(qdarr, trdarr, trlevs, dim,
+                                 thickness=None, grid=None, extensive=True,
+                                 time_dim=None, time_chunk=1):
+    """Conservatively remap a DataArray ``q``, co-located with tracer
+    ``trdarr``, to a new vertical grid with levels defined by ``trlevs``.
+
+    The tracer is taken to vary linearly in depth between the centers of
+    neighboring cells. Every cell then spans a range of tracer values,
+    and its content is split among the target layers in proportion to
+    the overlap of that range with each layer. Cells with zero thickness
+    (e.g. land, where hFac is zero) are skipped. The sum of the content
+    over the vertical is conserved.
+
+    Parameters
+    ----------
+    qdarr : xarray.DataArray
+        The data to remap
+    trdarr : xarray.DataArray
+        The tracer defining the new vertical coordinate. Must have the
+        same dims as `qdarr`.
+    trlevs : array_like
+        The monotonically increasing levels of the tracer bounding the new
+        vertical cells
+    dim : str
+        The vertical dimension
+    thickness : xarray.DataArray, optional
+        The thickness of the cells (e.g. ``drF * hFacC``)
+    grid : xgcm.Grid, optional
+        If `thickness` is not given, the thickness is the metric of the
+        grid axis of `dim` at the position of the tracer
+    extensive : bool, optional
+        Whether `qdarr` is the content of the cells (e.g. a volume flux).
+        If ``False``, `qdarr` is a concentration, and is multiplied by the
+        thickness.
+    time_dim : str, optional
+        If given, the data is remapped lazily in blocks of `time_chunk`
+        steps along this dimension, so that memory stays bounded however
+        long the time series.
+    time_chunk : int, optional
+        The number of time steps per block
+
+    Returns
+    -------
+    qtr : xarray.DataArray
+        The content of the new vertical cells
+    """
+    if qdarr.dims != trdarr.dims:
+        raise ValueError('qdarr must have the same dims as the tracer, '
+                         'got %s and %s' % (qdarr.dims, trdarr.dims))
+    if thickness is None:
+        if grid is None:
+            raise ValueError('Either `thickness` or `grid` must be given.')
+        thickness = grid.get_metric(trdarr, _get_grid_axis(grid, trdarr,
+                                                           dim))
+    trlevs = np.asarray(trlevs)
+    ax = qdarr.get_axis_num(dim)
+    q, tr = qdarr.data, trdarr.data
+    h = _broadcast_metric(thickness, qdarr)
+
+    if time_dim is not None:
+        q = dsa.asarray(q).rechunk({qdarr.get_axis_num(time_dim):
+                                    time_chunk})
+    if _is_dask_array(q) or _is_dask_array(tr) or _is_dask_array(h):
+        q = dsa.asarray(q).rechunk({ax: -1})
+        tr = dsa.asarray(tr).rechunk(q.chunks)
+        h = _broadcast_chunks_like(h, q)
+        chunks = list(q.chunks)
+        chunks[ax] = (len(trlevs) - 1,)
+        qtr = dsa.map_blocks(_conservative_regrid_vertical, q, tr, h,
+                             trlevs=trlevs, axis=ax, extensive=extensive,
+                             chunks=tuple(chunks), dtype=np.float64)
+    else:
+        h = np.broadcast_to(h, q.shape)
+        qtr = _conservative_regrid_vertical(q, tr, h, trlevs, axis=ax,
+                                            extensive=extensive)
+    return _wrap_regridded(qtr, qdarr, trdarr, trlevs, ax)
+
+
+def _get_grid_axis(grid, da, dim):
+    for axis_name, axis in grid.axes.items():
+        try:
+            _, axis_dim = axis._get_axis_coord(da)
+        except KeyError:
+            continue
+        if axis_dim == dim:
+            return axis_name
+    raise KeyError("Dimension '%s' is not on any grid axis." % dim)
+
+
+def _wrap_regridded(qtr, qdarr, trdarr, trlevs, ax):
     # make new coordinates
     trcoord = 0.5 * (trlevs[1:] + trlevs[:-1])
     trcoord_name = trdarr.name + '_coord'
     coords = {}
+    dims = list(qdarr.dims)
     dims[ax] = trcoord_name
     for d in dims:
         try:
@@ -27,48 +216,112 @@ def regrid_vertical(qdarr, trdarr, trlevs, dim):
         except KeyError:
             pass
     coords[trcoord_name] = trcoord
-    return xray.DataArray(qtr, coords, dims)
+    return xr.DataArray(qtr, coords, dims)
 
 
-# numpy version
-def _regrid_vertical(q, tr, trlevs, axis=0, extra_mask=None):
-    """Regrid a variable q into tracer coordinates defined by trlevs
-    along a specified axis."""
-    assert q.shape == tr.shape
+# numpy versions
+def _conservative_regrid_vertical(q, tr, h, trlevs, axis=0, extensive=True):
+    """Conservatively remap q with cell thickness h into tracer
+    coordinates defined by trlevs along a specified axis."""
+    assert q.shape == tr.shape == h.shape
     Nbins = len(trlevs)-1
     # make sure the vertical axis is axis 0
     if axis!=0:
         q = q.swapaxes(0,axis)
         tr = tr.swapaxes(0,axis)
+        h = h.swapaxes(0,axis)
     # reshape to flatten other axes
     shape_orig = q.shape
-    Npts = np.prod(q.shape[1:])
+    Npts = int(np.prod(q.shape[1:]))
     Nr = q.shape[0]
     q = q.reshape((Nr,Npts))
     tr = tr.reshape((Nr,Npts))
-    ## mask any values of outside the allowed range
-    #tr_m = np.ma.masked_greater_equal(
-    #            np.ma.masked_less(tr, trlevs.min()), trlevs.max())
-    #if self.extra_mask is not None:
-    #    tr_m.mask += self.extra_mask
-    #mask = tr_m.mask
+    h = h.reshape((Nr,Npts))
+
+    valid = (h > 0) & ~np.isnan(tr)
+    content = q * h if not extensive else q
+    content = np.where(valid & ~np.isnan(content), content, 0.)
+
+    # tracer at the cell interfaces, linear in depth between the centers
+    # of neighboring cells, and constant in the outer half of the top and
+    # bottom cells and of cells next to land
+    tr_i = np.empty((Nr+1,Npts), dtype=np.result_type(tr, np.float64))
+    tr_i[0] = tr[0]
+    tr_i[-1] = tr[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interior = ((tr[:-1]*h[1:] + tr[1:]*h[:-1]) /
+                    (h[:-1] + h[1:]))
+    interior = np.where(valid[1:], interior, tr[:-1])
+    tr_i[1:-1] = np.where(valid[:-1], interior, tr[1:])
+
+    # the range of tracer values spanned by every cell, limited to the
+    # target levels, so that all content ends up in a layer
+    lower = np.clip(np.minimum(tr_i[:-1], tr_i[1:]), trlevs[0], trlevs[-1])
+    upper = np.clip(np.maximum(tr_i[:-1], tr_i[1:]), trlevs[0], trlevs[-1])
+    width = upper - lower
+    thin = ~(width > 0)
+    width[thin] = 1.
+
+    # accumulate the fraction of every cell below each level, one target
+    # level at a time to keep the memory bounded
+    qtr = np.zeros((Nbins, Npts))
+    below_prev = 0.
+    for n in range(1, Nbins):
+        below = np.clip((trlevs[n] - lower) / width, 0., 1.)
+        below[thin] = lower[thin] < trlevs[n]
+        qtr[n-1] = np.sum(content * (below - below_prev), axis=0)
+        below_prev = below
+    qtr[Nbins-1] = np.sum(content * (1. - below_prev), axis=0)
+
+    qtr = qtr.reshape((Nbins,) + shape_orig[1:])
+    if axis!=0:
+        qtr = qtr.swapaxes(0,axis)
+    return qtr
+
+
+def _regrid_vertical(q, tr, trlevs, axis=0, extra_mask=None):
+    """Regrid a variable q into tracer coordinates defined by trlevs
+    along a specified axis."""
+    assert q.shape == tr.shape
+    return _apply_bins(q, _bin_indices(tr, trlevs, axis=axis),
+                       len(trlevs)-1, axis=axis)
+
+
+def _bin_indices(tr, trlevs, axis=0):
+    """Find the flat index of every point of tr in the (Nbins, Npts)
+    output of the regridding, with the vertical axis moved first and the
+    other axes flattened."""
+    Nbins = len(trlevs)-1
+    # make sure the vertical axis is axis 0
+    if axis!=0:
+        tr = tr.swapaxes(0,axis)
+    # reshape to flatten other axes
+    Npts = int(np.prod(tr.shape[1:]))
+    Nr = tr.shape[0]
+    tr = tr.reshape((Nr,Npts))
 
     # get indices of bins for whole array
-    idx = np.digitize(tr.ravel(), trlevs)-1
-    idx.shape = tr.shape
+    idx = np.digitize(tr, trlevs)-1
 
     # if there were values below the bottom bin, idx will have values less than 0
     idx[idx<0] = 0
     idx[idx>=Nbins] = Nbins-1
 
-    # now do the bin counting for each point
-    qtr = np.zeros((Nbins, Npts))
-    for n in xrange(Npts):
-        if Nr==1:
-            # can use a simple index array
-            qtr[idx[:,n],n] = q[:,n]
-        else:
-            qtr[:,n] = np.bincount(idx[:,n], weights=q[:,n], minlength=Nbins)[:Nbins]
+    # offset the bin index of every point by its column, so that a single
+    # bincount fills the (Nbins, Npts) output
+    idx *= Npts
+    idx += np.arange(Npts)
+    return idx.ravel()
+
+
+def _apply_bins(q, idx, Nbins, axis=0):
+    """Sum q into the bins found by _bin_indices."""
+    if axis!=0:
+        q = q.swapaxes(0,axis)
+    shape_orig = q.shape
+    Npts = int(np.prod(q.shape[1:]))
+    qtr = np.bincount(idx, weights=q.ravel(),
+                      minlength=Nbins*Npts)[:Nbins*Npts]
     qtr = qtr.reshape((Nbins,) + shape_orig[1:])
     if axis!=0:
         qtr = qtr.swapaxes(0,axis)
@@ -0,0 +1,202 @@
+"""
+Compact descriptions of grids, without their data.
+
+A :class:`GridSpec` records the axes of a :class:`xgcm.Grid` (the names,
+lengths and positions of their coordinates, their periodicity and default
+shifts), the names of its metrics and its face connections. It is cheap to
+pickle and can be written to JSON, so that it can be shipped to distributed
+workers, which rebuild a working Grid from it and the arrays they already
+have::
+
+    spec = grid.spec
+    text = spec.to_json()
+    grid = GridSpec.from_json(text).to_grid(ds)
+"""
+from __future__ import print_function, division
+
+import json
+
+
+def _tuples(value):
+    """Nested lists (e.g. from JSON) as nested tuples."""
+    if isinstance(value, list):
+        return tuple(_tuples(v) for v in value)
+    return value
+
+
+class AxisSpec(object):
+    """
+    The description of one :class:`xgcm.Axis`.
+
+    Attributes
+    ----------
+    name : str
+        The name of the axis
+    periodic : bool
+        Whether the axis is periodic
+    coords : tuple
+        ``(position, dim, length)`` for every coordinate of the axis
+    default_shifts : tuple
+        ``(position_from, position_to)`` pairs
+    """
+    __slots__ = ('name', 'periodic', 'coords', 'default_shifts')
+
+    def __init__(self, name, periodic, coords, default_shifts):
+        self.name = name
+        self.periodic = bool(periodic)
+        self.coords = tuple((pos, dim, int(size))
+                            for pos, dim, size in coords)
+        self.default_shifts = tuple(sorted(default_shifts))
+
+    def __repr__(self):
+        return ("<xgcm.spec.AxisSpec '%s' (%s): %s>"
+                % (self.name, 'periodic' if self.periodic else 'not periodic',
+                   ', '.join('%s=%s(%i)' % c for c in self.coords)))
+
+    def _state(self):
+        return (self.name, self.periodic, self.coords, self.default_shifts)
+
+    def __getstate__(self):
+        return self._state()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __eq__(self, other):
+        return isinstance(other, AxisSpec) and self._state() == other._state()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._state())
+
+    @classmethod
+    def from_axis(cls, axis):
+        """Describe an existing :class:`xgcm.Axis`."""
+        coords = [(pos, coord.name, len(coord))
+                  for pos, coord in axis.coords.items()]
+        return cls(axis._name, axis._periodic, coords,
+                   axis._default_shifts.items())
+
+
+class GridSpec(object):
+    """
+    The description of a :class:`xgcm.Grid`, without its data.
+
+    Attributes
+    ----------
+    axes : tuple of AxisSpec
+        The axes of the grid
+    backend : str or None
+        The compute backend of the grid
+    metrics : tuple
+        ``(axes, variable_names)`` for every set of metrics, where `axes`
+        is a tuple of axis names
+    face_connections : tuple or None
+        ``(face_dim, connections)``, where `connections` holds
+        ``(face, ((axis_name, (left_link, right_link)), ...))`` for every
+        face (see the `face_connections` argument of :class:`xgcm.Grid`)
+    """
+    __slots__ = ('axes', 'backend', 'metrics', 'face_connections')
+
+    def __init__(self, axes, backend=None, metrics=(), face_connections=None):
+        self.axes = tuple(axes)
+        self.backend = backend
+        self.metrics = tuple((tuple(sorted(key)), tuple(names))
+                             for key, names in metrics)
+        if face_connections is not None:
+            facedim, connections = face_connections
+            face_connections = (facedim, tuple(sorted(
+                (face, tuple(sorted(_tuples(list(links)))))
+                for face, links in connections)))
+        self.face_connections = face_connections
+
+    def __repr__(self):
+        summary = ['<xgcm.spec.GridSpec>']
+        summary += ['  %r' % axis for axis in self.axes]
+        return '\n'.join(summary)
+
+    def _state(self):
+        return (tuple(a._state() for a in self.axes), self.backend,
+                self.metrics, self.face_connections)
+
+    def __getstate__(self):
+        return self._state()
+
+    def __setstate__(self, state):
+        axes, backend, metrics, face_connections = state
+        self.__init__([AxisSpec(*a) for a in axes], backend, metrics,
+                      face_connections)
+
+    def __eq__(self, other):
+        return isinstance(other, GridSpec) and self._state() == other._state()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._state())
+
+    @classmethod
+    def from_grid(cls, grid):
+        """Describe an existing :class:`xgcm.Grid`."""
+        axes = [AxisSpec.from_axis(ax) for ax in grid.axes.values()]
+        metrics = [(key, [m.name for m in metric_vars])
+                   for key, metric_vars in grid._metrics.items()]
+        face_connections = None
+        if grid._face_connections is not None:
+            facedim, connections = grid._face_connections
+            face_connections = (facedim, [(face, links.items())
+                                          for face, links
+                                          in connections.items()])
+        return cls(axes, grid._backend, metrics, face_connections)
+
+    def to_grid(self, ds=None, **kwargs):
+        """
+        Create a working :class:`xgcm.Grid` from this description.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset or list of xarray.DataArray, optional
+            Data holding the axis coordinates and metrics of the grid (see
+            :meth:`xgcm.Grid.from_spec`)
+        **kwargs
+            Passed to :meth:`xgcm.Grid.from_spec`
+
+        Returns
+        -------
+        grid : xgcm.Grid
+        """
+        # import here to avoid circular imports
+        from .grid import Grid
+        return Grid.from_spec(self, ds, **kwargs)
+
+    def to_dict(self):
+        """A dict of plain Python types, suitable for JSON."""
+        return {'axes': [{'name': a.name, 'periodic': a.periodic,
+                          'coords': [list(c) for c in a.coords],
+                          'default_shifts': [list(s)
+                                             for s in a.default_shifts]}
+                         for a in self.axes],
+                'backend': self.backend,
+                'metrics': [[list(key), list(names)]
+                            for key, names in self.metrics],
+                'face_connections': self.face_connections}
+
+    @classmethod
+    def from_dict(cls, d):
+        """Create a GridSpec from the output of :meth:`to_dict`."""
+        axes = [AxisSpec(a['name'], a['periodic'], _tuples(a['coords']),
+                         _tuples(a['default_shifts'])) for a in d['axes']]
+        return cls(axes, d.get('backend'), _tuples(d.get('metrics', [])),
+                   _tuples(d.get('face_connections')))
+
+    def to_json(self):
+        """Serialize to a JSON string."""
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, text):
+        """Create a GridSpec from the output of :meth:`to_json`."""
+        return cls.from_dict(json.loads(text))
@@ -6,6 +6,7 @@ import numpy as np
 from xarray.testing import assert_allclose, assert_equal
 
 
+from xgcm.grid import Axis
 from xgcm.autogenerate import generate_axis, generate_grid_ds, \
     _parse_boundary_params, _parse_position, \
     _position_to_relative, _auto_pad, _fill_attrs
@@ -257,6 +258,31 @@ def test_generate_grid_ds():
     assert_equal(ds_new, ds_out_left)
 
 
+def test_generate_grid_ds_matches_generate_axis():
+    axis_dims = {'X': 'lon', 'Y': 'lat', 'Z': 'z'}
+    axis_coords = {'X': 'llon', 'Y': 'llat', 'Z': 'zz'}
+    discontinuity = {'lon': 360, 'lat': 180, 'llon': 360, 'llat': 180}
+    pad = {'z': 'auto', 'zz': 'auto'}
+    ds_old = ds_original.copy()
+    ds_new = generate_grid_ds(ds_old, axis_dims, axis_coords,
+                              boundary_discontinuity=discontinuity, pad=pad)
+
+    expected = ds_original
+    for ax, dim in iteritems(axis_dims):
+        expected = generate_axis(expected, ax, dim, dim,
+                                 boundary_discontinuity=discontinuity.get(dim),
+                                 pad=pad.get(dim))
+    for ax, name in iteritems(axis_coords):
+        expected = generate_axis(expected, ax, name, axis_dims[ax],
+                                 boundary_discontinuity=discontinuity.get(
+                                     name),
+                                 pad=pad.get(name), attrs_from_scratch=False)
+    xr.testing.assert_identical(ds_new, expected)
+    # the input is left untouched
+    xr.testing.assert_identical(ds_old, ds_original)
+    assert ds_old['lon'].attrs == {}
+
+
 def test_parse_boundary_params():
     assert _parse_boundary_params(360, 'anything') == 360
     assert _parse_boundary_params({'something': 360}, 'something') == 360
@@ -308,3 +334,100 @@ def test_fill_attrs():
     a = _fill_attrs(ds_out_right['lon'], 'center', 'Y')
     assert a.attrs['axis'] == 'Y'
     assert ('c_grid_axis_shift' not in a.attrs.keys())
+
+
+def test_auto_pad_dask():
+    dask = pytest.importorskip('dask')
+    ds_chunked = ds_original.chunk({'lat': 45, 'z': 5})
+    for rel in ['left', 'right']:
+        fill_value = _auto_pad(ds_chunked['zz'], 'z', rel)
+        assert isinstance(fill_value, dask.array.Array)
+        assert fill_value.compute() == _auto_pad(ds_original['zz'], 'z', rel)
+
+    def _no_compute(*args, **kwargs):
+        raise AssertionError('the grid was computed')
+    with dask.config.set(scheduler=_no_compute):
+        ds_new = generate_grid_ds(ds_chunked, {'Z': 'z'}, {'Z': 'zz'},
+                                  pad='auto')
+    assert isinstance(ds_new['zz_left'].data, dask.array.Array)
+    assert_allclose(ds_new['zz_left'].compute(), ds_out_left['zz_left'])
+
+
+@pytest.mark.parametrize('chunks', [None, {'lat': 45, 'lon': 200, 'z': 5}])
+def test_generate_grid_ds_corners(chunks):
+    axis_dims = {'X': 'lon', 'Y': 'lat', 'Z': 'z'}
+    axis_coords = {'X': 'llon', 'Y': 'llat', 'Z': 'zz'}
+    discontinuity = {'lon': 360, 'lat': 180, 'llon': 360, 'llat': 180}
+    ds = ds_original.chunk(chunks) if chunks else ds_original
+    ds_new = generate_grid_ds(ds, axis_dims, axis_coords,
+                              boundary_discontinuity=discontinuity,
+                              pad={'z': 'auto', 'zz': 'auto'},
+                              corner_coords=['llon', 'llat', 'zz'])
+
+    # the same as interpolating the generated coordinates along the other
+    # axes, which are wrapped (X, Y) or padded (Z) like their dimensions
+    expected = {}
+    for name, other_axes in [('llon', ['Y']), ('llat', ['X']),
+                             ('zz', ['X', 'Y'])]:
+        da = ds_new[axis_coords[[ax for ax in axis_coords
+                                  if axis_coords[ax] == name][0]] + '_left']
+        for ax in other_axes:
+            da = Axis(ds_new, ax, periodic=True).interp(da, 'left')
+        expected[name] = da
+    for name in ['llon', 'llat', 'zz']:
+        actual = ds_new[name + '_corner']
+        assert actual.dims == expected[name].dims
+        if chunks:
+            assert actual.data.chunks == ds[name].data.chunks
+        np.testing.assert_allclose(actual.values, expected[name].values)
+    assert_allclose(ds_new.llon_left, ds_out_left.llon_left)
+    assert_allclose(ds_new.llat_left, ds_out_left.llat_left)
+
+
+@pytest.mark.parametrize('chunks', [None, {'lat': 45, 'lon': 200}])
+def test_generate_grid_ds_corners_mixed(chunks):
+    # wrapped longitude and padded latitude
+    axis_dims = {'X': 'lon', 'Y': 'lat'}
+    axis_coords = {'X': 'llon', 'Y': 'llat'}
+    ds = ds_original.chunk(chunks) if chunks else ds_original
+    ds_new = generate_grid_ds(ds, axis_dims, axis_coords,
+                              boundary_discontinuity={'lon': 360,
+                                                      'llon': 360},
+                              pad={'lat': 'auto', 'llat': 'auto'},
+                              corner_coords=['llon', 'llat'])
+
+    # the coordinates are extended along the padded axis, and wrapped
+    # without discontinuity along the other
+    llon = Axis(ds_new, 'Y', periodic=False).interp(ds_new.llon_left,
+                                                    'left',
+                                                    boundary='extend')
+    llat = Axis(ds_new, 'X', periodic=True).interp(ds_new.llat_left, 'left')
+    for name, expected in [('llon', llon), ('llat', llat)]:
+        actual = ds_new[name + '_corner']
+        assert actual.dims == expected.dims
+        np.testing.assert_allclose(actual.values, expected.values)
+    np.testing.assert_allclose(ds_new.llon_corner.values[0, :3],
+                               [-180., -179.5, -179.])
+
+
+def test_generate_grid_ds_lazy():
+    dask = pytest.importorskip('dask')
+    ds_chunked = ds_original.chunk({'lat': 45, 'lon': 200, 'z': 5})
+    axis_dims = {'X': 'lon', 'Y': 'lat'}
+    axis_coords = {'X': 'llon', 'Y': 'llat'}
+
+    def _no_compute(*args, **kwargs):
+        raise AssertionError('the grid was computed')
+    with dask.config.set(scheduler=_no_compute):
+        ds_new = generate_grid_ds(ds_chunked, axis_dims, axis_coords,
+                                  pad={'lon': 'auto', 'lat': 'auto',
+                                       'llon': 'auto', 'llat': 'auto'},
+                                  corner_coords=['llon'])
+    expected = generate_grid_ds(ds_original, axis_dims, axis_coords,
+                                pad={'lon': 'auto', 'lat': 'auto',
+                                     'llon': 'auto', 'llat': 'auto'},
+                                corner_coords=['llon'])
+    for name in ['llon_left', 'llat_left', 'llon_corner']:
+        assert isinstance(ds_new[name].data, dask.array.Array)
+        assert ds_new[name].data.chunks == ds_chunked['llon'].data.chunks
+        assert_allclose(ds_new[name].compute(), expected[name])
@@ -0,0 +1,121 @@
+from __future__ import print_function
+import warnings
+import pytest
+import xarray as xr
+import numpy as np
+
+from xgcm.grid import Grid, raw_interp_function, raw_diff_function
+from xgcm import backends
+
+from . datasets import all_datasets, datasets
+
+
+def _require_backend(backend):
+    if backend == 'numexpr':
+        pytest.importorskip('numexpr')
+    elif backend == 'numba':
+        pytest.importorskip('numba')
+
+
+@pytest.fixture
+def restore_backend():
+    backend = backends._global_backend['name']
+    yield
+    backends.set_backend(backend)
+
+
+@pytest.mark.parametrize('dtype', ['f8', 'f4', 'i8'])
+@pytest.mark.parametrize('kernel', ['interp', 'diff'])
+@pytest.mark.parametrize('backend', ['numpy', 'numexpr', 'numba'])
+def test_kernel_equivalence(backend, kernel, dtype):
+    _require_backend(backend)
+    numpy_kernel = {'interp': raw_interp_function,
+                    'diff': raw_diff_function}[kernel]
+    f = backends.get_kernel(kernel, backend)
+
+    data = (100 * np.random.rand(7, 50)).astype(dtype)
+    left, right = data[:, :-1], data[:, 1:]
+    expected = numpy_kernel(left, right)
+    actual = f(left, right)
+    assert actual.dtype == expected.dtype
+    np.testing.assert_array_equal(actual, expected)
+
+    # broadcasting against a single boundary cell
+    np.testing.assert_array_equal(f(np.asarray(0., dtype), data[:, :1]),
+                                  numpy_kernel(np.asarray(0., dtype),
+                                               data[:, :1]))
+
+
+@pytest.mark.parametrize('chunks', [None, 40])
+@pytest.mark.parametrize('backend', ['numexpr', 'numba'])
+def test_axis_backends(all_datasets, backend, chunks):
+    _require_backend(backend)
+    ds, periodic, expected = all_datasets
+    grid = Grid(ds, periodic=periodic)
+    grid_backend = Grid(ds, periodic=periodic, backend=backend)
+
+    for axis_name, axis in grid.axes.items():
+        boundary = None if axis._periodic else 'extend'
+        for varname in ['data_c', 'data_g']:
+            da = ds[varname]
+            if chunks:
+                da = da.chunk(chunks)
+            for func in ['interp', 'diff']:
+                expected = getattr(grid, func)(da, axis_name,
+                                               boundary=boundary)
+                per_call = getattr(grid, func)(da, axis_name,
+                                               boundary=boundary,
+                                               backend=backend)
+                per_grid = getattr(grid_backend, func)(da, axis_name,
+                                                       boundary=boundary)
+                xr.testing.assert_allclose(expected, per_call, rtol=0,
+                                           atol=1e-14)
+                xr.testing.assert_allclose(expected, per_grid, rtol=0,
+                                           atol=1e-14)
+
+
+@pytest.mark.parametrize('backend', ['numexpr', 'numba'])
+def test_set_backend(backend, restore_backend):
+    _require_backend(backend)
+    backends.set_backend(backend)
+    assert backends.get_backend() == backend
+    assert (backends.get_kernel('interp') is
+            backends._load_backend(backend)['interp'])
+
+    ds = datasets['2d_left']
+    grid = Grid(ds)
+    np.testing.assert_allclose(grid.interp(ds.data_c, ['X', 'Y']).data,
+                               grid.interp(ds.data_c, ['X', 'Y'],
+                                           backend='numpy').data)
+
+    backends.set_backend(None)
+    assert backends.get_backend() == 'numpy'
+
+
+def test_backend_errors(restore_backend):
+    with pytest.raises(ValueError):
+        backends.set_backend('fortran')
+    with pytest.raises(ValueError):
+        backends.get_kernel('interp', 'fortran')
+    with pytest.raises(ValueError):
+        backends.get_kernel('laplacian')
+
+
+def test_backend_fallback():
+    def _load_missing():
+        raise ImportError('no module named missing')
+    backends.register_backend('missing', _load_missing)
+    try:
+        assert 'missing' not in backends.available_backends()
+        with pytest.warns(UserWarning):
+            f = backends.get_kernel('diff', 'missing')
+        assert f is raw_diff_function
+        # the fallback is resolved (and warned about) only once
+        with warnings.catch_warnings(record=True) as record:
+            warnings.simplefilter('always')
+            f = backends.get_kernel('interp', 'missing')
+        assert len(record) == 0
+        assert f is raw_interp_function
+    finally:
+        del backends._backend_loaders['missing']
+        del backends._resolved_backends['missing']
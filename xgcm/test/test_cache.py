@@ -0,0 +1,265 @@
+from __future__ import print_function
+import pickle
+import pytest
+import numpy as np
+import xarray as xr
+import dask.array as dsa
+
+from xgcm.cache import LRUCache, DiskCache, data_checksum
+from xgcm.grid import Grid
+
+from . datasets import datasets
+from . test_metrics import _metrics_dataset
+
+
+def test_lru_cache():
+    cache = LRUCache(maxbytes=3 * 80)
+    arrays = [np.full(10, n, dtype='f8') for n in range(4)]
+    for n in range(3):
+        cache[n] = arrays[n]
+    assert len(cache) == 3
+    assert cache.nbytes == 240
+
+    # touch the oldest entry, so that the second one is evicted
+    assert cache[0] is arrays[0]
+    cache[3] = arrays[3]
+    assert sorted(cache.keys()) == [0, 2, 3]
+    assert 1 not in cache
+    assert cache.get(1) is None
+    with pytest.raises(KeyError):
+        cache[1]
+
+    # replacing an entry updates the size
+    cache[3] = arrays[3][:5]
+    assert cache.nbytes == 200
+    del cache[3]
+    assert cache.nbytes == 160
+
+    # values larger than the cache are not stored
+    cache['big'] = np.zeros(100)
+    assert 'big' not in cache
+    assert cache.nbytes == 160
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_lru_cache_unbounded():
+    cache = LRUCache()
+    for n in range(100):
+        cache[n] = np.zeros(1000)
+    assert len(cache) == 100
+    # values without nbytes are counted as empty
+    cache['key'] = 'value'
+    assert cache['key'] == 'value'
+    assert cache.nbytes == 100 * 8000
+
+
+def test_lru_cache_pickle():
+    cache = LRUCache(maxbytes=1000)
+    cache[0] = np.zeros(10)
+    cache_new = pickle.loads(pickle.dumps(cache))
+    assert cache_new.maxbytes == 1000
+    assert len(cache_new) == 0
+
+
+@pytest.mark.parametrize('chunks', [None, 20])
+def test_grid_result_cache(chunks):
+    ds = datasets['2d_left']
+    if chunks:
+        ds = ds.chunk(chunks)
+    grid = Grid(ds, cache_bytes=2**30)
+    assert grid.cache_info()['entries'] == 0
+
+    first = grid.interp(ds.data_c, 'X')
+    xr.testing.assert_identical(grid.interp(ds.data_c, 'X'), first)
+    assert grid.cache_info()['hits'] == 1
+    assert grid.cache_info()['misses'] == 1
+
+    # different arguments are cached separately
+    other = grid.interp(ds.data_c, 'X', to='left')
+    assert other is not first
+    xr.testing.assert_identical(other, first)
+    xr.testing.assert_allclose(grid.diff(ds.data_c, ['X', 'Y']),
+                               Grid(ds).diff(ds.data_c, ['X', 'Y']))
+    grid.cumsum(ds.data_c, 'Y', boundary='fill')
+    grid.cumsum(ds.data_c, 'Y', boundary='fill')
+    info = grid.cache_info()
+    assert info['entries'] == 4
+    assert info['hits'] == 2
+    assert info['maxbytes'] == 2**30
+
+    grid.clear_cache()
+    assert grid.cache_info()['entries'] == 0
+    assert grid.cache_info()['hits'] == 0
+    xr.testing.assert_identical(grid.interp(ds.data_c, 'X'), first)
+    assert grid.cache_info()['misses'] == 1
+
+
+def test_grid_result_cache_identity():
+    ds = datasets['1d_left']
+    grid = Grid(ds, cache_bytes=2**30)
+    data = ds.data_c.values.copy()
+    da = ds.data_c.copy(data=data)
+    expected = grid.diff(da, 'X')
+    # new data with the same values is a cache hit
+    xr.testing.assert_identical(
+        grid.diff(ds.data_c.copy(data=data.copy()), 'X'), expected)
+    assert grid.cache_info()['hits'] == 1
+
+    # data changed in place is not
+    da.values[:] = 100
+    xr.testing.assert_identical(grid.diff(da, 'X'), Grid(ds).diff(da, 'X'))
+    assert grid.cache_info()['hits'] == 1
+
+    # neither are different coordinate values with the same names
+    shifted = da.assign_coords(XC=da.XC + 1)
+    xr.testing.assert_identical(grid.diff(shifted, 'X'),
+                                Grid(ds).diff(shifted, 'X'))
+    assert grid.cache_info()['hits'] == 1
+
+    # results larger than the cache are not stored
+    grid = Grid(ds, cache_bytes=8)
+    grid.diff(ds.data_c, 'X')
+    assert grid.cache_info()['entries'] == 0
+    assert Grid(ds).cache_info() == {}
+
+
+def test_grid_result_cache_writable():
+    ds, metrics = _metrics_dataset()
+    grid = Grid(ds, metrics=metrics, cache_bytes=2**20)
+    expected = Grid(ds, metrics=metrics).diff(ds.tracer, 'X')
+    # results can be modified without changing the cache
+    first = grid.diff(ds.tracer, 'X')
+    first.data *= 2
+    grid.diff(ds.tracer, 'X').values[0] = 1
+    # the cached difference is not changed by operations using it
+    xr.testing.assert_allclose(grid.derivative(ds.tracer, 'X'),
+                               Grid(ds, metrics=metrics).derivative(
+                                   ds.tracer, 'X'))
+    actual = grid.diff(ds.tracer, 'X')
+    assert grid.cache_info()['hits'] == 3
+    xr.testing.assert_identical(actual, expected)
+
+
+def test_disk_cache(tmpdir):
+    path = str(tmpdir.join('cache'))
+    cache = DiskCache(path, maxbytes=3 * 80 + 3 * 128)
+    arrays = [np.full(10, n, dtype='f8') for n in range(4)]
+    for n in range(3):
+        cache[('array', n)] = arrays[n]
+    assert len(cache) == 3
+    assert ('array', 0) in cache
+    assert cache.get(('array', 5)) is None
+
+    # other instances (e.g. in other processes) share the files
+    loaded = DiskCache(path).get(('array', 1))
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, arrays[1])
+
+    # the least recently used file is deleted
+    import os
+    import time
+    past = time.time() - 100
+    for n in range(3):
+        os.utime(cache._filename(('array', n)), (past + n, past + n))
+    cache.get(('array', 0))
+    cache[('array', 3)] = arrays[3]
+    assert len(cache) == 3
+    assert ('array', 1) not in cache
+    assert ('array', 0) in cache
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_data_checksum():
+    data = np.random.rand(5, 4)
+    assert data_checksum(data) == data_checksum(data.copy())
+    assert data_checksum(data) != data_checksum(data + 1)
+    assert data_checksum(data[:, ::2]) == data_checksum(data[:, ::2].copy())
+    dask = pytest.importorskip('dask.array')
+    assert (data_checksum(dask.from_array(data, chunks=2)) ==
+            data_checksum(dask.from_array(data, chunks=2)))
+
+
+@pytest.mark.parametrize('chunks', [None, 40])
+def test_grid_disk_cache(tmpdir, chunks):
+    ds = datasets['2d_left']
+    if chunks:
+        ds = ds.chunk(chunks)
+    path = str(tmpdir.join('cache'))
+    expected = Grid(ds).interp(ds.data_c, 'X')
+
+    grid = Grid(ds, disk_cache=path)
+    first = grid.interp(ds.data_c, 'X')
+    xr.testing.assert_allclose(first, expected)
+    info = grid.cache_info()
+    assert info['disk_misses'] == 1
+    assert info['disk_entries'] == 1
+
+    # a new grid, as in a later session, loads the stored result
+    grid = Grid(ds, disk_cache=DiskCache(path))
+    actual = grid.interp(ds.data_c, 'X')
+    assert grid.cache_info()['disk_hits'] == 1
+    # the names of dask results are the names of their dask arrays
+    xr.testing.assert_identical(actual.rename(None), expected.rename(None))
+    if chunks:
+        assert actual.data.chunks == expected.data.chunks
+    else:
+        assert isinstance(actual.data, np.memmap)
+
+    # other arguments, data or grids are different entries
+    grid.interp(ds.data_c, 'X', to='left')
+    grid.interp(ds.data_c + 1, 'X')
+    Grid(ds, periodic=False, disk_cache=path).interp(ds.data_c, 'X',
+                                                     boundary='fill')
+    assert grid.cache_info()['disk_hits'] == 1
+    assert grid.cache_info()['disk_entries'] == 4
+
+    grid.clear_cache(disk=True)
+    assert grid.cache_info()['disk_entries'] == 0
+
+
+def test_grid_disk_cache_metric_ops(tmpdir):
+    ds, metrics = _metrics_dataset()
+    path = str(tmpdir.join('cache'))
+    expected = Grid(ds, metrics=metrics).derivative(ds.tracer, 'X')
+    grid = Grid(ds, metrics=metrics, disk_cache=path)
+    for n in range(2):
+        # the second difference is a read-only, memory-mapped hit
+        xr.testing.assert_allclose(grid.derivative(ds.tracer, 'X'),
+                                   expected)
+    assert grid.cache_info()['disk_hits'] == 1
+    xr.testing.assert_allclose(
+        Grid(ds, metrics=metrics, disk_cache=path).derivative(ds.tracer,
+                                                              'X'),
+        expected)
+
+
+class _FillValue(object):
+    """A fill value with the default, address-based `repr`."""
+    def __init__(self, value):
+        self.value = value
+
+    def __float__(self):
+        return self.value
+
+
+def test_grid_disk_cache_kwargs(tmpdir):
+    ds = datasets['1d_left']
+    path = str(tmpdir.join('cache'))
+    grid = Grid(ds, periodic=False, disk_cache=path)
+    expected = Grid(ds, periodic=False).interp(ds.data_c, 'X',
+                                               boundary='fill', fill_value=2.)
+    # arguments without a stable representation are not stored on disk
+    for fill_value in [_FillValue(2.), dsa.from_array(np.array(2.),
+                                                      chunks=())]:
+        xr.testing.assert_allclose(
+            grid.interp(ds.data_c, 'X', boundary='fill',
+                        fill_value=fill_value), expected)
+    assert grid.cache_info()['disk_entries'] == 0
+
+    grid.interp(ds.data_c, 'X', boundary='fill', fill_value=np.float64(2))
+    assert grid.cache_info()['disk_entries'] == 1
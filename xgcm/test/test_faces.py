@@ -0,0 +1,178 @@
+from __future__ import print_function
+import pytest
+import xarray as xr
+import numpy as np
+
+from xgcm.grid import Grid
+
+N = 6
+
+
+def _coords(nx, ny):
+    return {'XC': ('XC', np.arange(nx) + 0.5, {'axis': 'X'}),
+            'XG': ('XG', np.arange(nx) * 1., {'axis': 'X',
+                                              'c_grid_axis_shift': -0.5}),
+            'YC': ('YC', np.arange(ny) + 0.5, {'axis': 'Y'}),
+            'YG': ('YG', np.arange(ny) * 1., {'axis': 'Y',
+                                              'c_grid_axis_shift': -0.5})}
+
+
+def _rotate(a):
+    # face 1 of the rotated layout: its X axis runs along global -Y and its
+    # Y axis along global +X
+    return a[::-1, :].T
+
+
+def _rotate180(a):
+    return a[::-1, ::-1]
+
+
+# two faces of size N x N, making up a global N x 2N mosaic. The fields
+# `ds_global.c` (at cell centers), `ds_global.u` (at XG) and `ds_global.v`
+# (at YG) are split into the two faces according to the layout.
+_LAYOUTS = {
+    # face 1 lies to the right of face 0, with the same orientation
+    'straight': {'face': {0: {'X': (None, (1, 'X', False))},
+                          1: {'X': ((0, 'X', False), None)}}},
+    # face 1 lies to the right of face 0, rotated by 90 degrees
+    'rotated': {'face': {0: {'X': (None, (1, 'Y', False))},
+                         1: {'Y': ((0, 'X', False), None)}}},
+    # face 1 lies to the left of face 0, rotated by 180 degrees
+    'reversed': {'face': {0: {'X': ((1, 'X', True), None),
+                              'Y': (None, None)},
+                          1: {'X': ((0, 'X', True), None),
+                              'Y': (None, None)}}},
+}
+
+
+def _face_datasets(layout):
+    ds_global = xr.Dataset(coords=_coords(2 * N, N))
+    for name, dims in [('c', ('YC', 'XC')), ('u', ('YC', 'XG')),
+                       ('v', ('YG', 'XC')), ('uc', ('YC', 'XC')),
+                       ('vc', ('YC', 'XC'))]:
+        ds_global[name] = (dims, np.random.rand(N, 2 * N))
+
+    g = {name: ds_global[name].values for name in ds_global.data_vars}
+    west = {name: a[:, :N] for name, a in g.items()}
+    east = {name: a[:, N:] for name, a in g.items()}
+    if layout == 'straight':
+        faces = [west, east]
+    elif layout == 'rotated':
+        rotated = {'c': _rotate(east['c']),
+                   # face 1 v is the global u; face 1 u is not used
+                   'u': np.random.rand(N, N),
+                   'v': _rotate(east['u']),
+                   'uc': -_rotate(east['vc']),
+                   'vc': _rotate(east['uc'])}
+        faces = [west, rotated]
+    elif layout == 'reversed':
+        flipped = {name: _rotate180(west[name]) for name in west}
+        for name in ['uc', 'vc']:
+            flipped[name] = -flipped[name]
+        faces = [east, flipped]
+
+    ds = xr.Dataset(coords=_coords(N, N))
+    ds.coords['face'] = ('face', np.arange(2))
+    for name in g:
+        ds[name] = (('face',) + ds_global[name].dims,
+                    np.stack([f[name] for f in faces]))
+    return ds, ds_global
+
+
+@pytest.mark.parametrize('chunks', [None, {'face': 1},
+                                    {'face': 1, 'XC': 4, 'YC': 4}])
+@pytest.mark.parametrize('func', ['interp', 'diff'])
+@pytest.mark.parametrize('layout', ['straight', 'rotated', 'reversed'])
+def test_face_connections_scalar(layout, func, chunks):
+    ds, ds_global = _face_datasets(layout)
+    if chunks:
+        ds = ds.chunk(chunks)
+    grid = Grid(ds, periodic=False, face_connections=_LAYOUTS[layout])
+    grid_global = Grid(ds_global, periodic=False)
+
+    expected = getattr(grid_global, func)(ds_global.c, 'X',
+                                          boundary='fill').values
+    west, east = expected[:, :N], expected[:, N:]
+
+    actual = getattr(grid, func)(ds.c, 'X', boundary='fill')
+    assert actual.dims == ('face', 'YC', 'XG')
+    if chunks:
+        assert actual.data.chunks[0] == (1, 1)
+        # the faces are only joined at the chunks on their edges
+        assert actual.data.chunks[2] == ds.c.data.chunks[2]
+    actual = actual.values
+    if layout == 'straight':
+        np.testing.assert_allclose(actual[0], west)
+        np.testing.assert_allclose(actual[1], east)
+    elif layout == 'rotated':
+        np.testing.assert_allclose(actual[0], west)
+        # along the Y axis of the rotated face
+        actual_y = getattr(grid, func)(ds.c, 'Y', boundary='fill').values
+        np.testing.assert_allclose(actual_y[1], _rotate(east))
+    elif layout == 'reversed':
+        np.testing.assert_allclose(actual[0], east)
+
+
+@pytest.mark.parametrize('chunks', [None, {'face': 1}])
+def test_face_connections_vector_rotated(chunks):
+    ds, ds_global = _face_datasets('rotated')
+    if chunks:
+        ds = ds.chunk(chunks)
+    grid = Grid(ds, periodic=False, face_connections=_LAYOUTS['rotated'])
+    grid_global = Grid(ds_global, periodic=False)
+
+    # the halo of u on face 0 is taken from v on face 1
+    expected = grid_global.interp(ds_global.u, 'X', boundary='fill')
+    actual = grid.interp(ds.u, 'X', boundary='fill',
+                         vector_partner={'Y': ds.v})
+    np.testing.assert_allclose(actual.values[0], expected.values[:, :N])
+
+    # and the halo of v on face 1 from u on face 0
+    expected = grid_global.diff(ds_global.uc, 'X', boundary='fill')
+    actual = grid.diff(ds.vc, 'Y', boundary='fill',
+                       vector_partner={'X': ds.uc})
+    np.testing.assert_allclose(actual.values[1],
+                               _rotate(expected.values[:, N:]))
+
+
+@pytest.mark.parametrize('chunks', [None, {'face': 1}])
+def test_face_connections_vector_reversed(chunks):
+    ds, ds_global = _face_datasets('reversed')
+    if chunks:
+        ds = ds.chunk(chunks)
+    grid = Grid(ds, periodic=False, face_connections=_LAYOUTS['reversed'])
+    grid_global = Grid(ds_global, periodic=False)
+
+    # both components change sign across the reversed edge
+    for name, partner in [('uc', {'Y': ds.vc}), ('vc', {'X': ds.uc})]:
+        expected = grid_global.diff(ds_global[name], 'X', boundary='fill')
+        actual = grid.diff(ds[name], 'X', boundary='fill',
+                           vector_partner=partner)
+        np.testing.assert_allclose(actual.values[0], expected.values[:, N:])
+
+
+def test_face_connections_multi_axis():
+    ds, _ = _face_datasets('rotated')
+    grid = Grid(ds, periodic=False, face_connections=_LAYOUTS['rotated'])
+    expected = grid.interp(grid.interp(ds.c, 'X', boundary='extend'), 'Y',
+                           boundary='extend')
+    actual = grid.interp(ds.c, ['X', 'Y'], boundary='extend')
+    xr.testing.assert_allclose(actual, expected)
+
+
+def test_face_connections_errors():
+    ds, _ = _face_datasets('straight')
+    with pytest.raises(ValueError):
+        Grid(ds, face_connections={'tile': _LAYOUTS['straight']['face']})
+    with pytest.raises(ValueError):
+        Grid(ds, face_connections={'face': {2: {'X': (None, None)}}})
+    with pytest.raises(ValueError):
+        Grid(ds, face_connections={'face': {0: {'X': (None,
+                                                      (3, 'X', False))}}})
+    with pytest.raises(KeyError):
+        Grid(ds, face_connections={'face': {0: {'Z': (None, None)}}})
+
+    grid = Grid(ds, face_connections=_LAYOUTS['straight'])
+    assert not grid.axes['X']._periodic
+    with pytest.raises(NotImplementedError):
+        grid.interp(ds.c, 'X', boundary='fill', boundary_discontinuity=1.)
@@ -5,6 +5,7 @@ import xarray as xr
 import numpy as np
 from dask.array import from_array
 
+from xgcm import comodo, duck_array_ops
 from xgcm.grid import Grid, Axis, add_to_slice
 
 from . datasets import (all_datasets, nonperiodic_1d, periodic_1d, periodic_2d,
@@ -394,6 +395,77 @@ def test_grid_create(all_datasets):
     grid = Grid(ds, periodic=periodic)
 
 
+def test_grid_axis_inference_cache(all_datasets):
+    ds, periodic, expected = all_datasets
+    grid = Grid(ds, periodic=periodic)
+    axes = comodo._infer_axes(ds)
+    assert list(grid.axes) == list(axes)
+    for axis_name, ax in grid.axes.items():
+        assert ([c.name for c in ax.coords.values()] ==
+                list(comodo.get_axis_positions(ds, axis_name).values()))
+        assert (sorted(comodo.get_axis_coords(ds, axis_name)) ==
+                sorted(c.name for c in ax.coords.values()))
+    assert comodo.get_all_axes(ds) == set(expected['axes'])
+
+    # the cached positions can't be modified through the results
+    positions = comodo.get_axis_positions(ds, 'X')
+    positions.clear()
+    assert comodo.get_axis_positions(ds, 'X') == axes['X']
+    assert len(axes['X']) > 0
+
+    # datasets with the same structure share the inferred axes
+    ds_other = ds.copy(deep=True)
+    assert comodo._infer_axes(ds_other) is axes
+
+    # but changes of the comodo attributes are picked up
+    ds_other = ds.copy(deep=True)
+    del ds_other[list(axes['X'].values())[-1]].attrs['c_grid_axis_shift']
+    assert comodo._infer_axes(ds_other) is not axes
+    for n in range(2):
+        # the error is raised again on cache hits
+        with pytest.raises(ValueError, match='c_grid_axis_shift'):
+            Grid(ds_other, periodic=periodic)
+        with pytest.raises(ValueError, match='c_grid_axis_shift'):
+            Axis(ds_other, 'X')
+    with pytest.raises(ValueError):
+        Axis(ds, 'W')
+
+
+def test_grid_result_templates(all_datasets):
+    ds, periodic, expected = all_datasets
+    grid = Grid(ds, periodic=periodic)
+    for axis_name, ax in grid.axes.items():
+        kwargs = {} if ax._periodic else {'boundary': 'extend'}
+        for varname in ['data_c', 'data_g']:
+            for func in ['interp', 'diff']:
+                da = ds[varname]
+                first = getattr(grid, func)(da, axis_name, **kwargs)
+                # later results are copies of a template, and the same as
+                # built from scratch
+                second = getattr(grid, func)(da, axis_name, **kwargs)
+                data = getattr(ax, func)(da, **kwargs).data
+                xr.testing.assert_identical(first, second)
+                xr.testing.assert_identical(
+                    second, xr.DataArray(data, dims=second.dims,
+                                         coords=second.coords))
+                # results don't share their attributes
+                for name in second.coords:
+                    second[name].attrs['changed'] = True
+                    assert 'changed' not in first[name].attrs
+
+                # other coordinates with the same dims
+                other = da.copy(deep=True)
+                for d in other.dims:
+                    if d not in [c.name for c in ax.coords.values()]:
+                        other[d] = other[d] + 1.
+                other_result = getattr(grid, func)(other, axis_name,
+                                                   **kwargs)
+                for d in other_result.dims:
+                    if d in other.coords:
+                        xr.testing.assert_identical(other_result[d],
+                                                    other[d])
+
+
 def test_grid_repr(all_datasets):
     ds, periodic, expected = all_datasets
     grid = Grid(ds, periodic=periodic)
@@ -461,3 +533,350 @@ def test_add_to_slice():
     xr.testing.assert_equal(ref_ar, np_new)
     xr.testing.assert_equal(ref_ar, da_new.compute())
     xr.testing.assert_equal(ref_ar_last, da_new_last.compute())
+
+
+@pytest.mark.parametrize('chunks', [1, 7, 33, 100])
+@pytest.mark.parametrize('varname', ['data_c', 'data_g'])
+@pytest.mark.parametrize('func', ['interp', 'diff'])
+def test_axis_periodic_dask_halo_1d(periodic_1d, varname, func, chunks):
+    ds, periodic, expected = periodic_1d
+    axis = Axis(ds, 'X', periodic=periodic)
+
+    da = ds[varname]
+    da_chunked = da.chunk({da.dims[0]: chunks})
+
+    expected = getattr(axis, func)(da)
+    actual = getattr(axis, func)(da_chunked)
+    assert isinstance(actual.data, type(da_chunked.data))
+    assert actual.data.chunks == da_chunked.data.chunks
+    xr.testing.assert_allclose(expected, actual.compute())
+
+
+@pytest.mark.parametrize('chunks', [{'XC': 10, 'YC': 50, 'XG': 10, 'YG': 50},
+                                    {'XC': 33, 'XG': 33},
+                                    {'YC': 1, 'YG': 1}])
+@pytest.mark.parametrize('axis_name', ['X', 'Y'])
+@pytest.mark.parametrize('varname', ['data_c', 'data_g'])
+@pytest.mark.parametrize('func', ['interp', 'diff'])
+def test_axis_periodic_dask_halo_2d(periodic_2d, axis_name, varname, func,
+                                    chunks):
+    ds, periodic, expected = periodic_2d
+    axis = Axis(ds, axis_name, periodic=periodic)
+
+    da = ds[varname]
+    da_chunked = da.chunk({d: c for d, c in chunks.items() if d in da.dims})
+
+    expected = getattr(axis, func)(da)
+    actual = getattr(axis, func)(da_chunked)
+    assert actual.data.chunks == da_chunked.data.chunks
+    xr.testing.assert_allclose(expected, actual.compute())
+
+
+def _discontinuous_reference(da, dim, to, discontinuity):
+    # wrap the periodic neighbor with roll and offset it with add_to_slice
+    if to == 'left':
+        data_left = add_to_slice(da.roll(**{dim: 1}), dim, 0,
+                                 -discontinuity)
+        return data_left.data, da.data
+    else:
+        data_right = add_to_slice(da.roll(**{dim: -1}), dim, -1,
+                                  discontinuity)
+        return da.data, data_right.data
+
+
+@pytest.mark.parametrize('chunks', [None, 1, 7, 100])
+@pytest.mark.parametrize('func', ['interp', 'diff'])
+def test_axis_boundary_discontinuity(periodic_1d, func, chunks):
+    ds, periodic, expected = periodic_1d
+    axis = Axis(ds, 'X', periodic=periodic)
+    discontinuity = 360.
+
+    g_is_left = ds.XG.attrs['c_grid_axis_shift'] < 0
+    for varname, dim, to in [('data_c', 'XC', g_is_left),
+                             ('data_g', 'XG', not g_is_left)]:
+        to = 'left' if to else 'right'
+        da = ds[varname]
+        if chunks:
+            da = da.chunk({dim: chunks})
+        data_left, data_right = _discontinuous_reference(ds[varname], dim,
+                                                         to, discontinuity)
+        f = {'interp': lambda a, b: 0.5 * (a + b),
+             'diff': lambda a, b: b - a}[func]
+        actual = getattr(axis, func)(da, boundary_discontinuity=discontinuity)
+        if chunks:
+            assert actual.data.chunks == da.data.chunks
+        np.testing.assert_allclose(actual.values, f(data_left, data_right))
+
+
+@pytest.mark.parametrize('chunks', [None, {'XC': 7, 'YC': 50},
+                                    {'XC': 10, 'YC': 9}])
+def test_grid_multi_axis_boundary_discontinuity(periodic_2d, chunks):
+    ds, periodic, expected = periodic_2d
+    grid = Grid(ds, periodic=periodic)
+    discontinuity = {'X': 360., 'Y': 180.}
+
+    da = ds.data_c
+    if chunks:
+        da = da.chunk(chunks)
+    expected = ds.data_c
+    for axis_name in ['X', 'Y']:
+        expected = grid.interp(expected, axis_name,
+                               boundary_discontinuity=discontinuity[
+                                   axis_name])
+    actual = grid.interp(da, ['X', 'Y'],
+                         boundary_discontinuity=discontinuity)
+    xr.testing.assert_allclose(expected, actual.compute())
+
+
+@pytest.mark.parametrize('dtype', ['f8', 'i8'])
+@pytest.mark.parametrize('boundary', ['fill', 'extend'])
+def test_grid_multi_axis_boundary_discontinuity_mixed(boundary, dtype):
+    # X is wrapped with a discontinuity, Y is padded
+    ds = datasets['2d_left']
+    grid = Grid(ds, periodic=['X'])
+    da = (100 * ds.data_c).astype(dtype)
+    kwargs = dict(boundary={'X': None, 'Y': boundary},
+                  fill_value={'Y': 0.}, boundary_discontinuity={'X': 360.})
+
+    expected = grid.interp(da, 'X', boundary_discontinuity=360.)
+    expected = grid.interp(expected, 'Y', boundary=boundary, fill_value=0.)
+    xr.testing.assert_allclose(grid.interp(da, ['X', 'Y'], **kwargs),
+                               expected)
+    actual = grid.interp(da.chunk({'XC': 4, 'YC': 3}), ['X', 'Y'], **kwargs)
+    xr.testing.assert_allclose(actual.compute(), expected)
+
+
+@pytest.mark.parametrize('boundary', ['extend', 'fill'])
+@pytest.mark.parametrize('func', ['interp', 'diff'])
+@pytest.mark.parametrize('position', ['outer', 'left', 'right'])
+def test_axis_padding_peak_memory(position, func, boundary):
+    # neighbor operations on padded numpy arrays should allocate little
+    # beyond the output array
+    tracemalloc = pytest.importorskip('tracemalloc')
+    N = 1000
+    xg = {'outer': np.arange(N + 1) - 0.5, 'left': np.arange(N) - 0.5,
+          'right': np.arange(N) + 0.5}[position]
+    shift = 0.5 if position == 'right' else -0.5
+    ds = xr.Dataset(coords={'XC': ('XC', np.arange(N), {'axis': 'X'}),
+                            'XG': ('XG', xg, {'axis': 'X',
+                                              'c_grid_axis_shift': shift})})
+    axis = Axis(ds, 'X', periodic=False)
+    da = xr.DataArray(np.random.rand(20, 100, N), dims=['Z', 'Y', 'XC'],
+                      coords={'XC': ds.XC})
+
+    tracemalloc.start()
+    try:
+        getattr(axis, func)(da, boundary=boundary)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 1.5 * da.nbytes
+
+
+@pytest.mark.parametrize('chunks', [None, {'XC': 10, 'XG': 10, 'YC': 50,
+                                           'YG': 50}])
+@pytest.mark.parametrize('boundary', ['extend', 'fill'])
+@pytest.mark.parametrize('varname', ['data_c', 'data_g'])
+@pytest.mark.parametrize('func', ['interp', 'diff'])
+def test_grid_multi_axis(all_2d, func, varname, boundary, chunks):
+    ds, periodic, expected = all_2d
+    grid = Grid(ds, periodic=periodic)
+
+    da = ds[varname]
+    if chunks:
+        da = da.chunk({d: c for d, c in chunks.items() if d in da.dims})
+
+    bcs = {}
+    for axis_name, axis in grid.axes.items():
+        bcs[axis_name] = None if axis._periodic else boundary
+
+    expected = getattr(grid, func)(da, 'X', boundary=bcs['X'])
+    expected = getattr(grid, func)(expected, 'Y', boundary=bcs['Y'])
+    actual = getattr(grid, func)(da, ['X', 'Y'], boundary=bcs)
+    assert actual.dims == expected.dims
+    if chunks:
+        # all shifts preserve the axis lengths, and hence the chunks
+        assert actual.data.chunks == da.data.chunks
+    xr.testing.assert_allclose(expected, actual)
+
+    # fusing is independent of the order of axes
+    actual_yx = getattr(grid, func)(da, ['Y', 'X'], boundary=bcs)
+    xr.testing.assert_allclose(actual, actual_yx)
+
+
+@pytest.mark.parametrize('chunks', [None, {'XC': 10, 'YC': 9}])
+@pytest.mark.parametrize('func', ['interp', 'diff'])
+def test_grid_multi_axis_fill_value(nonperiodic_2d, func, chunks):
+    ds, periodic, expected = nonperiodic_2d
+    grid = Grid(ds, periodic=False)
+
+    da = ds.data_c
+    if chunks:
+        da = da.chunk(chunks)
+    for axes in [['X', 'Y'], ['Y', 'X']]:
+        # the fill value of each axis is applied after the preceding axes,
+        # as in successive calls
+        expected = da
+        for axis_name in axes:
+            expected = getattr(grid, func)(expected, axis_name,
+                                           boundary='fill', fill_value=1.)
+        actual = getattr(grid, func)(da, axes, boundary='fill',
+                                     fill_value=1.)
+        xr.testing.assert_allclose(expected, actual)
+
+
+@pytest.mark.parametrize('block_bytes', [None, 100])
+@pytest.mark.parametrize('func', ['interp', 'diff'])
+def test_grid_multi_axis_outer(func, block_bytes, monkeypatch):
+    if block_bytes:
+        # numpy data is processed in blocks of a few rows
+        monkeypatch.setattr(duck_array_ops, '_STENCIL_BLOCK_BYTES',
+                            block_bytes)
+    ds = xr.Dataset(
+        {'data_c': (['YC', 'XC'], np.random.rand(5, 9))},
+        coords={'XC': ('XC', np.arange(1, 10), {'axis': 'X'}),
+                'XG': ('XG', np.arange(0.5, 10),
+                       {'axis': 'X', 'c_grid_axis_shift': -0.5}),
+                'YC': ('YC', np.arange(1, 6), {'axis': 'Y'}),
+                'YG': ('YG', np.arange(1.5, 5),
+                       {'axis': 'Y', 'c_grid_axis_shift': -0.5})})
+    grid = Grid(ds, periodic=False)
+
+    for da in [ds.data_c, ds.data_c.chunk({'XC': 4, 'YC': 2})]:
+        expected = getattr(grid, func)(da, 'X', boundary='extend')
+        expected = getattr(grid, func)(expected, 'Y')
+        actual = getattr(grid, func)(da, ['X', 'Y'], boundary='extend')
+        assert actual.dims == ('YG', 'XG')
+        xr.testing.assert_allclose(expected, actual)
+
+
+@pytest.mark.parametrize('chunks', [None, {'XC': 10, 'XG': 10}])
+@pytest.mark.parametrize('func', ['interp', 'diff', 'cumsum'])
+def test_grid_ops_dataset(all_2d, func, chunks):
+    ds, periodic, expected = all_2d
+    grid = Grid(ds, periodic=periodic)
+    boundary = None if grid.axes['X']._periodic else 'extend'
+    if func == 'cumsum':
+        boundary = 'fill'
+
+    ds_in = ds.copy()
+    # several variables on the same and on different positions
+    ds_in['data_c2'] = 2 * ds.data_c
+    ds_in['data_c3'] = ds.data_c ** 2
+    ds_in['data_g2'] = ds.data_g - 1
+    ds_in['data_int'] = (ds.data_c * 10).astype('i8')
+    ds_in['data_y'] = ds.YC ** 2
+    ds_in.attrs['title'] = 'test'
+    ds_in.data_c2.attrs['units'] = 'K'
+    ds_in.coords['mask'] = ds.data_c > 0.5
+    ds_in.coords['y_label'] = ('YC', np.arange(len(ds.YC)))
+    ds_in.coords['z'] = 0.
+    if chunks:
+        ds_in = ds_in.chunk(chunks)
+
+    ds_new = getattr(grid, func)(ds_in, 'X', boundary=boundary)
+    assert isinstance(ds_new, xr.Dataset)
+    # variables without an X dimension are dropped
+    assert list(ds_new.data_vars) == ['data_g', 'data_c', 'data_c2',
+                                      'data_c3', 'data_g2', 'data_int']
+
+    # the same as one variable at a time, with the attributes and the
+    # coordinates that don't lie on the axis
+    expected = xr.Dataset(attrs=ds_in.attrs)
+    for name in ds_new.data_vars:
+        da = getattr(grid, func)(ds_in[name], 'X', boundary=boundary)
+        da.attrs = ds_in[name].attrs
+        expected[name] = da
+    expected.coords['mask'] = ds_in.mask
+    expected.coords['y_label'] = ds_in.y_label
+    expected.coords['z'] = ds_in.z
+    xr.testing.assert_identical(ds_new, expected)
+    assert ds_new.data_c2.attrs == {'units': 'K'}
+
+
+def test_grid_ops_dataset_multi_axis(periodic_2d):
+    ds, periodic, expected = periodic_2d
+    grid = Grid(ds, periodic=periodic)
+
+    ds_in = xr.Dataset({'a': ds.data_c, 'b': 2 * ds.data_c})
+    ds_new = grid.interp(ds_in, ['X', 'Y'])
+    for name in ds_in.data_vars:
+        xr.testing.assert_allclose(ds_new[name],
+                                   grid.interp(ds_in[name], ['X', 'Y']))
+
+
+def _reverse_cumsum_expected(data, pad, drop, boundary, fill_value=0.):
+    # partial sums from the end, including the empty sum
+    sums = np.hstack([np.cumsum(data[::-1])[::-1], 0.])
+    expected = sums[int(drop):len(data) + int(pad)]
+    if pad:
+        expected[-1] = data[-1] if boundary == 'extend' else fill_value
+    return expected
+
+
+@pytest.mark.parametrize('boundary', ['extend', 'fill'])
+@pytest.mark.parametrize('from_center', [True, False])
+def test_axis_cumsum_reverse(nonperiodic_1d, boundary, from_center):
+    ds, periodic, expected = nonperiodic_1d
+    axis = Axis(ds, 'X', periodic=periodic)
+
+    to = set(expected['axes']['X']).difference({'center'}).pop()
+    if from_center:
+        da = ds.data_c
+        transition = ('center', to)
+    else:
+        da = ds.data_g
+        transition = (to, 'center')
+        to = 'center'
+
+    pad, drop = {('center', 'right'): (True, True),
+                 ('left', 'center'): (True, True),
+                 ('center', 'left'): (False, False),
+                 ('right', 'center'): (False, False),
+                 ('center', 'inner'): (False, True),
+                 ('outer', 'center'): (False, True),
+                 ('center', 'outer'): (True, False),
+                 ('inner', 'center'): (True, False)}[transition]
+
+    da_cum = axis.cumsum(da, to=to, boundary=boundary, reverse=True)
+    np.testing.assert_allclose(da_cum.data,
+                               _reverse_cumsum_expected(da.data, pad, drop,
+                                                        boundary))
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('boundary', ['extend', 'fill'])
+@pytest.mark.parametrize('chunks', [1, 2, 3, 50])
+@pytest.mark.parametrize('varname', ['data_c', 'data_g'])
+def test_axis_cumsum_dask(nonperiodic_1d, varname, chunks, boundary, reverse):
+    ds, periodic, expected = nonperiodic_1d
+    axis = Axis(ds, 'X', periodic=periodic)
+
+    da = ds[varname]
+    da_chunked = da.chunk({da.dims[0]: chunks})
+    kwargs = dict(boundary=boundary, fill_value=2., reverse=reverse)
+
+    expected = axis.cumsum(da, **kwargs)
+    actual = axis.cumsum(da_chunked, **kwargs)
+    assert isinstance(actual.data, type(da_chunked.data))
+    # the output keeps the input chunks, apart from the last one
+    assert actual.data.chunks[0][:-1] == da_chunked.data.chunks[0][:-1]
+    xr.testing.assert_allclose(expected, actual.compute())
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('axis_name', ['X', 'Y'])
+def test_axis_cumsum_dask_2d(nonperiodic_2d, axis_name, reverse):
+    ds, periodic, expected = nonperiodic_2d
+    axis = Axis(ds, axis_name, periodic=False)
+
+    for da in [ds.data_c, ds.data_g]:
+        da = da.where(da > 0.1)
+        da_chunked = da.chunk(30)
+        expected = axis.cumsum(da, boundary='fill', reverse=reverse)
+        actual = axis.cumsum(da_chunked, boundary='fill', reverse=reverse)
+        xr.testing.assert_allclose(expected, actual.compute())
+        # NaNs are skipped, as in xarray
+        xr.testing.assert_allclose(
+            axis.cumsum(da, boundary='fill'),
+            axis.cumsum(da.fillna(0.), boundary='fill'))
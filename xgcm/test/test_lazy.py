@@ -0,0 +1,125 @@
+from __future__ import print_function
+import pytest
+import xarray as xr
+import numpy as np
+
+from xgcm.grid import Grid
+from xgcm.lazy import LazyGrid, GridExpression
+from xgcm.duck_array_ops import _fused_stencil, _stencil_chain
+
+from . datasets import all_datasets, datasets
+
+
+@pytest.mark.parametrize('periodic', [True, False])
+@pytest.mark.parametrize('boundary', ['fill', 'extend'])
+@pytest.mark.parametrize('axis_len', [3, 20])
+def test_fused_stencil(periodic, boundary, axis_len):
+    data = np.random.rand(4, axis_len)
+    interp, diff = (0.5, 0.5), (-1, 1)
+    boundary = 'periodic' if periodic else boundary
+    # (weights, pad_left, pad_right) for center -> left -> center -> outer
+    # -> center
+    steps = [(interp, True, False), (diff, False, True)]
+    if not periodic:
+        steps += [(interp, True, True), (diff, False, False)]
+    steps = [s + (boundary, 2.) for s in steps]
+    expected = _stencil_chain(data, 1, steps)
+    np.testing.assert_allclose(_fused_stencil(data, 1, steps), expected)
+
+    dask = pytest.importorskip('dask.array')
+    actual = _fused_stencil(dask.from_array(data, chunks=(2, 7)), 1, steps)
+    np.testing.assert_allclose(actual.compute(), expected)
+
+
+@pytest.mark.parametrize('boundary', ['periodic', 'fill', 'extend'])
+def test_fused_stencil_nan(boundary):
+    data = np.arange(8.) ** 2
+    data[3] = np.nan
+    # interp then diff cancels the weight of the center tap
+    steps = [((0.5, 0.5), True, False, boundary, 2.),
+             ((-1, 1), False, True, boundary, 2.)]
+    expected = _stencil_chain(data, 0, steps)
+    actual = _fused_stencil(data, 0, steps)
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    np.testing.assert_allclose(actual, expected)
+
+
+@pytest.mark.parametrize('chunks', [None, 40])
+def test_lazy_chains(all_datasets, chunks):
+    ds, periodic, _ = all_datasets
+    grid = Grid(ds, periodic=periodic)
+    for axis_name, axis in grid.axes.items():
+        kwargs = {} if axis._periodic else {'boundary': 'fill',
+                                            'fill_value': 1.}
+        for varname in ['data_c', 'data_g']:
+            da = ds[varname]
+            if chunks:
+                da = da.chunk(chunks)
+            for first, second in [('interp', 'diff'), ('diff', 'diff'),
+                                  ('interp', 'interp')]:
+                expected = getattr(grid, second)(
+                    getattr(grid, first)(da, axis_name, **kwargs),
+                    axis_name, **kwargs)
+                lazy = grid.lazy()
+                expression = getattr(lazy, second)(
+                    getattr(lazy, first)(da, axis_name, **kwargs),
+                    axis_name, **kwargs)
+                actual = expression.compute()
+                assert type(actual.data) is type(expected.data)
+                xr.testing.assert_allclose(actual, expected)
+
+
+def test_lazy_common_subexpressions(monkeypatch):
+    ds = datasets['2d_left']
+    grid = Grid(ds)
+    calls = []
+    interp = grid.interp
+
+    def _counting_interp(da, axis, **kwargs):
+        calls.append(axis)
+        return interp(da, axis, **kwargs)
+    monkeypatch.setattr(grid, 'interp', _counting_interp)
+
+    with grid.lazy() as lazy:
+        assert isinstance(lazy, LazyGrid)
+        tx = lazy.interp(ds.data_c, 'X')
+        assert lazy.interp(ds.data_c, 'X') is tx
+        assert lazy.interp(ds.data_c, 'X', boundary='fill') is not tx
+        a = lazy.interp(ds.data_c, 'X') * ds.data_g
+        b = 2 * lazy.interp(ds.data_c, 'X') - 1
+        c = lazy.diff(lazy.interp(ds.data_c, 'X'), 'Y')
+        assert isinstance(a, GridExpression)
+        actual_a, actual_b, actual_c = lazy.compute(a, b, c)
+    assert calls == ['X']
+
+    expected_tx = interp(ds.data_c, 'X')
+    xr.testing.assert_allclose(actual_a, expected_tx * ds.data_g)
+    xr.testing.assert_allclose(actual_b, 2 * expected_tx - 1)
+    xr.testing.assert_allclose(actual_c, grid.diff(expected_tx, 'Y'))
+
+
+def test_lazy_shared_intermediate():
+    # an intermediate result that is also requested is not fused away
+    ds = datasets['1d_left']
+    grid = Grid(ds, periodic=False)
+    lazy = grid.lazy()
+    tx = lazy.interp(ds.data_c, 'X', boundary='extend')
+    dtx = lazy.diff(tx, 'X', boundary='extend')
+    actual_tx, actual_dtx = lazy.compute(tx, dtx)
+    expected_tx = grid.interp(ds.data_c, 'X', boundary='extend')
+    xr.testing.assert_allclose(actual_tx, expected_tx)
+    xr.testing.assert_allclose(actual_dtx,
+                               grid.diff(expected_tx, 'X',
+                                         boundary='extend'))
+
+
+def test_lazy_errors():
+    ds = datasets['1d_left']
+    grid = Grid(ds)
+    lazy = grid.lazy()
+    with pytest.raises(KeyError):
+        lazy.interp(ds.data_c, 'Z')
+    with pytest.raises(TypeError):
+        lazy.interp(ds.data_c, 'X') + 'a'
+    with pytest.raises(ValueError):
+        lazy.interp(ds.data_c, 'X') + grid.lazy().interp(ds.data_c, 'X')
@@ -1,8 +1,11 @@
 import pytest
 import os
 import tarfile
+import numpy as np
 
 import xgcm
+from xgcm import mdsxray
+from xgcm.mdsxray import parse_meta_file
 
 _TESTDATA_FILENAME = 'testdata.tar.gz'
 _TESTDATA_ITERS = [39600,]
@@ -29,3 +32,258 @@ def test_open_mdsdataset(mds_datadir):
     # most basic test: make sure we can open an mds dataset
     ds = xgcm.open_mdsdataset(os.path.join(mds_datadir, 'testdata'),
             _TESTDATA_ITERS, deltaT=_TESTDATA_DELTAT)
+
+
+_NX, _NY, _NZ = 8, 6, 4
+
+
+def _write_mds(dirname, prefix, data, iternum=None, fldlist=None,
+               dtype='>f4', tiles=None):
+    # write data (records first, then as (nz, ny, nx)) in MITgcm format,
+    # split into (nty, ntx) tiles if given
+    if iternum is not None:
+        prefix = '%s.%010d' % (prefix, iternum)
+    nrecords = len(fldlist) if fldlist else 1
+    shape = data.shape[1:] if fldlist else data.shape
+    nty, ntx = tiles or (1, 1)
+    tny, tnx = shape[-2] // nty, shape[-1] // ntx
+    for ty in range(nty):
+        for tx in range(ntx):
+            ranges = [(0, n) for n in shape[:-2]]
+            ranges += [(ty * tny, (ty + 1) * tny), (tx * tnx, (tx + 1) * tnx)]
+            dimlist = ',\n'.join('%5i,%5i,%5i' % (n, start + 1, end)
+                                 for n, (start, end)
+                                 in list(zip(shape, ranges))[::-1])
+            lines = [" nDims = [ %3i ];" % len(shape),
+                     " dimList = [\n%s\n ];" % dimlist,
+                     " dataprec = [ '%s' ];" % {'>f4': 'float32',
+                                                 '>f8': 'float64'}[dtype],
+                     " nrecords = [ %5i ];" % nrecords]
+            if iternum is not None:
+                lines.append(" timeStepNumber = [ %10i ];" % iternum)
+            if fldlist:
+                lines.append(" nFlds = [ %3i ];" % nrecords)
+                lines.append(" fldList = {\n %s\n };"
+                             % ' '.join("'%-8s'" % f for f in fldlist))
+            fname = prefix
+            if tiles:
+                fname += '.%03i.%03i' % (tx + 1, ty + 1)
+            with open(os.path.join(dirname, fname + '.meta'), 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            tile = data[..., ranges[-2][0]:ranges[-2][1],
+                        ranges[-1][0]:ranges[-1][1]]
+            tile.astype(dtype).tofile(os.path.join(dirname,
+                                                   fname + '.data'))
+
+
+@pytest.fixture(params=[None, (2, 4)], ids=['global', 'tiled'])
+def mds_synthetic(tmpdir, request):
+    dirname = str(tmpdir)
+    tiles = request.param
+    rng = np.random.RandomState(0)
+    grid = {}
+    x = np.arange(_NX) + 0.5
+    y = np.arange(_NY) + 0.5
+    grid['XC'], grid['YC'] = np.meshgrid(x, y)
+    grid['XG'], grid['YG'] = np.meshgrid(x - 0.5, y - 0.5)
+    for prefix in ['DXC', 'DYC', 'DXG', 'DYG', 'RAC', 'Depth']:
+        grid[prefix] = rng.rand(_NY, _NX)
+    grid['hFacC'] = rng.rand(_NZ, _NY, _NX)
+    rf = -np.arange(_NZ + 1, dtype='f8')
+    grid['RF'] = rf.reshape(_NZ + 1, 1, 1)
+    grid['RC'] = (0.5 * (rf[1:] + rf[:-1])).reshape(_NZ, 1, 1)
+    grid['DRF'] = np.ones((_NZ, 1, 1))
+    for prefix, data in grid.items():
+        _write_mds(dirname, prefix, data,
+                   tiles=tiles if data.shape[-1] > 1 else None)
+
+    output = {}
+    for iternum in [10, 20, 30]:
+        for prefix in ['T', 'U', 'Eta']:
+            shape = (_NY, _NX) if prefix == 'Eta' else (_NZ, _NY, _NX)
+            output[prefix, iternum] = rng.rand(*shape)
+            _write_mds(dirname, prefix, output[prefix, iternum], iternum,
+                       tiles=tiles)
+        # a diagnostics file with several fields
+        output['diags', iternum] = rng.rand(2, _NZ, _NY, _NX)
+        _write_mds(dirname, 'diags', output['diags', iternum], iternum,
+                   fldlist=['THETA', 'VVEL'], dtype='>f8', tiles=tiles)
+    return dirname, grid, output, tiles
+
+
+def test_parse_meta_file(mds_synthetic):
+    dirname, grid, output, tiles = mds_synthetic
+    if tiles:
+        pytest.skip('global files only')
+    meta = parse_meta_file(os.path.join(dirname, 'diags.0000000020.meta'))
+    assert meta['nDims'] == 3
+    assert meta['dimList'] == [(_NX, 1, _NX), (_NY, 1, _NY), (_NZ, 1, _NZ)]
+    assert meta['dataprec'] == np.dtype('>f8')
+    assert meta['nrecords'] == 2
+    assert meta['timeStepNumber'] == 20
+    assert meta['fldList'] == ['THETA', 'VVEL']
+
+
+@pytest.mark.parametrize('shape, ndim, expected', [
+    ((5, 1, 1), 1, (5,)),
+    ((1, 1, 1), 1, (1,)),
+    ((1, 4, 3), 2, (4, 3)),
+    ((1, 1, 3), 2, (1, 3)),
+    ((4, 1), 2, (4, 1)),
+    ((2, 1, 3), 3, (2, 1, 3))])
+def test_squeeze_shape(shape, ndim, expected):
+    # only the extra dimensions of length 1 are dropped
+    assert mdsxray._squeeze_shape(shape, ndim) == expected
+
+
+def test_open_mdsdataset_synthetic(mds_synthetic):
+    dirname, grid, output, tiles = mds_synthetic
+    ds = xgcm.open_mdsdataset(dirname, deltaT=60)
+
+    np.testing.assert_array_equal(ds.iter, [10, 20, 30])
+    np.testing.assert_array_equal(ds.time, [600, 1200, 1800])
+    assert ds.T.dims == ('time', 'Z', 'Y', 'X')
+    assert ds.U.dims == ('time', 'Z', 'Y', 'Xp1')
+    assert ds.Eta.dims == ('time', 'Y', 'X')
+    assert ds.VVEL.dims == ('time', 'Z', 'Yp1', 'X')
+    assert ds.HFacC.dims == ('Z', 'Y', 'X')
+    assert ds.drF.dims == ('Z',)
+
+    # one chunk per record, level and tile
+    nty, ntx = tiles or (1, 1)
+    assert ds.T.data.chunks == ((1,) * 3, (1,) * _NZ,
+                                (_NY // nty,) * nty, (_NX // ntx,) * ntx)
+    assert ds.XC.data.chunks == ((_NY // nty,) * nty, (_NX // ntx,) * ntx)
+    assert ds.T.dtype == np.dtype('f4')
+    assert ds.THETA.dtype == np.dtype('f8')
+
+    for n, iternum in enumerate([10, 20, 30]):
+        np.testing.assert_allclose(ds.T[n].values, output['T', iternum],
+                                   rtol=1e-6)
+        np.testing.assert_allclose(ds.Eta[n].values, output['Eta', iternum],
+                                   rtol=1e-6)
+        np.testing.assert_array_equal(ds.THETA[n].values,
+                                      output['diags', iternum][0])
+        np.testing.assert_array_equal(ds.VVEL[n].values,
+                                      output['diags', iternum][1])
+    np.testing.assert_allclose(ds.HFacC.values, grid['hFacC'], rtol=1e-6)
+
+    np.testing.assert_allclose(ds.X, grid['XC'][0])
+    np.testing.assert_allclose(ds.Yp1, grid['YG'][:, 0])
+    np.testing.assert_allclose(ds.Z, grid['RC'].ravel())
+    np.testing.assert_allclose(ds.Zp1, grid['RF'].ravel())
+    np.testing.assert_allclose(ds.Zl, grid['RF'].ravel()[:-1])
+
+
+def test_open_mdsdataset_grid(mds_synthetic):
+    dirname, grid, output, tiles = mds_synthetic
+    g = xgcm.Grid(xgcm.open_mdsdataset(dirname, iters=[20], prefix='T'),
+                  periodic=['X'])
+    ds = xgcm.open_mdsdataset(dirname, iters=[20], prefix='T')
+    assert list(ds.data_vars) == ['XC', 'YC', 'XG', 'YG', 'dxC', 'dyC',
+                                  'dxG', 'dyG', 'rA', 'Depth', 'drF',
+                                  'HFacC', 'T']
+    assert g.axes['X']._periodic
+    t_x = g.interp(ds.T, 'X')
+    assert t_x.dims == ('time', 'Z', 'Y', 'Xp1')
+    t_z = g.interp(ds.T, 'Z', boundary='extend')
+    assert t_z.dims == ('time', 'Zl', 'Y', 'X')
+
+
+def test_open_mdsdataset_options(mds_synthetic):
+    dirname, grid, output, tiles = mds_synthetic
+    ds = xgcm.open_mdsdataset(dirname, iters=None)
+    assert 'time' not in ds.dims
+    assert 'HFacC' in ds
+
+    ds = xgcm.open_mdsdataset(dirname, iters=[10, 30], prefix=['Eta'],
+                              read_grid=False)
+    assert list(ds.data_vars) == ['Eta']
+    np.testing.assert_array_equal(ds.X, np.arange(_NX))
+    np.testing.assert_allclose(ds.Eta[1].values, output['Eta', 30],
+                               rtol=1e-6)
+
+    with pytest.raises(IOError):
+        xgcm.open_mdsdataset(dirname, iters=[40], prefix='T')
+    with pytest.raises(IOError):
+        xgcm.open_mdsdataset(dirname, prefix='SALT')
+
+
+def test_open_mdsdataset_mismatched_iters(mds_synthetic):
+    dirname, grid, output, tiles = mds_synthetic
+    # a second prefix with output at other iterations
+    rng = np.random.RandomState(1)
+    for iternum in [30, 40]:
+        output['S', iternum] = rng.rand(_NZ, _NY, _NX)
+        _write_mds(dirname, 'S', output['S', iternum], iternum, tiles=tiles)
+
+    for prefix in [['T', 'S'], ['S', 'T']]:
+        # all iterations of any prefix, with gaps where one is missing
+        ds = xgcm.open_mdsdataset(dirname, prefix=prefix)
+        np.testing.assert_array_equal(ds.iter, [10, 20, 30, 40])
+        for n, iternum in enumerate([10, 20, 30, 40]):
+            for name in prefix:
+                if (name, iternum) in output:
+                    np.testing.assert_allclose(ds[name][n].values,
+                                               output[name, iternum],
+                                               rtol=1e-6)
+                else:
+                    assert ds[name][n].isnull().all()
+
+    with pytest.raises(IOError):
+        xgcm.open_mdsdataset(dirname, iters=[10, 40], prefix=['T', 'S'])
+
+
+def test_open_mdsdataset_lazy(mds_synthetic, monkeypatch):
+    dirname, grid, output, tiles = mds_synthetic
+    # opening reads nothing but the headers and 1D coordinates
+    reads = []
+    read_file = mdsxray._read_file
+
+    def _counting_read_file(fname, *args):
+        reads.append(os.path.basename(fname))
+        return read_file(fname, *args)
+    monkeypatch.setattr(mdsxray, '_read_file', _counting_read_file)
+
+    ds = xgcm.open_mdsdataset(dirname, read_grid=False)
+    assert reads == []
+    ds.T[1, 2].values
+    if tiles:
+        assert sorted(reads) == sorted(
+            'T.0000000020.%03i.%03i.data' % (tx, ty)
+            for tx in range(1, 5) for ty in range(1, 3))
+    else:
+        assert reads == ['T.0000000020.data']
+
+    # a subregion only touches the tiles it overlaps
+    del reads[:]
+    ds.T[0, 0, :2, :2].values
+    if tiles:
+        assert reads == ['T.0000000010.001.001.data']
+    else:
+        assert reads == ['T.0000000010.data']
+
+
+def test_mds_array_tiles(tmpdir):
+    # reads spanning several tiles and missing (land) tiles
+    dirname = str(tmpdir)
+    data = np.random.rand(_NZ, _NY, _NX)
+    _write_mds(dirname, 'S', data, 0, tiles=(2, 2))
+    os.remove(os.path.join(dirname, 'S.0000000000.002.002.data'))
+    os.remove(os.path.join(dirname, 'S.0000000000.002.002.meta'))
+
+    ds = xgcm.open_mdsdataset(dirname, read_grid=False)
+    expected = data.astype('f4')
+    expected[:, _NY // 2:, _NX // 2:] = np.nan
+    np.testing.assert_array_equal(ds.S[0].values, expected)
+
+    # a single read spanning all tiles
+    fname = os.path.join(dirname, 'S.0000000000')
+    meta, layout = mdsxray._read_layout(fname, ['.001.001', '.002.001',
+                                                '.001.002'])
+    assert len(layout) == 3
+    array = mdsxray._MDSArray([fname], meta['dataprec'], (_NZ, _NY, _NX),
+                              layout=layout)
+    np.testing.assert_array_equal(array[0, 1:3, 1:5, 2:7],
+                                  expected[1:3, 1:5, 2:7])
+    np.testing.assert_array_equal(array[:, 2], expected[None, 2])
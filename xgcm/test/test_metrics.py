@@ -0,0 +1,144 @@
+from __future__ import print_function
+import pytest
+import xarray as xr
+import numpy as np
+
+from xgcm.grid import Grid
+
+
+def _metrics_dataset():
+    nx, ny, nz = 12, 10, 5
+    xc = np.arange(nx) + 0.5
+    yc = np.arange(ny) + 0.5
+    ds = xr.Dataset(
+        coords={'XC': ('XC', xc, {'axis': 'X'}),
+                'XG': ('XG', xc - 0.5, {'axis': 'X',
+                                        'c_grid_axis_shift': -0.5}),
+                'YC': ('YC', yc, {'axis': 'Y'}),
+                'YG': ('YG', yc - 0.5, {'axis': 'Y',
+                                        'c_grid_axis_shift': -0.5}),
+                'Z': ('Z', -np.arange(nz) - 0.5, {'axis': 'Z'})})
+    ds['dxC'] = ('XC', 1 + np.random.rand(nx))
+    ds['dxG'] = ('XG', 1 + np.random.rand(nx))
+    ds['dyC'] = ('YC', 1 + np.random.rand(ny))
+    ds['rA'] = (('YC', 'XC'), 1 + np.random.rand(ny, nx))
+    ds['drF'] = ('Z', 1 + np.random.rand(nz))
+    ds['tracer'] = (('Z', 'YC', 'XC'), np.random.rand(nz, ny, nx))
+    ds['u'] = (('Z', 'YC', 'XG'), np.random.rand(nz, ny, nx))
+    ds['v'] = (('Z', 'YG', 'XC'), np.random.rand(nz, ny, nx))
+    metrics = {('X',): ['dxC', 'dxG'], ('Y',): ['dyC'], ('Z',): ['drF'],
+               ('X', 'Y'): ['rA']}
+    return ds, metrics
+
+
+def test_metrics_errors():
+    ds, metrics = _metrics_dataset()
+    with pytest.raises(KeyError):
+        Grid(ds, metrics={('X',): ['dxF']})
+    with pytest.raises(KeyError):
+        Grid(ds, metrics={('T',): ['dxC']})
+    grid = Grid(ds, metrics=metrics)
+    # no metric in Y at the position of v is registered
+    with pytest.raises(KeyError):
+        grid.get_metric(ds.v, 'Y')
+    with pytest.raises(KeyError):
+        grid.get_metric(ds.v, ['X', 'Y'])
+
+
+def test_get_metric():
+    ds, metrics = _metrics_dataset()
+    grid = Grid(ds, metrics=metrics)
+
+    xr.testing.assert_equal(grid.get_metric(ds.tracer, 'X'), ds.dxC)
+    xr.testing.assert_equal(grid.get_metric(ds.u, 'X'), ds.dxG)
+    xr.testing.assert_equal(grid.get_metric(ds.tracer, ['X', 'Y']), ds.rA)
+    volume = grid.get_metric(ds.tracer, ['X', 'Y', 'Z'])
+    xr.testing.assert_allclose(volume.transpose('Z', 'YC', 'XC'),
+                               (ds.rA * ds.drF).transpose('Z', 'YC', 'XC'))
+    # products of metrics are cached
+    assert grid.get_metric(ds.tracer, ['Z', 'Y', 'X']) is volume
+
+
+@pytest.mark.parametrize('chunks', [None, {'Z': 2, 'YC': 3, 'XC': 5}])
+@pytest.mark.parametrize('axes', ['X', 'Z', ['X', 'Y'], ['X', 'Y', 'Z']])
+def test_integrate_average(axes, chunks):
+    ds, metrics = _metrics_dataset()
+    # some land cells
+    ds['tracer'] = ds.tracer.where(ds.tracer > 0.1)
+    grid = Grid(ds, metrics=metrics)
+
+    da = ds.tracer
+    if chunks:
+        da = da.chunk(chunks)
+    weights = grid.get_metric(ds.tracer, axes)
+    dims = [{'X': 'XC', 'Y': 'YC', 'Z': 'Z'}[ax] for ax in axes]
+    expected_int = (ds.tracer * weights).sum(dims)
+    expected_avg = expected_int / weights.where(ds.tracer.notnull()).sum(dims)
+
+    actual_int = grid.integrate(da, axes)
+    actual_avg = grid.average(da, axes)
+    if chunks:
+        assert actual_int.chunks is not None
+    xr.testing.assert_allclose(expected_int.transpose(*actual_int.dims),
+                               actual_int.compute())
+    xr.testing.assert_allclose(expected_avg.transpose(*actual_avg.dims),
+                               actual_avg.compute())
+
+
+def test_average_dataset():
+    ds, metrics = _metrics_dataset()
+    grid = Grid(ds, metrics=metrics)
+    ds_data = ds[['tracer']]
+    ds_data['tracer2'] = 2 * ds.tracer
+    ds_data['u'] = ds.u
+
+    actual = grid.average(ds_data, 'X')
+    for name in ['tracer', 'tracer2', 'u']:
+        xr.testing.assert_allclose(actual[name],
+                                   grid.average(ds_data[name], 'X'))
+
+
+@pytest.mark.parametrize('chunks', [None, {'Z': 2, 'YC': 3, 'XC': 5,
+                                           'XG': 5}])
+@pytest.mark.parametrize('varname', ['tracer', 'u'])
+def test_derivative(varname, chunks):
+    ds, metrics = _metrics_dataset()
+    grid = Grid(ds, metrics=metrics)
+
+    da = ds[varname]
+    if chunks:
+        da = da.chunk({d: c for d, c in chunks.items() if d in da.dims})
+    diff = grid.diff(ds[varname], 'X')
+    expected = diff / grid.get_metric(diff, 'X')
+    actual = grid.derivative(da, 'X')
+    if chunks:
+        assert actual.data.chunks == grid.diff(da, 'X').data.chunks
+    xr.testing.assert_allclose(expected.transpose(*actual.dims),
+                               actual.compute())
+
+
+def test_derivative_dtype():
+    ds, metrics = _metrics_dataset()
+    grid = Grid(ds, metrics=metrics)
+    da = (ds.tracer * 10).astype('i8')
+    expected = grid.diff(da, 'X') / grid.get_metric(grid.diff(da, 'X'), 'X')
+    actual = grid.derivative(da, 'X')
+    assert actual.dtype.kind == 'f'
+    xr.testing.assert_allclose(expected.transpose(*actual.dims), actual)
+    # the input is not modified by the scaling
+    xr.testing.assert_identical(da, (ds.tracer * 10).astype('i8'))
+
+
+def test_derivative_reciprocal_cache():
+    ds, metrics = _metrics_dataset()
+    grid = Grid(ds, metrics=metrics)
+    da = ds.tracer.chunk({'XC': 4})
+
+    diff = grid.diff(da, 'X')
+    reciprocal = grid._get_reciprocal_metric(diff, 'X')
+    assert reciprocal.chunks[2] == diff.data.chunks[2]
+    assert reciprocal.shape == (1, 1, diff.shape[2])
+    grid.derivative(da, 'X')
+    assert grid._get_reciprocal_metric(diff, 'X') is reciprocal
+    np.testing.assert_allclose(reciprocal.compute()[0, 0],
+                               1 / grid.get_metric(diff, 'X').values)
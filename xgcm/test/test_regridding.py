@@ -0,0 +1,182 @@
+from __future__ import print_function
+import pytest
+import xarray as xr
+import numpy as np
+
+from xgcm import Grid
+from xgcm.regridding import (regrid_vertical, _regrid_vertical,
+                             VerticalRegridder, conservative_regrid_vertical)
+
+
+def _regrid_vertical_loop(q, tr, trlevs):
+    # reference: bin every column separately (vertical axis 0)
+    Nbins = len(trlevs) - 1
+    idx = np.clip(np.digitize(tr, trlevs) - 1, 0, Nbins - 1)
+    qtr = np.zeros((Nbins,) + q.shape[1:])
+    for n in np.ndindex(*q.shape[1:]):
+        column = (slice(None),) + n
+        qtr[column] = np.bincount(idx[column], weights=q[column],
+                                  minlength=Nbins)[:Nbins]
+    return qtr
+
+
+def _regrid_dataset(nz=15, ny=6, nx=7, nt=3):
+    tr = np.random.rand(nt, nz, ny, nx).cumsum(axis=1)
+    return xr.Dataset({'q': (('time', 'Z', 'YC', 'XC'),
+                             np.random.rand(nt, nz, ny, nx)),
+                       'rho': (('time', 'Z', 'YC', 'XC'), tr)},
+                      coords={'Z': -np.arange(nz)})
+
+
+@pytest.mark.parametrize('nz', [1, 15])
+@pytest.mark.parametrize('axis', [0, 1, 2])
+def test_regrid_vertical_kernel(nz, axis):
+    q = np.random.rand(nz, 6, 7)
+    tr = 10 * np.random.rand(nz, 6, 7)
+    trlevs = np.linspace(1, 9, 9)
+    expected = _regrid_vertical_loop(q, tr, trlevs)
+    actual = _regrid_vertical(q.swapaxes(0, axis), tr.swapaxes(0, axis),
+                              trlevs, axis=axis)
+    np.testing.assert_allclose(actual.swapaxes(0, axis), expected)
+    # the total is conserved
+    np.testing.assert_allclose(actual.sum(axis=axis),
+                               q.swapaxes(0, axis).sum(axis=axis))
+
+
+@pytest.mark.parametrize('chunks', [None, {'time': 1},
+                                    {'time': 1, 'Z': 4, 'YC': 2}])
+def test_regrid_vertical(chunks):
+    ds = _regrid_dataset()
+    trlevs = np.linspace(0, ds.rho.max().values, 11)
+    if chunks:
+        ds = ds.chunk(chunks)
+    actual = regrid_vertical(ds.q, ds.rho, trlevs, 'Z')
+
+    assert actual.dims == ('time', 'rho_coord', 'YC', 'XC')
+    if chunks:
+        assert actual.chunks is not None
+        assert actual.chunks[1] == (10,)
+    expected = _regrid_vertical_loop(
+        ds.q.values.swapaxes(0, 1), ds.rho.values.swapaxes(0, 1),
+        trlevs).swapaxes(0, 1)
+    np.testing.assert_allclose(actual.values, expected)
+    np.testing.assert_allclose(actual.rho_coord,
+                               0.5 * (trlevs[1:] + trlevs[:-1]))
+
+
+@pytest.mark.parametrize('chunks', [None, {'time': 1, 'YC': 3}])
+def test_vertical_regridder(chunks):
+    ds = _regrid_dataset()
+    ds['q2'] = 2 * ds.q
+    trlevs = np.linspace(0, ds.rho.max().values, 11)
+    if chunks:
+        ds = ds.chunk(chunks)
+    regridder = VerticalRegridder(ds.rho, trlevs, 'Z')
+
+    for name in ['q', 'q2']:
+        expected = regrid_vertical(ds[name], ds.rho, trlevs, 'Z')
+        actual = regridder(ds[name])
+        xr.testing.assert_allclose(expected.compute(), actual.compute())
+
+    # one cached index per block of the tracer
+    nblocks = 1 if chunks is None else ds.rho.data.npartitions
+    assert len(regridder._cache) == nblocks
+    assert regridder._cache.nbytes == ds.rho.size * np.dtype(np.intp).itemsize
+
+
+def test_vertical_regridder_eviction():
+    ds = _regrid_dataset().chunk({'time': 1})
+    trlevs = np.linspace(0, ds.rho.max().values, 11)
+    block_bytes = ds.rho.size // 3 * np.dtype(np.intp).itemsize
+    regridder = VerticalRegridder(ds.rho, trlevs, 'Z',
+                                  maxbytes=2 * block_bytes)
+    expected = regrid_vertical(ds.q, ds.rho, trlevs, 'Z')
+    for _ in range(2):
+        actual = regridder(ds.q)
+        xr.testing.assert_allclose(expected.compute(), actual.compute())
+        assert len(regridder._cache) <= 2
+        assert regridder._cache.nbytes <= 2 * block_bytes
+
+
+def test_vertical_regridder_dims():
+    ds = _regrid_dataset()
+    regridder = VerticalRegridder(ds.rho, np.linspace(0, 1, 5), 'Z')
+    with pytest.raises(ValueError):
+        regridder(ds.q.isel(time=0))
+
+
+def _thickness_dataset():
+    ds = _regrid_dataset()
+    nz = len(ds.Z)
+    ds.coords['Z'].attrs['axis'] = 'Z'
+    ds['drF'] = ('Z', 1 + np.random.rand(nz))
+    hfac = np.ones(ds.rho.shape[1:])
+    # land at the bottom of some columns, and a partial cell
+    hfac[-3:, 0, :] = 0.
+    hfac[-4, 0, :] = 0.5
+    ds['hFacC'] = (('Z', 'YC', 'XC'), hfac)
+    ds['dz'] = ds.drF * ds.hFacC
+    return ds
+
+
+@pytest.mark.parametrize('extensive', [True, False])
+@pytest.mark.parametrize('chunks', [None, {'time': 1, 'YC': 2}])
+def test_conservative_regrid_vertical(chunks, extensive):
+    ds = _thickness_dataset()
+    trlevs = np.linspace(0.5, ds.rho.max().values - 0.5, 8)
+    if chunks:
+        ds = ds.chunk(chunks)
+    actual = conservative_regrid_vertical(ds.q, ds.rho, trlevs, 'Z',
+                                          thickness=ds.dz,
+                                          extensive=extensive)
+    assert actual.dims == ('time', 'rho_coord', 'YC', 'XC')
+    if chunks:
+        assert actual.chunks is not None
+
+    # the content of every column is conserved
+    content = ds.q if extensive else ds.q * ds.dz
+    content = content.where(ds.dz > 0, 0.)
+    np.testing.assert_allclose(actual.sum('rho_coord').values,
+                               content.sum('Z').transpose('time', 'YC',
+                                                          'XC').values)
+
+
+def test_conservative_regrid_vertical_layers():
+    # a single column with tracer linear in depth
+    nz = 4
+    z = np.arange(nz) + 0.5
+    tr = xr.DataArray(z[:, None], dims=['Z', 'XC'], name='rho')
+    h = xr.DataArray(np.ones(nz), dims=['Z'])
+    q = xr.DataArray(np.ones((nz, 1)), dims=['Z', 'XC'])
+    # the interfaces are at tracer values 0.5, 1, 2, 3, 3.5
+    actual = conservative_regrid_vertical(q, tr, [0., 1.5, 2.25, 4.], 'Z',
+                                          thickness=h)
+    np.testing.assert_allclose(actual.values[:, 0], [1.5, 0.75, 1.75])
+
+    # binning puts whole cells in a single layer instead
+    binned = regrid_vertical(q, tr, np.array([0., 1.5, 2.25, 4.]), 'Z')
+    np.testing.assert_allclose(binned.values[:, 0], [1., 1., 2.])
+
+
+def test_conservative_regrid_vertical_grid():
+    ds = _thickness_dataset()
+    grid = Grid(ds, metrics={('Z',): ['dz']})
+    trlevs = np.linspace(0.5, ds.rho.max().values - 0.5, 8)
+    expected = conservative_regrid_vertical(ds.q, ds.rho, trlevs, 'Z',
+                                            thickness=ds.dz)
+    actual = conservative_regrid_vertical(ds.q, ds.rho, trlevs, 'Z',
+                                          grid=grid)
+    xr.testing.assert_allclose(expected, actual)
+    with pytest.raises(ValueError):
+        conservative_regrid_vertical(ds.q, ds.rho, trlevs, 'Z')
+
+
+def test_conservative_regrid_vertical_streaming():
+    ds = _thickness_dataset()
+    trlevs = np.linspace(0.5, ds.rho.max().values - 0.5, 8)
+    expected = conservative_regrid_vertical(ds.q, ds.rho, trlevs, 'Z',
+                                            thickness=ds.dz)
+    actual = conservative_regrid_vertical(ds.q, ds.rho, trlevs, 'Z',
+                                          thickness=ds.dz, time_dim='time')
+    assert actual.chunks[0] == (1,) * len(ds.time)
+    xr.testing.assert_allclose(expected, actual.compute())
@@ -0,0 +1,159 @@
+from __future__ import print_function
+import os
+import pickle
+import pytest
+import xarray as xr
+import numpy as np
+
+from xgcm.grid import Grid
+from xgcm.spec import GridSpec, AxisSpec
+
+from . datasets import all_datasets, datasets
+from . test_metrics import _metrics_dataset
+from . test_faces import _face_datasets, _LAYOUTS
+
+
+def _assert_same_grid(grid, expected):
+    assert list(grid.axes) == list(expected.axes)
+    for name, ax in grid.axes.items():
+        other = expected.axes[name]
+        assert ax._periodic == other._periodic
+        assert ax._default_shifts == other._default_shifts
+        assert ([(p, c.name, len(c)) for p, c in ax.coords.items()] ==
+                [(p, c.name, len(c)) for p, c in other.coords.items()])
+
+
+def test_spec_roundtrip(all_datasets):
+    ds, periodic, _ = all_datasets
+    grid = Grid(ds, periodic=periodic)
+    spec = grid.spec
+    assert isinstance(spec, GridSpec)
+    assert all(isinstance(a, AxisSpec) for a in spec.axes)
+    assert not hasattr(spec, '__dict__')
+
+    assert pickle.loads(pickle.dumps(spec)) == spec
+    assert GridSpec.from_json(spec.to_json()) == spec
+    assert GridSpec.from_dict(spec.to_dict()) == spec
+
+    new_grid = GridSpec.from_json(spec.to_json()).to_grid(ds)
+    _assert_same_grid(new_grid, grid)
+    for axis_name, axis in grid.axes.items():
+        boundary = None if axis._periodic else 'extend'
+        for varname in ['data_c', 'data_g']:
+            xr.testing.assert_identical(
+                new_grid.interp(ds[varname], axis_name, boundary=boundary),
+                grid.interp(ds[varname], axis_name, boundary=boundary))
+
+
+def test_spec_without_coords():
+    ds = datasets['2d_left']
+    grid = Grid(ds)
+    # only the data, without any coordinates
+    da = xr.DataArray(ds.data_c.values, dims=ds.data_c.dims, name='data_c')
+    new_grid = grid.spec.to_grid()
+    actual = new_grid.diff(da, 'X')
+    expected = grid.diff(ds.data_c, 'X')
+    assert actual.dims == expected.dims
+    assert 'XG' not in actual.coords
+    np.testing.assert_array_equal(actual.values, expected.values)
+
+    # coordinates are taken from the arrays the worker has
+    new_grid = grid.spec.to_grid([ds.data_c, ds.data_g])
+    xr.testing.assert_identical(new_grid.diff(ds.data_c, 'X'), expected)
+
+    with pytest.raises(ValueError):
+        grid.spec.to_grid(ds.isel(XC=slice(1, None)))
+
+
+def test_spec_metrics_and_faces():
+    ds, metrics = _metrics_dataset()
+    grid = Grid(ds, metrics=metrics, backend='numpy')
+    spec = GridSpec.from_json(grid.spec.to_json())
+    assert spec == grid.spec
+    assert spec.backend == 'numpy'
+    new_grid = spec.to_grid(ds)
+    xr.testing.assert_allclose(new_grid.integrate(ds.tracer, ['X', 'Y']),
+                               grid.integrate(ds.tracer, ['X', 'Y']))
+    # metrics that are not available are left out
+    assert spec.to_grid(ds.drop_vars('rA'))._metrics.keys() == \
+        set(frozenset(k) for k in metrics if k != ('X', 'Y'))
+
+    ds, _ = _face_datasets('rotated')
+    grid = Grid(ds, periodic=False, face_connections=_LAYOUTS['rotated'])
+    spec = GridSpec.from_json(grid.spec.to_json())
+    assert spec == grid.spec
+    new_grid = spec.to_grid(ds)
+    xr.testing.assert_identical(new_grid.interp(ds.c, 'Y', boundary='fill'),
+                                grid.interp(ds.c, 'Y', boundary='fill'))
+
+
+def test_grid_pickle_without_data():
+    ds = datasets['2d_left'].copy()
+    ds['big'] = (('YC', 'XC'), np.random.rand(*ds.data_c.shape))
+    ds = ds.expand_dims(time=20)
+    grid = Grid(ds, cache_bytes=2**20)
+    pickled = pickle.dumps(grid)
+    assert len(pickled) < ds.nbytes / 20
+
+    new_grid = pickle.loads(pickled)
+    _assert_same_grid(new_grid, grid)
+    assert new_grid.cache_info()['maxbytes'] == 2**20
+    xr.testing.assert_identical(new_grid.interp(ds.data_c, ['X', 'Y']),
+                                grid.interp(ds.data_c, ['X', 'Y']))
+
+
+@pytest.mark.parametrize('chunks', [None, 5])
+def test_grid_save_load(tmpdir, chunks):
+    ds, metrics = _metrics_dataset()
+    ds['XC'].attrs['units'] = 'm'
+    ds['XC'].attrs['scale'] = np.float32(2.)
+    if chunks:
+        ds = ds.chunk(chunks)
+    grid = Grid(ds, periodic=['X'], metrics=metrics)
+    path = str(tmpdir.join('grid'))
+    grid.save(path)
+
+    loaded = Grid.load(path)
+    _assert_same_grid(loaded, grid)
+    assert loaded.spec == grid.spec
+    assert loaded.axes['X'].coords['center'].attrs == {'axis': 'X',
+                                                       'units': 'm',
+                                                       'scale': 2.}
+    metric = loaded.get_metric(ds.tracer, ['X', 'Y'])
+    xr.testing.assert_allclose(metric, grid.get_metric(ds.tracer,
+                                                       ['X', 'Y']))
+    area = loaded._metrics[frozenset(['X', 'Y'])][0]
+    assert isinstance(area.variable._data, np.memmap)
+    xr.testing.assert_allclose(loaded.integrate(ds.tracer, ['X', 'Y', 'Z']),
+                               grid.integrate(ds.tracer, ['X', 'Y', 'Z']))
+    xr.testing.assert_allclose(loaded.interp(ds.u, 'X'),
+                               grid.interp(ds.u, 'X'))
+
+    # saving again replaces the store, without leaving stale arrays, and
+    # grids loaded before keep their data
+    Grid(ds).save(path)
+    assert Grid.load(path, check_dims=False)._metrics == {}
+    # only the axis coordinates are left
+    assert (len([f for f in os.listdir(path) if f.endswith('.npy')]) ==
+            len(Grid(ds)._grid_dataset().variables))
+    xr.testing.assert_allclose(loaded.get_metric(ds.tracer, ['X', 'Y']),
+                               metric)
+
+
+def test_grid_save_invalid(tmpdir):
+    ds, metrics = _metrics_dataset()
+    path = str(tmpdir.join('grid'))
+    Grid(ds).save(path)
+    files = sorted(os.listdir(path))
+
+    ds_attrs = ds.copy()
+    ds_attrs['XC'].attrs['created'] = object()
+    ds_object = ds.copy()
+    ds_object['dxC'] = ds.dxC.astype(object)
+    for ds_invalid in [ds_attrs, ds_object]:
+        grid = Grid(ds_invalid, metrics=metrics)
+        with pytest.raises(ValueError):
+            grid.save(path)
+        # the stored grid is left as it was
+        assert sorted(os.listdir(path)) == files
+        Grid.load(path)